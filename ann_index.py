@@ -0,0 +1,412 @@
+"""
+Approksimatiivinen lähimmän naapurin haku (IVF / IVF-PQ) embedding-matriisille.
+
+Tämä moduuli:
+- Klusteroi vektorit k-meansilla nlist listaan (IVF) ja tallentaa ne
+  listajärjestyksessä yhtenäisiksi lohkoiksi
+- Pakkaa vektorit valinnaisesti tuotekvantisoinnilla (PQ, residuaalit
+  listan keskipisteestä): m tavua per vektori, pisteytys hakutaulukoilla
+- Suodattaa metatiedoilla haun aikana: jokaisen läpikäydyn listan rivit
+  maskataan ennen pisteytystä, ja listoja käydään läpi kunnes k sallittua
+  ehdokasta löytyy (ei top-k:n jälkisuodatusta)
+- Hyvin valikoiva suodatin (vähän sallittuja rivejä) lasketaan tarkasti
+  suoraan sallituista riveistä
+- Tallentaa indeksin raakoina binääritiedostoina, jotka avataan numpy.memmap:lla
+
+Pisteytys on sisätulo (embeddingit ovat L2-normalisoituja -> kosini).
+Rivinumero on normalized_chunks.jsonl:n rivi (sama kuin embedding-matriisissa).
+
+Hakemiston rakenne:
+    manifest.json       - rivit, dimensio, nlist, PQ-parametrit
+    centroids.bin       - nlist x dim float32
+    list_offsets.bin    - nlist + 1 int64 (listan alku/loppu positioina)
+    list_rows.bin       - positio -> rivinumero (uint32)
+    vectors.bin         - positio -> vektori float32 (IVF-Flat)
+    codes.bin           - positio -> m tavun PQ-koodi (IVF-PQ)
+    codebooks.bin       - m x 256 x dsub float32 (IVF-PQ)
+
+Käyttö:
+    python ann_index.py [output_dir]   # rakenna normalized_chunks.ann embeddingeistä
+"""
+
+import json
+import logging
+import math
+import os
+import sys
+from array import array
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from atomic_dir import atomic_directory, resolve_directory
+from embed_chunks import EmbeddingMatrix
+from metadata_index import MetadataIndex, intersect_postings
+
+# Konfiguroi logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+_log = logging.getLogger(__name__)
+
+# Konfiguraatiovakiot
+INDEX_VERSION = 1
+DEFAULT_NPROBE = 16  # Läpikäytävien listojen määrä haussa
+KMEANS_ITERATIONS = 20
+KMEANS_TRAIN_SIZE = 100_000  # Klusterointiin käytettävä otos
+PQ_CENTROIDS = 256  # Koodikirjan koko (1 tavu per aliavaruus)
+PQ_RERANK_FACTOR = 10  # PQ-haussa tarkasti uudelleenpisteytettävät: k * tämä
+EXACT_FILTER_ROWS = 4096  # Tätä pienempi sallittu joukko lasketaan tarkasti
+
+
+def default_nlist(rows: int) -> int:
+    """Listojen oletusmäärä: ~4 * sqrt(N)."""
+    return max(1, min(rows, int(4 * math.sqrt(rows))))
+
+
+def _squared_distances(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Euklidiset etäisyydet toiseen (rivit x keskipisteet)."""
+    return (
+        np.einsum("ij,ij->i", data, data)[:, None]
+        - 2 * data @ centroids.T
+        + np.einsum("ij,ij->i", centroids, centroids)[None, :]
+    )
+
+
+def assign(data: np.ndarray, centroids: np.ndarray, batch_size: int = 16384) -> np.ndarray:
+    """Lähin keskipiste jokaiselle riville (erissä muistin säästämiseksi)."""
+    labels = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), batch_size):
+        batch = data[start:start + batch_size]
+        labels[start:start + batch_size] = _squared_distances(batch, centroids).argmin(axis=1)
+    return labels
+
+
+def kmeans(
+    data: np.ndarray,
+    k: int,
+    iterations: int = KMEANS_ITERATIONS,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Lloydin k-means (tyhjät klusterit alustetaan uudelleen satunnaisella rivillä).
+
+    Args:
+        data: Opetusdata (n x d float32)
+        k: Klustereiden määrä
+        iterations: Iteraatioiden määrä
+        seed: Satunnaislukusiemen (toistettava tulos)
+
+    Returns:
+        Keskipisteet (k x d float32)
+    """
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign(data, centroids)
+        sums = np.zeros_like(centroids, dtype=np.float64)
+        np.add.at(sums, labels, data)
+        counts = np.bincount(labels, minlength=k)
+        empty = counts == 0
+        centroids = (sums / np.maximum(counts, 1)[:, None]).astype(np.float32)
+        if empty.any():
+            centroids[empty] = data[rng.choice(len(data), size=int(empty.sum()))]
+    return centroids
+
+
+def build_ann_index(
+    vectors: np.ndarray,
+    output_dir: str | Path,
+    nlist: int | None = None,
+    pq_m: int | None = None,
+    seed: int = 0,
+    source_fingerprint: str | None = None,
+) -> dict[str, Any]:
+    """
+    Rakenna IVF- tai IVF-PQ-indeksi ja kirjoita se hakemistoon.
+
+    Args:
+        vectors: Embedding-matriisi (rivit x dim), rivi = chunkin rivinumero
+        output_dir: Indeksin hakemisto
+        nlist: Listojen määrä (oletus: ~4 * sqrt(N))
+        pq_m: PQ-aliavaruuksien määrä (None = IVF-Flat, täydet float32-vektorit);
+              dim on oltava jaollinen pq_m:llä
+        seed: Satunnaislukusiemen
+        source_fingerprint: Embedding-matriisin lähteen sormenjälki (tallennetaan manifestiin)
+
+    Returns:
+        Indeksin manifest
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    rows, dim = vectors.shape
+    if rows == 0:
+        raise ValueError("Tyhjästä matriisista ei voi rakentaa indeksiä")
+    if pq_m is not None and dim % pq_m:
+        raise ValueError(f"Dimensio {dim} ei ole jaollinen pq_m:llä {pq_m}")
+    nlist = min(nlist or default_nlist(rows), rows)
+
+    rng = np.random.default_rng(seed)
+    train = vectors
+    if rows > KMEANS_TRAIN_SIZE:
+        train = vectors[np.sort(rng.choice(rows, size=KMEANS_TRAIN_SIZE, replace=False))]
+
+    _log.info(f"Klusteroidaan {rows} vektoria {nlist} listaan...")
+    centroids = kmeans(train, nlist, seed=seed)
+    labels = assign(vectors, centroids)
+
+    # Listajärjestys: vakaa lajittelu pitää rivit kasvavassa järjestyksessä listan sisällä
+    order = np.argsort(labels, kind="stable")
+    counts = np.bincount(labels, minlength=nlist)
+    list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+    np.cumsum(counts, out=list_offsets[1:])
+
+    with atomic_directory(output_dir) as staging:
+        centroids.tofile(staging / "centroids.bin")
+        list_offsets.tofile(staging / "list_offsets.bin")
+        order.astype(np.uint32).tofile(staging / "list_rows.bin")
+
+        if pq_m is None:
+            vectors[order].tofile(staging / "vectors.bin")
+        else:
+            dsub = dim // pq_m
+            residuals = vectors[order] - centroids[labels[order]]
+            train_residuals = residuals
+            if rows > KMEANS_TRAIN_SIZE:
+                train_residuals = residuals[rng.choice(rows, size=KMEANS_TRAIN_SIZE, replace=False)]
+            n_codes = min(PQ_CENTROIDS, len(train_residuals))
+            codebooks = np.zeros((pq_m, PQ_CENTROIDS, dsub), dtype=np.float32)
+            codes = np.empty((rows, pq_m), dtype=np.uint8)
+            _log.info(f"Opetetaan PQ-koodikirjat ({pq_m} x {n_codes})...")
+            for j in range(pq_m):
+                part = slice(j * dsub, (j + 1) * dsub)
+                codebooks[j, :n_codes] = kmeans(train_residuals[:, part], n_codes, seed=seed + j)
+                codes[:, j] = assign(residuals[:, part], codebooks[j, :n_codes])
+            codebooks.tofile(staging / "codebooks.bin")
+            codes.tofile(staging / "codes.bin")
+
+        manifest = {
+            "version": INDEX_VERSION,
+            "rows": rows,
+            "source_fingerprint": source_fingerprint,
+            "dim": dim,
+            "nlist": nlist,
+            "pq_m": pq_m,
+            "metric": "inner_product",
+            "byteorder": sys.byteorder,
+        }
+        with (staging / "manifest.json").open("w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+class ANNIndex:
+    """
+    IVF/IVF-PQ-indeksi (tiedostot avataan numpy.memmap:lla).
+
+    Käyttö:
+        with EmbeddingMatrix("106PDF_output/normalized_chunks.embeddings") as matrix:
+            index = ANNIndex.load("106PDF_output/normalized_chunks.ann", metadata_index)
+            results = index.search(query_vector, k=10, organisaatio="Kaupunginhallitus",
+                                   date_from="2025-01-01")
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        metadata_index: MetadataIndex | None = None,
+        rerank_vectors: np.ndarray | None = None,
+    ) -> None:
+        self.path = resolve_directory(path)
+        self.metadata_index = metadata_index
+        with (self.path / "manifest.json").open("r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") != INDEX_VERSION:
+            raise ValueError(f"Tuntematon indeksin versio: {self.manifest.get('version')}")
+        if self.manifest["byteorder"] != sys.byteorder:
+            raise ValueError(f"Indeksi on kirjoitettu {self.manifest['byteorder']}-endian-koneella")
+
+        self.rows: int = self.manifest["rows"]
+        self.source_fingerprint: str | None = self.manifest.get("source_fingerprint")
+        self.dim: int = self.manifest["dim"]
+        self.nlist: int = self.manifest["nlist"]
+        self.pq_m: int | None = self.manifest["pq_m"]
+
+        def memmap(name: str, dtype: Any, shape: tuple[int, ...]) -> np.ndarray:
+            return np.memmap(self.path / name, dtype=dtype, mode="r", shape=shape)
+
+        self.centroids = memmap("centroids.bin", np.float32, (self.nlist, self.dim))
+        self.list_offsets = np.asarray(memmap("list_offsets.bin", np.int64, (self.nlist + 1,)))
+        self.list_rows = memmap("list_rows.bin", np.uint32, (self.rows,))
+        # Rivi -> positio (tarkkaa suodatettua hakua varten)
+        self.positions = np.empty(self.rows, dtype=np.int64)
+        self.positions[self.list_rows] = np.arange(self.rows)
+
+        if self.pq_m is None:
+            self.vectors = memmap("vectors.bin", np.float32, (self.rows, self.dim))
+        else:
+            dsub = self.dim // self.pq_m
+            self.codes = memmap("codes.bin", np.uint8, (self.rows, self.pq_m))
+            self.codebooks = memmap("codebooks.bin", np.float32, (self.pq_m, PQ_CENTROIDS, dsub))
+        # PQ-tulosten tarkka uudelleenpisteytys (rivijärjestyksessä oleva matriisi)
+        self.rerank_vectors = rerank_vectors
+
+    @classmethod
+    def load(
+        cls,
+        path: str | Path,
+        metadata_index: MetadataIndex | None = None,
+        rerank_vectors: np.ndarray | None = None,
+    ) -> "ANNIndex":
+        """
+        Lataa indeksi hakemistosta.
+
+        Args:
+            path: build_ann_index():n kirjoittama hakemisto
+            metadata_index: Metatietoindeksi suodattimia varten (valinnainen)
+            rerank_vectors: Alkuperäinen embedding-matriisi PQ-tulosten tarkkaan
+                            uudelleenpisteytykseen (valinnainen)
+
+        Returns:
+            ANNIndex
+        """
+        return cls(path, metadata_index, rerank_vectors)
+
+    def _allowed_rows(self, rows: Sequence[int] | None, filters: dict[str, Any]) -> np.ndarray | None:
+        """Yhdistä rivirajaus ja metatietosuodattimet järjestetyksi rivitaulukoksi."""
+        if filters:
+            if self.metadata_index is None:
+                raise ValueError("Metatietosuodattimet vaativat metadata_index-parametrin")
+            filtered = self.metadata_index.query(**filters)
+            rows = filtered if rows is None else intersect_postings([rows, filtered])
+        if rows is None:
+            return None
+        if isinstance(rows, (array, memoryview)) and rows.itemsize == 4:
+            return np.frombuffer(rows, dtype=np.uint32).astype(np.int64)
+        return np.asarray(rows, dtype=np.int64)
+
+    def _score_positions(self, query: np.ndarray, positions: np.ndarray, lists: np.ndarray,
+                         centroid_scores: np.ndarray, lut: np.ndarray | None) -> np.ndarray:
+        """Pisteytä positiot (tarkka sisätulo tai PQ-hakutaulukko)."""
+        if lut is None:
+            return self.vectors[positions] @ query
+        codes = self.codes[positions]
+        return centroid_scores[lists] + lut[np.arange(self.pq_m), codes].sum(axis=1)
+
+    def _finalize(self, query: np.ndarray, rows: np.ndarray, scores: np.ndarray, k: int) -> list[tuple[int, float]]:
+        """Valitse top-k (PQ: tarkka uudelleenpisteytys, jos matriisi on annettu)."""
+        if self.pq_m is not None and self.rerank_vectors is not None and len(rows) > k:
+            keep = min(len(rows), k * PQ_RERANK_FACTOR)
+            top = np.argpartition(-scores, keep - 1)[:keep]
+            rows = rows[top]
+            scores = np.asarray(self.rerank_vectors[rows], dtype=np.float32) @ query
+        if len(rows) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[top], scores[top]
+        order = np.lexsort((rows, -scores))
+        return [(int(rows[i]), float(scores[i])) for i in order]
+
+    def search(
+        self,
+        query: Sequence[float] | np.ndarray,
+        k: int = 10,
+        nprobe: int = DEFAULT_NPROBE,
+        rows: Sequence[int] | None = None,
+        **filters: Any,
+    ) -> list[tuple[int, float]]:
+        """
+        Hae k lähintä riviä (sisätulo).
+
+        Suodattimet sovelletaan listojen läpikäynnin aikana: jokaisesta listasta
+        pisteytetään vain sallitut rivit, ja listoja käydään läpi vähintään
+        nprobe kappaletta ja kunnes k sallittua ehdokasta on löytynyt.
+
+        Args:
+            query: Kyselyvektori (dim)
+            k: Palautettavien tulosten määrä
+            nprobe: Läpikäytävien listojen vähimmäismäärä
+            rows: Sallitut rivinumerot (valinnainen)
+            **filters: MetadataIndex.query()-suodattimet
+                       (organisaatio, pykala, section_type, year, month, date_from, date_to)
+
+        Returns:
+            [(rivinumero, pistemäärä)] paras ensin
+        """
+        query = np.asarray(query, dtype=np.float32)
+        allowed = self._allowed_rows(rows, filters)
+        if k <= 0 or (allowed is not None and len(allowed) == 0):
+            return []
+
+        centroid_scores = self.centroids @ query
+        lut = None
+        if self.pq_m is not None:
+            dsub = self.dim // self.pq_m
+            lut = np.einsum("mcd,md->mc", self.codebooks, query.reshape(self.pq_m, dsub))
+
+        # Valikoiva suodatin: pisteytä sallitut rivit suoraan
+        if allowed is not None and len(allowed) <= max(EXACT_FILTER_ROWS, k):
+            positions = self.positions[allowed]
+            lists = np.searchsorted(self.list_offsets, positions, side="right") - 1
+            scores = self._score_positions(query, positions, lists, centroid_scores, lut)
+            return self._finalize(query, allowed, scores, k)
+
+        mask = None
+        if allowed is not None:
+            mask = np.zeros(self.rows, dtype=bool)
+            mask[allowed] = True
+
+        candidate_positions = []
+        candidate_lists = []
+        found = 0
+        for probed, list_id in enumerate(np.argsort(-centroid_scores)):
+            if probed >= nprobe and found >= k:
+                break
+            start, end = self.list_offsets[list_id], self.list_offsets[list_id + 1]
+            positions = np.arange(start, end)
+            if mask is not None:
+                positions = positions[mask[self.list_rows[start:end]]]
+            if len(positions):
+                candidate_positions.append(positions)
+                candidate_lists.append(np.full(len(positions), list_id))
+                found += len(positions)
+
+        if not candidate_positions:
+            return []
+        positions = np.concatenate(candidate_positions)
+        lists = np.concatenate(candidate_lists)
+        scores = self._score_positions(query, positions, lists, centroid_scores, lut)
+        return self._finalize(query, self.list_rows[positions].astype(np.int64), scores, k)
+
+
+def main():
+    """Pääfunktio."""
+    if len(sys.argv) > 1:
+        base_dir = Path(sys.argv[1])
+    else:
+        default_dir = Path("106PDF_output")
+        base_dir = default_dir if default_dir.exists() else Path(os.getenv("LAPUA_RAG_OUTPUT_DIR", "."))
+
+    embeddings_dir = base_dir / "normalized_chunks.embeddings"
+    index_dir = base_dir / "normalized_chunks.ann"
+    pq_m = os.getenv("LAPUA_RAG_ANN_PQ_M")  # esim. 48 (384-dim): IVF-PQ, muuten IVF-Flat
+
+    with EmbeddingMatrix(embeddings_dir) as matrix:
+        vectors = np.frombuffer(matrix.buffer, dtype=matrix.dtype).reshape(len(matrix), matrix.dim)
+        manifest = build_ann_index(
+            vectors,
+            index_dir,
+            pq_m=int(pq_m) if pq_m else None,
+            source_fingerprint=matrix.source_fingerprint,
+        )
+        del vectors
+
+    _log.info(
+        f"✅ ANN-indeksi tallennettu: {index_dir} "
+        f"({manifest['rows']} vektoria, {manifest['nlist']} listaa, PQ: {manifest['pq_m'] or 'ei'})"
+    )
+
+
+if __name__ == "__main__":
+    main()
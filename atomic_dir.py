@@ -0,0 +1,176 @@
+"""
+Indeksihakemistojen versiointi ja atominen vaihto.
+
+Indeksit (metaindex, bm25, colstore, sections, embeddings, ann, tables)
+luetaan mmap:llä. Jos rakentaja kirjoittaisi olemassa olevan tiedoston päälle
+(open("wb") katkaisee tiedoston), käynnissä oleva hakupalvelu lukisi
+katkaistua tai puolivalmista dataa (SIGBUS tai roskaa). Windowsissa mmapattua
+tiedostoa tai sen hakemistoa ei voi edes nimetä uudelleen tai poistaa.
+
+Siksi jokainen rakennus kirjoitetaan omaan versiohakemistoonsa, ja käytössä
+oleva versio vaihdetaan korvaamalla pieni osoitintiedosto (CURRENT)
+os.replace():lla. Mmapattuja tiedostoja ei siirretä eikä kirjoiteta päälle.
+
+Hakemiston rakenne:
+    <indeksi>/CURRENT       - käytössä olevan versiohakemiston nimi
+    <indeksi>/v<aika>-<pid>/ - yksi rakennus (manifest.json + datatiedostot)
+
+Tämä moduuli:
+- Luo uuden versiohakemiston (staging_directory) ja julkaisee sen vasta
+  valmiina (publish_directory); keskeytynyt rakennus ei näy lukijoille
+- Ratkaisee lukijalle käytössä olevan version (resolve_directory); vanha
+  litteä rakenne (tiedostot suoraan hakemistossa) luetaan sellaisenaan
+- Poistaa vanhat versiot julkaisun yhteydessä: edellinen versio säilytetään
+  (KEEP_VERSIONS), jotta juuri vaihdon aikana avaava lukija ehtii avata sen.
+  Poisto on paras yritys: Windowsissa vielä mmapattu versio jää paikalleen ja
+  poistetaan seuraavassa julkaisussa, kun lukijat ovat avanneet uuden
+
+Käyttö:
+    with atomic_directory("106PDF_output/normalized_chunks.bm25") as path:
+        (path / "postings.bin").write_bytes(...)
+        (path / "manifest.json").write_text(...)
+
+    index_dir = resolve_directory("106PDF_output/normalized_chunks.bm25")
+"""
+
+import logging
+import os
+import shutil
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+_log = logging.getLogger(__name__)
+
+# Konfiguraatiovakiot
+POINTER_FILE = "CURRENT"
+VERSION_PREFIX = "v"
+KEEP_VERSIONS = 2  # Nykyinen + edellinen (lukijat, jotka avaavat vaihdon aikana)
+REPLACE_RETRIES = 20  # Windows: osoitin voi olla hetken auki lukijalla
+REPLACE_RETRY_DELAY = 0.05  # s
+
+
+def resolve_directory(path: str | Path) -> Path:
+    """
+    Palauta indeksin käytössä oleva versiohakemisto.
+
+    Args:
+        path: Indeksihakemisto (esim. normalized_chunks.bm25)
+
+    Returns:
+        Versiohakemisto, tai path itse jos osoitinta ei ole (vanha rakenne)
+    """
+    path = Path(path)
+    try:
+        name = (path / POINTER_FILE).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return path
+    return path / name
+
+
+def staging_directory(path: str | Path) -> Path:
+    """
+    Luo uusi, vielä julkaisematon versiohakemisto indeksihakemiston alle.
+
+    Args:
+        path: Indeksihakemisto
+
+    Returns:
+        Versiohakemiston polku
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    staging = path / f"{VERSION_PREFIX}{time.time_ns()}-{os.getpid()}"
+    staging.mkdir()
+    return staging
+
+
+def _replace_with_retry(source: Path, target: Path) -> None:
+    """os.replace, joka yrittää uudelleen, jos kohde on hetken auki (Windows)."""
+    for attempt in range(REPLACE_RETRIES):
+        try:
+            os.replace(source, target)
+            return
+        except PermissionError:
+            if attempt == REPLACE_RETRIES - 1:
+                raise
+            time.sleep(REPLACE_RETRY_DELAY)
+
+
+def publish_directory(path: str | Path, staging: str | Path) -> None:
+    """
+    Ota valmis versiohakemisto käyttöön ja poista vanhat versiot.
+
+    Args:
+        path: Indeksihakemisto
+        staging: staging_directory():n palauttama (valmiiksi kirjoitettu) hakemisto
+    """
+    path = Path(path)
+    staging = Path(staging)
+    pointer = path / POINTER_FILE
+    pointer_tmp = path / f"{POINTER_FILE}.tmp-{os.getpid()}"
+    pointer_tmp.write_text(staging.name, encoding="utf-8")
+    _replace_with_retry(pointer_tmp, pointer)
+    prune_versions(path)
+
+
+def discard_directory(staging: str | Path) -> None:
+    """Poista keskeneräinen (julkaisematon) versiohakemisto."""
+    shutil.rmtree(staging, ignore_errors=True)
+
+
+def prune_versions(path: str | Path, keep: int = KEEP_VERSIONS) -> None:
+    """
+    Poista vanhat versiot ja vanhan rakenteen tiedostot (paras yritys).
+
+    Käytössä oleva versio ja keep - 1 uusinta muuta versiota säilytetään.
+    Tiedostot, joita ei voi poistaa (Windows: lukija mmapannut ne), jätetään
+    seuraavaan julkaisuun.
+
+    Args:
+        path: Indeksihakemisto
+        keep: Säilytettävien versioiden määrä (vähintään 1: käytössä oleva)
+    """
+    path = Path(path)
+    current = resolve_directory(path)
+    if current == path:
+        return  # Ei julkaistua versiota
+    versions = sorted(
+        (entry for entry in path.iterdir()
+         if entry.is_dir() and entry.name.startswith(VERSION_PREFIX) and entry != current),
+        key=lambda entry: entry.name,  # v<aika_ns>-<pid>: uusin ensin
+        reverse=True,
+    )
+    stale = versions[max(keep - 1, 0):]
+    # Vanhan (litteän) rakenteen tiedostot suoraan indeksihakemistossa
+    stale += [entry for entry in path.iterdir() if entry.is_file() and entry.name != POINTER_FILE
+              and not entry.name.startswith(f"{POINTER_FILE}.tmp-")]
+    for entry in stale:
+        try:
+            if entry.is_dir():
+                shutil.rmtree(entry)
+            else:
+                entry.unlink()
+        except OSError as e:
+            _log.debug(f"Vanhaa versiota ei voitu poistaa vielä ({entry}): {e}")
+
+
+@contextmanager
+def atomic_directory(path: str | Path) -> Iterator[Path]:
+    """
+    Kirjoita indeksi uuteen versiohakemistoon ja julkaise se onnistuessa.
+
+    Args:
+        path: Indeksihakemisto
+
+    Yields:
+        Versiohakemisto, johon indeksi kirjoitetaan
+    """
+    staging = staging_directory(path)
+    try:
+        yield staging
+    except BaseException:
+        discard_directory(staging)
+        raise
+    publish_directory(path, staging)
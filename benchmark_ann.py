@@ -0,0 +1,167 @@
+"""
+ANN-indeksin benchmark: recall@10 brute force -hakua vastaan ja QPS.
+
+Tämä skripti:
+1. Lataa embeddingit ja metatietoindeksin (tai luo synteettisen datan)
+2. Rakentaa IVF-Flat- ja IVF-PQ-indeksit väliaikaiseen hakemistoon
+3. Laskee tarkat top-10-tulokset brute force -haulla
+4. Mittaa recall@10:n ja QPS:n eri nprobe-arvoilla, suodattamattomille ja
+   metatiedoilla suodatetuille kyselyille
+
+Käyttö:
+    python benchmark_ann.py [output_dir]          # oikeat embeddingit (embed_chunks.py)
+    python benchmark_ann.py --synthetic 100000    # synteettinen klusteroitu data
+"""
+
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from ann_index import ANNIndex, build_ann_index
+from embed_chunks import EmbeddingMatrix
+from metadata_index import MetadataIndex
+
+# Konfiguroi logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+_log = logging.getLogger(__name__)
+
+# Konfiguraatiovakiot
+K = 10
+QUERY_COUNT = 200
+NPROBE_VALUES = (1, 4, 16, 64)
+SYNTHETIC_DIM = 384
+SYNTHETIC_ORGS = (
+    "Kaupunginhallitus",
+    "Kaupunginvaltuusto",
+    "Sivistyslautakunta",
+    "Tekninen lautakunta",
+    "Ympäristölautakunta",
+    "Hyvinvointilautakunta",
+)
+
+
+def synthetic_dataset(rows: int, dim: int = SYNTHETIC_DIM, seed: int = 0) -> tuple[np.ndarray, MetadataIndex]:
+    """Klusteroidut normalisoidut vektorit ja satunnaiset metatiedot."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, rows // 200), dim)).astype(np.float32)
+    vectors = centers[rng.integers(len(centers), size=rows)]
+    vectors += 0.5 * rng.standard_normal((rows, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    chunks = (
+        {
+            "organisaatio": SYNTHETIC_ORGS[rng.integers(len(SYNTHETIC_ORGS))],
+            "kokous_pvm": f"{rng.integers(2019, 2026)}-{rng.integers(1, 13):02d}-{rng.integers(1, 29):02d}",
+            "pykala": f"§ {rng.integers(1, 400)}",
+            "section_type": "paatos",
+        }
+        for _ in range(rows)
+    )
+    return vectors, MetadataIndex.from_chunks(chunks)
+
+
+def exact_top_k(vectors: np.ndarray, query: np.ndarray, allowed: np.ndarray | None) -> set[int]:
+    """Brute force top-k (sisätulo), valinnaisesti sallituista riveistä."""
+    if allowed is None:
+        scores = vectors @ query
+        return set(np.argpartition(-scores, min(K, len(scores)) - 1)[:K].tolist())
+    scores = vectors[allowed] @ query
+    top = np.argpartition(-scores, min(K, len(allowed)) - 1)[:K]
+    return set(allowed[top].tolist())
+
+
+def run_queries(
+    index: ANNIndex,
+    queries: np.ndarray,
+    truth: list[set[int]],
+    nprobe: int,
+    filters: dict[str, Any],
+) -> tuple[float, float]:
+    """Palauta (recall@K, QPS)."""
+    hits = 0
+    expected = 0
+    start = time.perf_counter()
+    results = [index.search(query, k=K, nprobe=nprobe, **filters) for query in queries]
+    elapsed = time.perf_counter() - start
+    for result, true_rows in zip(results, truth):
+        hits += len({row for row, _ in result} & true_rows)
+        expected += len(true_rows)
+    return hits / max(expected, 1), len(queries) / elapsed
+
+
+def benchmark(vectors: np.ndarray, metadata_index: MetadataIndex, seed: int = 0) -> None:
+    """Aja benchmark ja tulosta tulostaulukko."""
+    rng = np.random.default_rng(seed)
+    rows, dim = vectors.shape
+    queries = vectors[rng.choice(rows, size=min(QUERY_COUNT, rows), replace=False)]
+    queries = queries + 0.1 * rng.standard_normal(queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    # Suodatettu kysely: yleisin organisaatio + kahden vuoden aikaväli
+    organisations = metadata_index.values("organisaatio")
+    organisation = max(organisations, key=lambda org: len(metadata_index.posting("organisaatio", org)))
+    years = sorted(metadata_index.values("year"))
+    filters = {"organisaatio": organisation}
+    if years:
+        filters.update(date_from=f"{years[-2] if len(years) > 1 else years[-1]}-01-01",
+                       date_to=f"{years[-1]}-12-31")
+    allowed = np.asarray(metadata_index.query(**filters), dtype=np.int64)
+
+    start = time.perf_counter()
+    truth = [exact_top_k(vectors, query, None) for query in queries]
+    brute_qps = len(queries) / (time.perf_counter() - start)
+    truth_filtered = [exact_top_k(vectors, query, allowed) for query in queries]
+
+    print(f"\nRivejä: {rows}, dimensio: {dim}, kyselyjä: {len(queries)}")
+    print(f"Suodatin: {filters} -> {len(allowed)} riviä ({len(allowed) / rows * 100:.1f}%)")
+    print(f"Brute force: {brute_qps:.0f} QPS\n")
+    print(f"{'indeksi':<10} {'nprobe':>6} {'recall@10':>10} {'QPS':>8} {'recall@10 (suod.)':>18} {'QPS (suod.)':>12}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, pq_m in (("IVF-Flat", None), ("IVF-PQ", dim // 8 if dim % 8 == 0 else None)):
+            if name == "IVF-PQ" and pq_m is None:
+                continue
+            index_dir = Path(tmp) / name
+            start = time.perf_counter()
+            build_ann_index(vectors, index_dir, pq_m=pq_m, seed=seed)
+            _log.info(f"{name} rakennettu {time.perf_counter() - start:.1f} s")
+            index = ANNIndex.load(index_dir, metadata_index, rerank_vectors=vectors)
+            for nprobe in NPROBE_VALUES:
+                recall, qps = run_queries(index, queries, truth, nprobe, {})
+                recall_f, qps_f = run_queries(index, queries, truth_filtered, nprobe, filters)
+                print(f"{name:<10} {nprobe:>6} {recall:>10.3f} {qps:>8.0f} {recall_f:>18.3f} {qps_f:>12.0f}")
+            del index
+
+
+def main():
+    """Pääfunktio."""
+    if len(sys.argv) > 2 and sys.argv[1] == "--synthetic":
+        vectors, metadata_index = synthetic_dataset(int(sys.argv[2]))
+        benchmark(vectors, metadata_index)
+        return
+
+    if len(sys.argv) > 1:
+        base_dir = Path(sys.argv[1])
+    else:
+        default_dir = Path("106PDF_output")
+        base_dir = default_dir if default_dir.exists() else Path(os.getenv("LAPUA_RAG_OUTPUT_DIR", "."))
+
+    metadata_index = MetadataIndex.load(base_dir / "normalized_chunks.metaindex")
+    with EmbeddingMatrix(base_dir / "normalized_chunks.embeddings") as matrix:
+        vectors = np.frombuffer(matrix.buffer, dtype=matrix.dtype).reshape(len(matrix), matrix.dim)
+        benchmark(np.asarray(vectors, dtype=np.float32), metadata_index)
+        del vectors
+    metadata_index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,589 @@
+"""
+BM25-avainsanahaku normalisoiduille chunkeille.
+
+Tämä moduuli:
+- Tokenisoi suomenkielisen tekstin (pykälät yhtenä tokenina: "§ 398" -> "§398",
+  kevyt taivutuspäätteiden katkaisu)
+- Rakentaa käänteisindeksin, jonka posting-listat tallennetaan levylle
+  delta-koodattuina ja lohkokohtaisella leveydellä pakattuina 128 rivin lohkoina
+- Hakee top-k tulokset MaxScore-karsinnalla: lohkojen ohitustiedot
+  (viimeinen rivi + lohkon maksimipistemäärä) mahdollistavat listojen
+  hyppimisen purkamatta jokaista lohkoa
+- Tukee metatietosuodattimia (metadata_index.MetadataIndex)
+
+Rivinumero on chunkin järjestysnumero normalized_chunks.jsonl:ssä.
+
+Hakemiston rakenne:
+    manifest.json       - rivimäärä, BM25-parametrit, keskimääräinen pituus
+    vocab.json          - termi -> [df, ensimmäinen lohko, lohkoja, idf]
+    postings.bin        - lohkot: rivien deltat ja tf:t kiinteällä 1/2/4 tavun leveydellä
+    skip_docs.bin       - lohkon viimeinen rivi (uint32)
+    skip_offsets.bin    - lohkon alku postings.bin:ssä (uint64, + loppumerkki)
+    skip_scores.bin     - lohkon maksimipistemäärä (float32)
+    doc_norms.bin       - k1 * (1 - b + b * |d| / avgdl) per rivi (float32)
+
+Käyttö:
+    python bm25_index.py [output_dir]              # rakenna indeksi
+    python bm25_index.py [output_dir] "§ 398"      # hae
+"""
+
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import sys
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from collections.abc import Sequence
+from functools import lru_cache
+from itertools import accumulate
+from pathlib import Path
+from typing import Any
+
+from atomic_dir import atomic_directory, resolve_directory
+from chunk_store import SourceFingerprint
+from jsonl_io import iter_jsonl
+from metadata_index import MetadataIndex, intersect_postings
+
+# Konfiguroi logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+_log = logging.getLogger(__name__)
+
+# Konfiguraatiovakiot
+K1 = 1.2  # BM25 termifrekvenssin saturaatio
+B = 0.75  # BM25 dokumentin pituuden normalisointi
+BLOCK_SIZE = 128  # Postingeja per lohko (ohitustietojen tarkkuus)
+INDEX_VERSION = 1
+MIN_STEM_LENGTH = 4  # Vartalon vähimmäispituus päätteen katkaisun jälkeen
+
+_EXHAUSTED = 2**32  # Loppumerkki: suurempi kuin mikään rivinumero
+
+# Pykälä ("§ 398", "§398") yhtenä tokenina, muuten sanat ja numerot
+_TOKEN_PATTERN = re.compile(r"§\s*(\d+)|\w+")
+
+# Yleisimmät sijapäätteet, pisin ensin (kevyt katkaisu, ei täysi morfologia)
+_SUFFIXES = tuple(sorted(
+    (
+        "issa", "issä", "ista", "istä", "illa", "illä", "ilta", "iltä", "ille", "iksi",
+        "ssa", "ssä", "sta", "stä", "lla", "llä", "lta", "ltä", "lle", "ksi",
+        "tta", "ttä", "den", "ien", "jen", "ita", "itä", "ja", "jä", "na", "nä",
+        "en", "in", "n", "t",
+    ),
+    key=len,
+    reverse=True,
+))
+
+
+@lru_cache(maxsize=1 << 18)
+def stem(token: str) -> str:
+    """
+    Katkaise yleisin sijapääte (esim. "talousarviossa" -> "talousarvio").
+
+    Numerot ja lyhyet sanat palautetaan sellaisenaan. Tulos välimuistitetaan
+    tokenikohtaisesti, koska sanasto on pieni verrattuna tokenien määrään.
+    """
+    if len(token) <= MIN_STEM_LENGTH or token.isdigit():
+        return token
+    for suffix in _SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= MIN_STEM_LENGTH:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text: str, use_stemming: bool = True) -> list[str]:
+    """
+    Tokenisoi teksti BM25-indeksiä varten.
+
+    Args:
+        text: Tokenisoitava teksti
+        use_stemming: Katkaise sijapäätteet (sama asetus indeksoinnissa ja haussa)
+
+    Returns:
+        Lista tokeneita (pienillä kirjaimilla, pykälät muodossa "§398")
+    """
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(text.lower()):
+        if match.group(1):
+            tokens.append(f"§{int(match.group(1))}")
+        else:
+            token = match.group(0)
+            tokens.append(stem(token) if use_stemming else token)
+    return tokens
+
+
+# Lohkon arvojen leveys tavuina -> array-typecode
+_WIDTH_TYPECODES = {1: "B", 2: "H", 4: "I"}
+
+
+def _pack_values(values: list[int]) -> tuple[int, bytes]:
+    """Pakkaa arvot pienimpään leveyteen (1, 2 tai 4 tavua), johon suurin mahtuu."""
+    largest = max(values)
+    width = 1 if largest < 1 << 8 else 2 if largest < 1 << 16 else 4
+    return width, array(_WIDTH_TYPECODES[width], values).tobytes()
+
+
+def _encode_block(docs: Sequence[int], tfs: Sequence[int], base: int) -> bytes:
+    """
+    Pakkaa lohko: [delta-leveys, tf-leveys] + rivien deltat + tf:t.
+
+    Kiinteä leveys lohkon sisällä (frame of reference tavutarkkuudella) pitää
+    pakkauksen lähellä varintia, mutta purku on yksi array-muunnos.
+    """
+    deltas = []
+    previous = base
+    for doc in docs:
+        deltas.append(doc - previous)
+        previous = doc
+    delta_width, delta_bytes = _pack_values(deltas)
+    tf_width, tf_bytes = _pack_values(list(tfs))
+    return bytes((delta_width, tf_width)) + delta_bytes + tf_bytes
+
+
+def _decode_block(data: bytes, base: int) -> tuple[list[int], list[int]]:
+    """Pura lohko -> (rivit, tf:t)."""
+    delta_width, tf_width = data[0], data[1]
+    count = (len(data) - 2) // (delta_width + tf_width)
+    split = 2 + count * delta_width
+    deltas = array(_WIDTH_TYPECODES[delta_width], data[2:split])
+    tfs = array(_WIDTH_TYPECODES[tf_width], data[split:])
+    return list(accumulate(deltas, initial=base))[1:], tfs.tolist()
+
+
+class BM25IndexBuilder:
+    """
+    Rakentaa BM25-indeksin chunk kerrallaan.
+
+    Käyttö:
+        builder = BM25IndexBuilder()
+        for chunk in iter_jsonl("normalized_chunks.jsonl"):
+            builder.add(chunk["text"])
+        builder.write("normalized_chunks.bm25")
+    """
+
+    def __init__(self, use_stemming: bool = True) -> None:
+        self.use_stemming = use_stemming
+        self._postings: dict[str, tuple[array, array]] = {}
+        self._doc_lengths = array("I")
+        self._fingerprint = SourceFingerprint()
+
+    @property
+    def rows(self) -> int:
+        return len(self._doc_lengths)
+
+    def add(self, text: str) -> None:
+        """Lisää seuraava chunk (rivinumero = lisäysjärjestys)."""
+        row = len(self._doc_lengths)
+        term_counts = Counter(tokenize(text, self.use_stemming))
+        self._doc_lengths.append(sum(term_counts.values()))
+        for term, tf in term_counts.items():
+            entry = self._postings.get(term)
+            if entry is None:
+                entry = self._postings[term] = (array("I"), array("I"))
+            entry[0].append(row)
+            entry[1].append(tf)
+        self._fingerprint.update(text)
+
+    def write(self, path: str | Path, k1: float = K1, b: float = B) -> None:
+        """
+        Kirjoita indeksi hakemistoon atomisesti (ks. atomic_dir).
+
+        Args:
+            path: Output-hakemisto
+            k1: BM25 k1-parametri
+            b: BM25 b-parametri
+        """
+        with atomic_directory(path) as staging:
+
+            rows = self.rows
+            avgdl = sum(self._doc_lengths) / rows if rows else 0.0
+            doc_norms = array("f", (
+                k1 * (1 - b + b * length / avgdl) if avgdl else k1 for length in self._doc_lengths
+            ))
+
+            vocab: dict[str, list[Any]] = {}
+            skip_docs = array("I")
+            skip_offsets = array("Q")
+            skip_scores = array("f")
+            offset = 0
+
+            with (staging / "postings.bin").open("wb") as f:
+                for term in sorted(self._postings):
+                    docs, tfs = self._postings[term]
+                    df = len(docs)
+                    idf = math.log(1 + (rows - df + 0.5) / (df + 0.5))
+                    first_block = len(skip_docs)
+                    previous = 0
+                    for start in range(0, df, BLOCK_SIZE):
+                        block_docs = docs[start:start + BLOCK_SIZE]
+                        block_tfs = tfs[start:start + BLOCK_SIZE]
+                        block = _encode_block(block_docs, block_tfs, previous)
+                        block_max = max(
+                            idf * tf * (k1 + 1) / (tf + doc_norms[doc])
+                            for doc, tf in zip(block_docs, block_tfs)
+                        )
+                        previous = block_docs[-1]
+                        f.write(block)
+                        skip_docs.append(previous)
+                        skip_offsets.append(offset)
+                        # Pyöristä ylöspäin, ettei float32 aliarvioi ylärajaa
+                        skip_scores.append(block_max * (1 + 1e-6))
+                        offset += len(block)
+                    vocab[term] = [df, first_block, len(skip_docs) - first_block, idf]
+            skip_offsets.append(offset)  # Viimeisen lohkon loppu
+
+            for name, values in (
+                ("skip_docs.bin", skip_docs),
+                ("skip_offsets.bin", skip_offsets),
+                ("skip_scores.bin", skip_scores),
+                ("doc_norms.bin", doc_norms),
+            ):
+                with (staging / name).open("wb") as f:
+                    values.tofile(f)
+
+            with (staging / "vocab.json").open("w", encoding="utf-8") as f:
+                json.dump(vocab, f, ensure_ascii=False)
+
+            manifest = {
+                "version": INDEX_VERSION,
+                "rows": rows,
+                "source_fingerprint": self._fingerprint.hexdigest(),
+                "terms": len(vocab),
+                "avgdl": avgdl,
+                "k1": k1,
+                "b": b,
+                "block_size": BLOCK_SIZE,
+                "use_stemming": self.use_stemming,
+                "byteorder": sys.byteorder,
+            }
+            with (staging / "manifest.json").open("w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+class _PostingCursor:
+    """Yhden termin posting-listan kursori (purkaa lohkon kerrallaan)."""
+
+    __slots__ = (
+        "index", "query_tf", "scale", "max_score",
+        "first", "end", "block", "docs", "tfs", "pos", "doc",
+    )
+
+    def __init__(self, index: "BM25Index", entry: list[Any], query_tf: int) -> None:
+        _, first_block, n_blocks, idf = entry
+        self.index = index
+        self.query_tf = query_tf
+        self.scale = idf * query_tf * (index.k1 + 1)
+        self.first = first_block
+        self.end = first_block + n_blocks
+        block_scores = index.skip_scores[first_block:self.end]
+        self.max_score = max(block_scores) * query_tf
+        self._load(first_block)
+
+    def _load(self, block: int) -> None:
+        self.block = block
+        base = self.index.skip_docs[block - 1] if block > self.first else 0
+        self.docs, self.tfs = self.index._read_block(block, base)
+        self.pos = 0
+        self.doc = self.docs[0]
+
+    def next(self) -> None:
+        """Siirry seuraavaan riviin."""
+        self.pos += 1
+        if self.pos < len(self.docs):
+            self.doc = self.docs[self.pos]
+        elif self.block + 1 < self.end:
+            self._load(self.block + 1)
+        else:
+            self.doc = _EXHAUSTED
+
+    def next_geq(self, target: int) -> None:
+        """Siirry ensimmäiseen riviin >= target (ohittaa kokonaisia lohkoja)."""
+        if target <= self.doc:
+            return
+        skip_docs = self.index.skip_docs
+        if skip_docs[self.block] < target:
+            block = bisect_left(skip_docs, target, self.block + 1, self.end)
+            if block == self.end:
+                self.doc = _EXHAUSTED
+                return
+            self._load(block)
+        self.pos = bisect_left(self.docs, target, self.pos)
+        self.doc = self.docs[self.pos]
+
+    def block_bound(self, target: int) -> tuple[float, int]:
+        """
+        Yläraja lohkolle, joka sisältäisi rivin target (purkamatta lohkoa).
+
+        Returns:
+            (lohkon maksimipistemäärä, lohkon viimeinen rivi); (0, _EXHAUSTED)
+            jos listassa ei ole rivejä >= target
+        """
+        block = bisect_left(self.index.skip_docs, target, self.block, self.end)
+        if block == self.end:
+            return 0.0, _EXHAUSTED
+        return self.index.skip_scores[block] * self.query_tf, self.index.skip_docs[block]
+
+    def score(self) -> float:
+        """BM25-pistemäärä nykyiselle riville."""
+        tf = self.tfs[self.pos]
+        return self.scale * tf / (tf + self.index.doc_norms[self.doc])
+
+
+class BM25Index:
+    """
+    Levyltä luettava BM25-indeksi (binääritiedostot mapataan muistiin).
+
+    Käyttö:
+        with BM25Index.load("106PDF_output/normalized_chunks.bm25") as index:
+            for row, score in index.search("Virkiä superpesis", k=10, year=2025):
+                ...
+    """
+
+    def __init__(self, path: str | Path, metadata_index: MetadataIndex | None = None) -> None:
+        self.path = resolve_directory(path)
+        self.metadata_index = metadata_index
+        with (self.path / "manifest.json").open("r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") != INDEX_VERSION:
+            raise ValueError(f"Tuntematon indeksin versio: {self.manifest.get('version')}")
+        if self.manifest["byteorder"] != sys.byteorder:
+            raise ValueError(f"Indeksi on kirjoitettu {self.manifest['byteorder']}-endian-koneella")
+        with (self.path / "vocab.json").open("r", encoding="utf-8") as f:
+            self.vocab: dict[str, list[Any]] = json.load(f)
+
+        self.rows: int = self.manifest["rows"]
+        self.source_fingerprint: str | None = self.manifest.get("source_fingerprint")
+        self.k1: float = self.manifest["k1"]
+        self.use_stemming: bool = self.manifest["use_stemming"]
+        self._mmaps: list[mmap.mmap] = []
+        self._views: list[memoryview] = []
+        self.postings = self._map("postings.bin", "B")
+        self.skip_docs = self._map("skip_docs.bin", "I")
+        self.skip_offsets = self._map("skip_offsets.bin", "Q")
+        self.skip_scores = self._map("skip_scores.bin", "f")
+        self.doc_norms = self._map("doc_norms.bin", "f")
+
+    @classmethod
+    def load(cls, path: str | Path, metadata_index: MetadataIndex | None = None) -> "BM25Index":
+        """
+        Lataa indeksi hakemistosta.
+
+        Args:
+            path: BM25IndexBuilder.write():n kirjoittama hakemisto
+            metadata_index: Metatietoindeksi suodattimia varten (valinnainen)
+
+        Returns:
+            BM25Index
+        """
+        return cls(path, metadata_index)
+
+    def _map(self, filename: str, typecode: str) -> memoryview:
+        """Mappaa tiedosto vain luku -tilassa (tyhjä tiedosto -> tyhjä näkymä)."""
+        with (self.path / filename).open("rb") as f:
+            if f.seek(0, 2) == 0:
+                return memoryview(array(typecode))
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mmaps.append(mapped)
+        view = memoryview(mapped).cast(typecode)
+        self._views.append(view)
+        return view
+
+    def _read_block(self, block: int, base: int) -> tuple[list[int], list[int]]:
+        """Lue ja pura yksi posting-lohko."""
+        start, end = self.skip_offsets[block], self.skip_offsets[block + 1]
+        return _decode_block(self.postings[start:end].tobytes(), base)
+
+    def search(
+        self,
+        query: str,
+        k: int = 10,
+        rows: Sequence[int] | None = None,
+        **filters: Any,
+    ) -> list[tuple[int, float]]:
+        """
+        Hae kyselyn k parasta riviä BM25-pisteillä (MaxScore-karsinta).
+
+        Args:
+            query: Hakulause (esim. "§ 398 Virkiä")
+            k: Palautettavien tulosten määrä
+            rows: Sallitut rivinumerot järjestettynä (valinnainen)
+            **filters: MetadataIndex.query()-suodattimet
+                       (organisaatio, pykala, section_type, year, month, date_from, date_to)
+
+        Returns:
+            [(rivinumero, pistemäärä)] paras ensin
+        """
+        if filters:
+            if self.metadata_index is None:
+                raise ValueError("Metatietosuodattimet vaativat metadata_index-parametrin")
+            filtered = self.metadata_index.query(**filters)
+            rows = filtered if rows is None else intersect_postings([rows, filtered])
+        if k <= 0 or (rows is not None and not len(rows)):
+            return []
+
+        query_terms = Counter(tokenize(query, self.use_stemming))
+        cursors = [
+            _PostingCursor(self, self.vocab[term], query_tf)
+            for term, query_tf in query_terms.items()
+            if term in self.vocab
+        ]
+        if not cursors:
+            return []
+
+        # MaxScore: lista on "ei-välttämätön", jos sen ja pienempien listojen
+        # ylärajojen summa ei riitä top-k:hon. Ehdokkaat tulevat vain
+        # välttämättömistä listoista, muita haetaan hyppimällä (next_geq).
+        cursors.sort(key=lambda c: c.max_score)
+        upper_bounds = []
+        total = 0.0
+        for cursor in cursors:
+            total += cursor.max_score
+            upper_bounds.append(total)
+
+        heap: list[tuple[float, int]] = []
+        threshold = 0.0
+        first_essential = 0
+        essential = cursors
+        doc_norms = self.doc_norms
+        range_end = -1
+        range_bound = 0.0
+
+        while True:
+            doc = min([cursor.doc for cursor in essential])
+            if doc == _EXHAUSTED:
+                break
+
+            if rows is not None:
+                pos = bisect_left(rows, doc)
+                if pos == len(rows):
+                    break
+                if rows[pos] != doc:
+                    for cursor in essential:
+                        cursor.next_geq(rows[pos])
+                    continue
+
+            if len(heap) == k:
+                # Block-max: välillä [doc, range_end] jokainen lista pysyy samassa
+                # lohkossa, joten lohkojen maksimien summa on koko välin yläraja.
+                # Jos se ei riitä top-k:hon, hypätään koko väli yli.
+                if doc > range_end:
+                    range_bound = 0.0
+                    range_end = _EXHAUSTED
+                    for cursor in cursors:
+                        block_score, last_doc = cursor.block_bound(doc)
+                        range_bound += block_score
+                        range_end = min(range_end, last_doc)
+                if range_bound <= threshold:
+                    if range_end == _EXHAUSTED:
+                        break
+                    for cursor in essential:
+                        cursor.next_geq(range_end + 1)
+                    continue
+
+            score = 0.0
+            for cursor in essential:
+                if cursor.doc == doc:
+                    tf = cursor.tfs[cursor.pos]
+                    score += cursor.scale * tf / (tf + doc_norms[doc])
+                    cursor.next()
+            for i in range(first_essential - 1, -1, -1):
+                if score + upper_bounds[i] <= threshold:
+                    break
+                cursor = cursors[i]
+                cursor.next_geq(doc)
+                if cursor.doc == doc:
+                    score += cursor.score()
+
+            # Tasapisteissä pienempi rivinumero voittaa
+            if len(heap) < k:
+                heapq.heappush(heap, (score, -doc))
+            elif score > heap[0][0]:
+                heapq.heapreplace(heap, (score, -doc))
+            else:
+                continue
+
+            if len(heap) == k:
+                threshold = heap[0][0]
+                while first_essential < len(cursors) and upper_bounds[first_essential] <= threshold:
+                    first_essential += 1
+                if first_essential == len(cursors):
+                    break
+                essential = cursors[first_essential:]
+
+        return [(-neg_doc, score) for score, neg_doc in sorted(heap, key=lambda x: (-x[0], -x[1]))]
+
+    def close(self) -> None:
+        """Vapauta näkymät ja sulje mmapit."""
+        for view in self._views:
+            view.release()
+        self._views = []
+        for mapped in self._mmaps:
+            mapped.close()
+        self._mmaps = []
+
+    def __enter__(self) -> "BM25Index":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def build_bm25_index(input_jsonl: str | Path, output_dir: str | Path) -> int:
+    """
+    Rakenna BM25-indeksi normalized_chunks.jsonl:stä.
+
+    Args:
+        input_jsonl: Polku normalized_chunks.jsonl-tiedostoon
+        output_dir: Indeksin hakemisto
+
+    Returns:
+        Indeksoitujen chunkkien määrä
+    """
+    builder = BM25IndexBuilder()
+    for chunk in iter_jsonl(input_jsonl):
+        builder.add(chunk.get("text", ""))
+    builder.write(output_dir)
+    return builder.rows
+
+
+def main():
+    """Pääfunktio."""
+    if len(sys.argv) > 1:
+        base_dir = Path(sys.argv[1])
+    else:
+        default_dir = Path("106PDF_output")
+        base_dir = default_dir if default_dir.exists() else Path(os.getenv("LAPUA_RAG_OUTPUT_DIR", "."))
+
+    input_jsonl = base_dir / "normalized_chunks.jsonl"
+    index_dir = base_dir / "normalized_chunks.bm25"
+    metadata_index_dir = base_dir / "normalized_chunks.metaindex"
+
+    if len(sys.argv) <= 2:
+        _log.info(f"Rakennetaan BM25-indeksi: {input_jsonl}")
+        rows = build_bm25_index(input_jsonl, index_dir)
+        _log.info(f"✅ BM25-indeksi tallennettu: {index_dir} ({rows} chunkkia)")
+        return
+
+    query = sys.argv[2]
+    metadata_index = MetadataIndex.load(metadata_index_dir) if metadata_index_dir.exists() else None
+    with BM25Index.load(index_dir, metadata_index) as index:
+        results = index.search(query, k=10)
+    if metadata_index:
+        metadata_index.close()
+
+    wanted = {row for row, _ in results}
+    chunks = {row: chunk for row, chunk in enumerate(iter_jsonl(input_jsonl)) if row in wanted}
+    for row, score in results:
+        chunk = chunks[row]
+        print(f"{score:.3f}  {chunk.get('organisaatio')} {chunk.get('kokous_pvm')} "
+              f"{chunk.get('pykala')}: {chunk.get('text', '')[:120]}")
+
+
+if __name__ == "__main__":
+    main()
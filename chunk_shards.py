@@ -0,0 +1,344 @@
+"""
+Normalisoitujen chunkkien jako shardeihin rinnakkaista jatkokäsittelyä varten.
+
+Tämä moduuli:
+- Kirjoittaa chunkit shardeihin samalla virralla kuin normalized_chunks.jsonl
+  (chunk kerrallaan, yksi avoin tiedosto per shardi)
+- Jakaa chunkit joko dokumentin hashilla (source_file, SHA1 mod shardien määrä;
+  dokumentin chunkit ja pykälät pysyvät samassa shardissa) tai organisaation ja
+  kokousvuoden mukaan
+- Tallentaa jokaiselle shardille globaalit rivinumerot, joten shardikohtaiset
+  tulokset (embeddingit, indeksit, validointi) yhdistetään takaisin
+  normalized_chunks.jsonl:n järjestykseen deterministisesti
+- Kirjoittaa manifestin: shardien koot, id- ja rivivälit sekä SHA256-tarkisteet
+
+Jako on deterministinen: sama syöte tuottaa samat shardit ja samat tiedostot
+tavu tavulta (chunkit ovat shardissa globaalissa järjestyksessä).
+
+Hakemiston rakenne (käytössä oleva versiohakemisto, ks. atomic_dir):
+    manifest.json   - jako, shardit nimen mukaan järjestettynä (kirjoitetaan viimeisenä)
+    <shardi>.jsonl  - shardin chunkit (sama muoto kuin normalized_chunks.jsonl)
+    <shardi>.rows   - shardin rivien globaalit rivinumerot (uint32, nouseva)
+
+Shardit kirjoitetaan uuteen versiohakemistoon, joka julkaistaan vasta
+close():ssa; keskeytynyt ajo ei kirjoita manifestia eikä korvaa edellisiä
+shardeja.
+
+Käyttö:
+    python chunk_shards.py 106PDF_output            # shardien yhteenveto
+    python chunk_shards.py 106PDF_output --verify   # tarkista koot ja tarkisteet
+
+    manifest = load_manifest("106PDF_output/normalized_chunks.shards")
+    for shard in manifest["shards"]:            # esim. yksi työ per shardi
+        chunks = iter_shard_chunks("106PDF_output/normalized_chunks.shards", shard["name"])
+"""
+
+import hashlib
+import heapq
+import json
+import logging
+import os
+import re
+import sys
+from array import array
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Any, BinaryIO, TextIO
+
+from atomic_dir import discard_directory, publish_directory, resolve_directory, staging_directory
+from jsonl_io import iter_jsonl
+
+# Konfiguroi logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+_log = logging.getLogger(__name__)
+
+# Konfiguraatiovakiot
+SHARDS_VERSION = 1
+PARTITIONS = ("hash", "organisaatio_year")
+DEFAULT_SHARDS = 16
+UNKNOWN_PARTITION = "tuntematon"
+
+_UNSAFE_NAME_PATTERN = re.compile(r"[^\w-]+")
+
+
+def shard_name(chunk: dict[str, Any], partition: str = "hash", num_shards: int = DEFAULT_SHARDS) -> str:
+    """
+    Päättele chunkin shardi.
+
+    Hash-jaossa avaimena on source_file (SHA1, ei Pythonin hash(), joka
+    vaihtelee ajosta toiseen), joten dokumentti ei jakaudu shardeille.
+
+    Args:
+        chunk: Normalisoitu chunk
+        partition: "hash" tai "organisaatio_year"
+        num_shards: Shardien määrä hash-jaossa
+
+    Returns:
+        Shardin nimi (esim. "shard-00003" tai "Kaupunginhallitus-2025")
+    """
+    if partition == "hash":
+        digest = hashlib.sha1((chunk.get("source_file") or "").encode("utf-8")).digest()
+        return f"shard-{int.from_bytes(digest[:8], 'big') % num_shards:05d}"
+    organisaatio = chunk.get("organisaatio") or UNKNOWN_PARTITION
+    year = (chunk.get("kokous_pvm") or "")[:4] or UNKNOWN_PARTITION
+    return f"{_UNSAFE_NAME_PATTERN.sub('_', organisaatio).strip('_')}-{year}"
+
+
+class _Shard:
+    """Yhden shardin avoimet tiedostot ja manifestin tiedot."""
+
+    def __init__(self, path: Path, name: str) -> None:
+        self.name = name
+        self.jsonl: TextIO = (path / f"{name}.jsonl").open("w", encoding="utf-8", newline="\n")
+        self.rows_file: BinaryIO = (path / f"{name}.rows").open("wb")
+        self.sha256 = hashlib.sha256()
+        self.chunks = 0
+        self.bytes = 0
+        self.first_id: str | None = None
+        self.last_id: str | None = None
+        self.first_row: int | None = None
+        self.last_row: int | None = None
+
+    def entry(self) -> dict[str, Any]:
+        """Shardin rivi manifestiin."""
+        return {
+            "name": self.name,
+            "file": f"{self.name}.jsonl",
+            "rows_file": f"{self.name}.rows",
+            "chunks": self.chunks,
+            "bytes": self.bytes,
+            "sha256": self.sha256.hexdigest(),
+            "first_id": self.first_id,
+            "last_id": self.last_id,
+            "first_row": self.first_row,
+            "last_row": self.last_row,
+        }
+
+
+class ShardedChunkWriter:
+    """
+    Kirjoittaa normalisoidut chunkit shardeihin chunk kerrallaan.
+
+    Muistissa pidetään vain shardien avoimet tiedostot ja laskurit.
+    Virhetilanteessa (poikkeus with-lohkossa) keskeneräiset shardit
+    poistetaan ja edelliset säilyvät, kuten ColumnarChunkWriterissa.
+
+    Käyttö:
+        with ShardedChunkWriter("106PDF_output/normalized_chunks.shards", "hash", 16) as writer:
+            for chunk in chunks:
+                writer.append(chunk)
+    """
+
+    def __init__(self, path: str | Path, partition: str = "hash", num_shards: int = DEFAULT_SHARDS) -> None:
+        if partition not in PARTITIONS:
+            raise ValueError(f"Tuntematon jako: {partition} (tuetut: {', '.join(PARTITIONS)})")
+        if num_shards < 1:
+            raise ValueError(f"Shardien määrän pitää olla vähintään 1: {num_shards}")
+        self.path = Path(path)
+        self.partition = partition
+        self.num_shards = num_shards
+        self.rows = 0
+        self._shards: dict[str, _Shard] = {}
+        self._staging = staging_directory(self.path)
+
+    def append(self, chunk: dict[str, Any], line: str | None = None) -> None:
+        """
+        Lisää seuraava chunk (globaali rivinumero = lisäysjärjestys).
+
+        Args:
+            chunk: Normalisoitu chunk
+            line: Valmiiksi serialisoitu JSONL-rivi (ei serialisoida uudelleen)
+        """
+        name = shard_name(chunk, self.partition, self.num_shards)
+        shard = self._shards.get(name)
+        if shard is None:
+            shard = self._shards[name] = _Shard(self._staging, name)
+        if line is None:
+            line = json.dumps(chunk, ensure_ascii=False) + "\n"
+
+        data = line.encode("utf-8")
+        shard.jsonl.write(line)
+        shard.sha256.update(data)
+        shard.bytes += len(data)
+        shard.rows_file.write(array("I", [self.rows]).tobytes())
+        if shard.chunks == 0:
+            shard.first_id = chunk.get("id")
+            shard.first_row = self.rows
+        shard.last_id = chunk.get("id")
+        shard.last_row = self.rows
+        shard.chunks += 1
+        self.rows += 1
+
+    def _close_files(self) -> None:
+        for shard in self._shards.values():
+            shard.jsonl.close()
+            shard.rows_file.close()
+
+    def close(self) -> None:
+        """Sulje shardit, kirjoita manifest.json (viimeisenä) ja julkaise shardit."""
+        self._close_files()
+
+        manifest = {
+            "version": SHARDS_VERSION,
+            "partition": self.partition,
+            "num_shards": self.num_shards if self.partition == "hash" else len(self._shards),
+            "rows": self.rows,
+            "byteorder": sys.byteorder,
+            "shards": [self._shards[name].entry() for name in sorted(self._shards)],
+        }
+        with (self._staging / "manifest.json").open("w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        publish_directory(self.path, self._staging)
+
+    def discard(self) -> None:
+        """Sulje shardit ja poista keskeneräinen kirjoitus (edelliset shardit säilyvät)."""
+        self._close_files()
+        discard_directory(self._staging)
+
+    def __enter__(self) -> "ShardedChunkWriter":
+        return self
+
+    def __exit__(self, exc_type: Any, *exc_info: Any) -> None:
+        if exc_type is not None:
+            self.discard()
+        else:
+            self.close()
+
+
+def load_manifest(path: str | Path) -> dict[str, Any]:
+    """
+    Lue shardihakemiston manifest.
+
+    Args:
+        path: ShardedChunkWriterin kirjoittama hakemisto
+
+    Returns:
+        Manifest (partition, rows, shards)
+    """
+    with (resolve_directory(path) / "manifest.json").open("r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != SHARDS_VERSION:
+        raise ValueError(f"Tuntematon shardien versio: {manifest.get('version')}")
+    return manifest
+
+
+def iter_shard_chunks(path: str | Path, name: str) -> Iterator[dict[str, Any]]:
+    """Iteroi shardin chunkit."""
+    return iter_jsonl(resolve_directory(path) / f"{name}.jsonl")
+
+
+def read_shard_rows(path: str | Path, name: str) -> array:
+    """
+    Lue shardin rivien globaalit rivinumerot.
+
+    Args:
+        path: Shardihakemisto
+        name: Shardin nimi
+
+    Returns:
+        array("I"): shardin i:nnen chunkin rivi normalized_chunks.jsonl:ssä
+    """
+    manifest = load_manifest(path)
+    if manifest["byteorder"] != sys.byteorder:
+        raise ValueError(f"Shardit on kirjoitettu {manifest['byteorder']}-endian-koneella")
+    rows = array("I")
+    rows.frombytes((resolve_directory(path) / f"{name}.rows").read_bytes())
+    return rows
+
+
+def merge_shard_results(path: str | Path, results: dict[str, Iterable[Any]]) -> Iterator[tuple[int, Any]]:
+    """
+    Yhdistä shardikohtaiset tulokset globaaliin rivijärjestykseen.
+
+    Shardien rivinumerot ovat nousevia, joten yhdistäminen on k-tie-merge
+    ilman lajittelua; tulos ei riipu siitä, missä järjestyksessä shardit
+    valmistuivat.
+
+    Args:
+        path: Shardihakemisto
+        results: Shardin nimi -> tulokset shardin chunkkien järjestyksessä
+                 (esim. embeddingit tai validoinnin tulokset)
+
+    Yields:
+        (globaali rivi, tulos) nousevassa rivijärjestyksessä
+    """
+    streams = [zip(read_shard_rows(path, name), shard_results) for name, shard_results in sorted(results.items())]
+    yield from heapq.merge(*streams, key=lambda item: item[0])
+
+
+def verify_shards(path: str | Path) -> list[str]:
+    """
+    Tarkista shardien koot, chunkkimäärät ja SHA256-tarkisteet manifestia vasten.
+
+    Args:
+        path: Shardihakemisto
+
+    Returns:
+        Virheelliset shardit (tyhjä lista = kaikki kunnossa)
+    """
+    path = resolve_directory(path)
+    manifest = load_manifest(path)
+    invalid = []
+    total = 0
+    for shard in manifest["shards"]:
+        shard_path = path / shard["file"]
+        rows_path = path / shard["rows_file"]
+        if not shard_path.exists() or not rows_path.exists():
+            _log.warning(f"Shardi puuttuu: {shard['name']}")
+            invalid.append(shard["name"])
+            continue
+        digest = hashlib.sha256()
+        lines = 0
+        with shard_path.open("rb") as f:
+            for line in f:
+                digest.update(line)
+                lines += 1
+        if (
+            digest.hexdigest() != shard["sha256"]
+            or lines != shard["chunks"]
+            or shard_path.stat().st_size != shard["bytes"]
+            or rows_path.stat().st_size != 4 * shard["chunks"]
+        ):
+            _log.warning(f"Shardi ei vastaa manifestia: {shard['name']}")
+            invalid.append(shard["name"])
+        total += shard["chunks"]
+    if total != manifest["rows"] and not invalid:
+        _log.warning(f"Shardien chunkit ({total}) != manifestin rivit ({manifest['rows']})")
+        invalid.append("manifest")
+    return invalid
+
+
+def main():
+    """Pääfunktio."""
+    if len(sys.argv) > 1:
+        base_dir = Path(sys.argv[1])
+    else:
+        default_dir = Path("106PDF_output")
+        base_dir = default_dir if default_dir.exists() else Path(os.getenv("LAPUA_RAG_OUTPUT_DIR", "."))
+
+    shards_dir = base_dir / "normalized_chunks.shards"
+    if not (resolve_directory(shards_dir) / "manifest.json").exists():
+        _log.error(f"Shardeja ei löydy: {shards_dir} (aja postprocess_docling_chunks.py "
+                   f"LAPUA_RAG_SHARD_BY=hash)")
+        sys.exit(1)
+
+    manifest = load_manifest(shards_dir)
+    if len(sys.argv) > 2 and sys.argv[2] == "--verify":
+        invalid = verify_shards(shards_dir)
+        if invalid:
+            _log.error(f"❌ Virheellisiä shardeja: {', '.join(invalid)}")
+            sys.exit(1)
+        _log.info(f"✅ {len(manifest['shards'])} shardia kunnossa ({manifest['rows']} chunkkia)")
+        return
+
+    print(f"Jako: {manifest['partition']}, {len(manifest['shards'])} shardia, {manifest['rows']} chunkkia")
+    for shard in manifest["shards"]:
+        print(f"  {shard['name']:<40} {shard['chunks']:>8} chunkkia  {shard['bytes'] / 1024 / 1024:8.1f} MB  "
+              f"rivit {shard['first_row']}-{shard['last_row']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+"""
+Kompakti sarakepohjainen tallennusmuoto normalisoiduille chunkeille.
+
+Tämä moduuli:
+- Kirjoittaa normalisoidut chunkit sarakkeittain (chunk kerrallaan, vakiomuisti)
+- Sanakirjakoodaa toistuvat merkkijonot (organisaatio, source_file, pykälä, section_type)
+- Tallentaa päivämäärät int32-muodossa (YYYYMMDD, 0 = ei päivämäärää)
+- Tallentaa tekstit yhteen yhtenäiseen puskuriin offset-taulukon kanssa
+- Lukee tallenteen mmap:llä: avaus vie millisekunteja ja sarakkeet luetaan
+  suoraan sivuvälimuistista ilman JSON-parsintaa
+
+Hakemiston rakenne:
+    manifest.json       - rivimäärä, lähteen sormenjälki, sarakkeet ja sanakirjat
+    <sarake>.bin        - kiinteän leveyden sarakkeet (array-typecode manifestissa)
+    <sarake>.data       - merkkijonosarakkeiden UTF-8-tavut peräkkäin
+    <sarake>.offsets    - merkkijonosarakkeiden int64-offsetit (rows + 1 kpl)
+
+Sarakkeet ovat natiivissa tavujärjestyksessä (manifestissa "byteorder"), joten
+ne voi lukea myös numpyllä ilman kopiointia:
+    numpy.frombuffer(store.column("kokous_pvm"), dtype=numpy.int32)
+"""
+
+import hashlib
+import json
+import mmap
+import sys
+from array import array
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any, BinaryIO
+
+from atomic_dir import discard_directory, publish_directory, resolve_directory, staging_directory
+
+STORE_VERSION = 1
+
+# Sanakirjakoodatut sarakkeet: int32-koodi per rivi, -1 = None
+DICTIONARY_COLUMNS = ("organisaatio", "source_file", "pykala", "section_type")
+
+# Kiinteän leveyden kokonaislukusarakkeet: sarake -> array-typecode
+INT_COLUMNS = {
+    "kokous_pvm": "i",  # YYYYMMDD, 0 = None
+    "chunk_index": "i",
+    "total_chunks": "i",
+    "is_table": "B",
+}
+
+# Vaihtelevan pituiset merkkijonosarakkeet (UTF-8-puskuri + offsetit)
+STRING_COLUMNS = ("id", "text")
+
+# SHA1-hash tallennetaan 20 tavuna per rivi
+HASH_BYTES = 20
+
+# Chunk-skeeman kenttäjärjestys (sama kuin normalized_chunks.jsonl)
+FIELD_ORDER = (
+    "id",
+    "text",
+    "source_file",
+    "organisaatio",
+    "kokous_pvm",
+    "pykala",
+    "chunk_index",
+    "total_chunks",
+    "section_type",
+    "is_table",
+    "hash",
+)
+
+
+class SourceFingerprint:
+    """
+    Laskee chunk-aineiston sormenjäljen rivien teksteistä rivijärjestyksessä.
+
+    Jokainen indeksi tallentaa sormenjäljen ja rivimäärän manifestiinsa
+    ("source_fingerprint", "rows"), jotta hakija voi todeta indeksien olevan
+    rakennettu samasta normalized_chunks.jsonl:stä (rivi = sama chunk).
+    Tekstit hashataan sellaisenaan (ei normalisointia), pituus etuliitteenä.
+
+    Käyttö:
+        fingerprint = SourceFingerprint()
+        for chunk in chunks:
+            fingerprint.update(chunk.get("text", ""))
+        manifest["source_fingerprint"] = fingerprint.hexdigest()
+    """
+
+    def __init__(self) -> None:
+        self._digest = hashlib.sha1()
+
+    def update(self, text: str) -> None:
+        """Lisää seuraavan rivin teksti."""
+        data = text.encode("utf-8")
+        self._digest.update(len(data).to_bytes(8, "little"))
+        self._digest.update(data)
+
+    def hexdigest(self) -> str:
+        """Palauta sormenjälki hex-muodossa."""
+        return self._digest.hexdigest()
+
+
+def encode_date(date_str: str | None) -> int:
+    """Muunna "YYYY-MM-DD" kokonaisluvuksi YYYYMMDD (None -> 0)."""
+    if not date_str:
+        return 0
+    year, month, day = date_str.split("-")
+    return int(year) * 10000 + int(month) * 100 + int(day)
+
+
+def decode_date(value: int) -> str | None:
+    """Muunna YYYYMMDD takaisin muotoon "YYYY-MM-DD" (0 -> None)."""
+    if not value:
+        return None
+    return f"{value // 10000:04d}-{value // 100 % 100:02d}-{value % 100:02d}"
+
+
+class ColumnarChunkWriter:
+    """
+    Kirjoittaa normalisoidut chunkit sarakepohjaiseen hakemistoon chunk kerrallaan.
+
+    Muistissa pidetään vain sanakirjat (uniikit organisaatiot, polut, pykälät).
+    Sarakkeet kirjoitetaan uuteen versiohakemistoon, joka julkaistaan
+    close():ssa (ks. atomic_dir); virhetilanteessa vanha tallenne säilyy.
+
+    Käyttö:
+        with ColumnarChunkWriter("106PDF_output/normalized_chunks.colstore") as writer:
+            for chunk in chunks:
+                writer.append(chunk)
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self._staging = staging_directory(self.path)
+        self.rows = 0
+        self._dictionaries: dict[str, dict[str, int]] = {name: {} for name in DICTIONARY_COLUMNS}
+        self._files: dict[str, BinaryIO] = {}
+        self._string_sizes = {name: 0 for name in STRING_COLUMNS}
+        self._fingerprint = SourceFingerprint()
+
+        for name in DICTIONARY_COLUMNS + tuple(INT_COLUMNS):
+            self._files[name] = (self._staging / f"{name}.bin").open("wb")
+        self._files["hash"] = (self._staging / "hash.bin").open("wb")
+        for name in STRING_COLUMNS:
+            self._files[f"{name}.data"] = (self._staging / f"{name}.data").open("wb")
+            self._files[f"{name}.offsets"] = (self._staging / f"{name}.offsets").open("wb")
+            self._files[f"{name}.offsets"].write(array("q", [0]).tobytes())
+
+    def append(self, chunk: dict[str, Any]) -> None:
+        """Lisää yksi normalisoitu chunk."""
+        for name in DICTIONARY_COLUMNS:
+            value = chunk.get(name)
+            if value is None:
+                code = -1
+            else:
+                dictionary = self._dictionaries[name]
+                code = dictionary.setdefault(value, len(dictionary))
+            self._files[name].write(array("i", [code]).tobytes())
+
+        int_values = {
+            "kokous_pvm": encode_date(chunk.get("kokous_pvm")),
+            "chunk_index": chunk.get("chunk_index", 0),
+            "total_chunks": chunk.get("total_chunks", 0),
+            "is_table": 1 if chunk.get("is_table") else 0,
+        }
+        for name, typecode in INT_COLUMNS.items():
+            self._files[name].write(array(typecode, [int_values[name]]).tobytes())
+
+        self._files["hash"].write(bytes.fromhex(chunk["hash"]))
+
+        for name in STRING_COLUMNS:
+            data = (chunk.get(name) or "").encode("utf-8")
+            self._files[f"{name}.data"].write(data)
+            self._string_sizes[name] += len(data)
+            self._files[f"{name}.offsets"].write(array("q", [self._string_sizes[name]]).tobytes())
+
+        self._fingerprint.update(chunk.get("text") or "")
+        self.rows += 1
+
+    def close(self) -> None:
+        """Sulje sarakkeet, kirjoita manifest.json ja julkaise tallenne."""
+        for f in self._files.values():
+            f.close()
+
+        manifest = {
+            "version": STORE_VERSION,
+            "rows": self.rows,
+            "source_fingerprint": self._fingerprint.hexdigest(),
+            "byteorder": sys.byteorder,
+            "dictionary_columns": list(DICTIONARY_COLUMNS),
+            "int_columns": INT_COLUMNS,
+            "string_columns": list(STRING_COLUMNS),
+            "hash_bytes": HASH_BYTES,
+            # Sanakirjat koodijärjestyksessä (koodi = listan indeksi)
+            "dictionaries": {
+                name: list(dictionary) for name, dictionary in self._dictionaries.items()
+            },
+        }
+        with (self._staging / "manifest.json").open("w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        publish_directory(self.path, self._staging)
+
+    def discard(self) -> None:
+        """Sulje sarakkeet ja poista keskeneräinen tallenne (vanha säilyy)."""
+        for f in self._files.values():
+            f.close()
+        discard_directory(self._staging)
+
+    def __enter__(self) -> "ColumnarChunkWriter":
+        return self
+
+    def __exit__(self, exc_type: Any, *exc_info: Any) -> None:
+        if exc_type is not None:
+            self.discard()
+        else:
+            self.close()
+
+
+class ColumnarChunkStore:
+    """
+    Lukee sarakepohjaisen chunk-tallenteen mmap:llä.
+
+    Avaus lukee vain manifest.json:n; sarakkeet ovat memoryview-näkymiä
+    mmap-puskureihin, joten käyttöjärjestelmä lataa vain tarvittavat sivut.
+
+    Käyttö:
+        with ColumnarChunkStore("106PDF_output/normalized_chunks.colstore") as store:
+            print(len(store), store.text(0), store.get(0)["organisaatio"])
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = resolve_directory(path)
+        with (self.path / "manifest.json").open("r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+
+        if self.manifest.get("version") != STORE_VERSION:
+            raise ValueError(f"Tuntematon tallenteen versio: {self.manifest.get('version')}")
+        if self.manifest["byteorder"] != sys.byteorder:
+            raise ValueError(
+                f"Tallenne on kirjoitettu {self.manifest['byteorder']}-endian-koneella"
+            )
+
+        self.rows: int = self.manifest["rows"]
+        self.source_fingerprint: str | None = self.manifest.get("source_fingerprint")
+        self.dictionaries: dict[str, list[str]] = self.manifest["dictionaries"]
+        self._mmaps: list[mmap.mmap] = []
+        self._columns: dict[str, memoryview] = {}
+
+        for name in self.manifest["dictionary_columns"]:
+            self._columns[name] = self._map(f"{name}.bin").cast("i")
+        for name, typecode in self.manifest["int_columns"].items():
+            self._columns[name] = self._map(f"{name}.bin").cast(typecode)
+        self._hashes = self._map("hash.bin")
+        self._string_data: dict[str, memoryview] = {}
+        self._string_offsets: dict[str, memoryview] = {}
+        for name in self.manifest["string_columns"]:
+            self._string_data[name] = self._map(f"{name}.data")
+            self._string_offsets[name] = self._map(f"{name}.offsets").cast("q")
+
+    def _map(self, filename: str) -> memoryview:
+        """Mappaa tiedosto vain luku -tilassa (tyhjä tiedosto -> tyhjä näkymä)."""
+        with (self.path / filename).open("rb") as f:
+            if f.seek(0, 2) == 0:
+                return memoryview(b"")
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mmaps.append(mapped)
+        return memoryview(mapped)
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def column(self, name: str) -> memoryview:
+        """
+        Palauta kiinteän leveyden sarake (sanakirjakoodit tai kokonaisluvut).
+
+        Args:
+            name: Sarakkeen nimi (esim. "organisaatio", "kokous_pvm")
+
+        Returns:
+            memoryview, jossa yksi arvo per rivi
+        """
+        return self._columns[name]
+
+    def decode(self, name: str, row: int) -> Any:
+        """Palauta rivin arvo alkuperäisessä muodossa."""
+        if name in self._string_data:
+            return self.string(name, row)
+        if name == "hash":
+            return self._hashes[row * HASH_BYTES:(row + 1) * HASH_BYTES].hex()
+        value = self._columns[name][row]
+        if name in self.dictionaries:
+            return self.dictionaries[name][value] if value >= 0 else None
+        if name == "kokous_pvm":
+            return decode_date(value)
+        if name == "is_table":
+            return bool(value)
+        return value
+
+    def string(self, name: str, row: int) -> str:
+        """Palauta merkkijonosarakkeen arvo (esim. "text" tai "id")."""
+        offsets = self._string_offsets[name]
+        return str(self._string_data[name][offsets[row]:offsets[row + 1]], "utf-8")
+
+    def text(self, row: int) -> str:
+        """Palauta rivin teksti."""
+        return self.string("text", row)
+
+    def get(self, row: int) -> dict[str, Any]:
+        """Palauta rivi chunk-dictinä (sama skeema kuin normalized_chunks.jsonl)."""
+        if not 0 <= row < self.rows:
+            raise IndexError(row)
+        return {name: self.decode(name, row) for name in FIELD_ORDER}
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        for row in range(self.rows):
+            yield self.get(row)
+
+    def close(self) -> None:
+        """Vapauta näkymät ja sulje mmapit."""
+        for view in (*self._columns.values(), *self._string_data.values(),
+                     *self._string_offsets.values(), self._hashes):
+            view.release()
+        self._columns.clear()
+        self._string_data.clear()
+        self._string_offsets.clear()
+        for mapped in self._mmaps:
+            mapped.close()
+        self._mmaps.clear()
+
+    def __enter__(self) -> "ColumnarChunkStore":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
@@ -0,0 +1,125 @@
+"""
+Deduplikaation tilastot ja raportti.
+
+Tämä moduuli:
+- Kerää duplikaattiklusterit (edustaja, koko, identtiset ja lähes identtiset
+  esiintymät, esimerkkiteksti) yhdellä läpikäynnillä chunkkien virratessa
+  ohi, joten syötettä ei tarvitse lukea tai hashata uudelleen lokitusta varten
+- Lokittaa suurimmat klusterit
+- Kirjoittaa koneluettavan raportin (dedup_report.json)
+
+Käyttö:
+    dedup = DedupStats()
+    dedup.add_unique()
+    dedup.add_duplicate(representative_hash, representative_id, text, near=False)
+    dedup.log_top(10)
+    dedup.write_report("106PDF_output/dedup_report.json")
+"""
+
+import json
+import logging
+from pathlib import Path
+from typing import Any
+
+_log = logging.getLogger(__name__)
+
+# Konfiguraatiovakiot
+EXAMPLE_CHARS = 200  # Esimerkkitekstin pituus per klusteri
+
+
+class DedupStats:
+    """
+    Duplikaattiklusterit edustajan hashin mukaan.
+
+    Muistissa pidetään vain klusterit, joissa on vähintään yksi duplikaatti.
+    Esimerkkiteksti otetaan klusterin ensimmäisestä duplikaatista: identtisten
+    chunkkien normalisoitu teksti on sama kuin edustajalla, eikä jokaisen
+    uniikin chunkin tekstiä tarvitse säilyttää siltä varalta, että sille
+    löytyy myöhemmin duplikaatti.
+    """
+
+    def __init__(self, example_chars: int = EXAMPLE_CHARS) -> None:
+        """
+        Args:
+            example_chars: Esimerkkitekstin pituus merkkeinä
+        """
+        self.example_chars = example_chars
+        self.clusters: dict[str, dict[str, Any]] = {}
+        self.unique = 0
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+
+    def add_unique(self) -> None:
+        """Kirjaa säilytetty (ei-duplikaatti) chunk."""
+        self.unique += 1
+
+    def add_duplicate(self, representative_hash: str, representative_id: str, text: str, near: bool = False) -> None:
+        """
+        Kirjaa poisjätetty duplikaatti edustajansa klusteriin.
+
+        Args:
+            representative_hash: Säilytetyn edustajan hash (klusterin avain)
+            representative_id: Säilytetyn edustajan chunk-id
+            text: Duplikaatin teksti (esimerkiksi, jos klusteri on uusi)
+            near: True = lähes identtinen (MinHash/LSH), False = identtinen
+        """
+        cluster = self.clusters.get(representative_hash)
+        if cluster is None:
+            cluster = self.clusters[representative_hash] = {
+                "representative_id": representative_id,
+                "hash": representative_hash,
+                "size": 1,
+                "exact": 0,
+                "near": 0,
+                "example": text[:self.example_chars],
+            }
+        cluster["size"] += 1
+        if near:
+            cluster["near"] += 1
+            self.near_duplicates += 1
+        else:
+            cluster["exact"] += 1
+            self.exact_duplicates += 1
+
+    def top(self, n: int | None = None) -> list[dict[str, Any]]:
+        """Palauta klusterit koon mukaan laskevasti (n = None: kaikki)."""
+        clusters = sorted(self.clusters.values(), key=lambda cluster: -cluster["size"])
+        return clusters if n is None else clusters[:n]
+
+    def log_top(self, n: int = 10) -> None:
+        """Lokita n suurinta klusteria esimerkkiteksteineen."""
+        _log.info(f"Duplikaattiklustereita: {len(self.clusters)}")
+        _log.info(f"Top-{n} klusterit (eniten esiintymiä):")
+        for i, cluster in enumerate(self.top(n), 1):
+            _log.info(
+                f"  {i}. {cluster['representative_id']} (hash {cluster['hash'][:16]}...): "
+                f"{cluster['size']} esiintymää "
+                f"({cluster['exact']} identtistä, {cluster['near']} lähes identtistä)"
+            )
+            _log.info(f"     Esimerkki: {cluster['example']}...")
+
+    def report(self, **extra: Any) -> dict[str, Any]:
+        """
+        Koneluettava raportti.
+
+        Args:
+            **extra: Lisäkentät raportin alkuun (esim. near_duplicate_threshold)
+
+        Returns:
+            Yhteenveto ja kaikki klusterit koon mukaan laskevasti
+        """
+        return {
+            **extra,
+            "unique_chunks": self.unique,
+            "exact_duplicates": self.exact_duplicates,
+            "near_duplicates": self.near_duplicates,
+            "cluster_count": len(self.clusters),
+            "clusters": self.top(),
+        }
+
+    def write_report(self, path: str | Path, **extra: Any) -> None:
+        """Kirjoita report() JSON-tiedostoon."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("w", encoding="utf-8") as f:
+            json.dump(self.report(**extra), f, ensure_ascii=False, indent=2)
@@ -0,0 +1,422 @@
+"""
+Embedding-jobi normalisoiduille chunkeille (CPU).
+
+Tämä skripti:
+1. Lukee normalized_chunks.jsonl:n rivi kerrallaan
+2. Ohittaa chunkit, joiden tekstin hash löytyy jo välimuistista (vain uudet
+   embeddataan). Avain on tarkan tekstin SHA1 (text_hash), ei chunkin "hash"-
+   kenttää, joka lasketaan pienaakkosista: isot ja pienet kirjaimet erottavalle
+   encoderille ne ovat eri tekstejä
+3. Muodostaa erät pituusjärjestyksessä (samanpituiset tekstit samaan erään,
+   vähemmän paddingia)
+4. Tallentaa jokaisen erän välimuistiin heti (keskeytynyt ajo jatkuu siitä)
+5. Kirjoittaa vektorit mmap-luettavaksi float32- tai float16-matriisiksi,
+   jonka rivi = normalized_chunks.jsonl:n rivi
+
+Encoder on vaihdettava: oletuksena sentence-transformers CPU:lla, testeihin
+deterministinen HashingEncoder (ei mallia, ei riippuvuuksia).
+
+Hakemistot:
+    embedding_cache/<encoder>/      - manifest.json, vectors.bin (float32), hashes.bin
+    normalized_chunks.embeddings/   - manifest.json, vectors.bin (rows x dim)
+"""
+
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Any, Protocol
+
+from atomic_dir import atomic_directory, resolve_directory
+from bm25_index import tokenize
+from chunk_store import SourceFingerprint
+from jsonl_io import iter_jsonl
+
+# Konfiguroi logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+_log = logging.getLogger(__name__)
+
+# Konfiguraatiovakiot
+DEFAULT_MODEL_ID = "sentence-transformers/all-MiniLM-L6-v2"  # Sama kuin chunkerin oletus
+BATCH_SIZE = 32  # Tekstejä per encoder-kutsu
+HASH_BYTES = 20  # SHA1-hash tavuina
+CACHE_KEY = "text-sha1"  # Välimuistin avain: tarkan tekstin SHA1 (text_hash)
+EMBEDDINGS_VERSION = 1
+
+# Tuetut tallennusmuodot: dtype -> struct-formaatti
+DTYPE_FORMATS = {"float32": "f", "float16": "e"}
+
+
+class Encoder(Protocol):
+    """Encoder-rajapinta: nimi (välimuistin avain), dimensio ja erän enkoodaus."""
+
+    name: str
+    dim: int
+
+    def encode(self, texts: list[str]) -> Sequence[Sequence[float]]:
+        """Palauta yksi dim-pituinen vektori per teksti."""
+        ...
+
+
+class HashingEncoder:
+    """
+    Deterministinen stub-encoder testeihin (feature hashing, ei mallia).
+
+    Jokainen token hajautetaan dimensioon etumerkillä, ja vektori
+    L2-normalisoidaan. Sama teksti tuottaa aina saman vektorin.
+    """
+
+    def __init__(self, dim: int = 384) -> None:
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def encode(self, texts: list[str]) -> list[list[float]]:
+        vectors = []
+        for text in texts:
+            vector = [0.0] * self.dim
+            for token in tokenize(text):
+                digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                vector[value % self.dim] += 1.0 if value >> 63 else -1.0
+            norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+            vectors.append([x / norm for x in vector])
+        return vectors
+
+
+class SentenceTransformerEncoder:
+    """sentence-transformers-malli CPU:lla (normalisoidut vektorit)."""
+
+    def __init__(self, model_id: str = DEFAULT_MODEL_ID, device: str = "cpu") -> None:
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_id, device=device)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = model_id
+
+    def encode(self, texts: list[str]) -> Sequence[Sequence[float]]:
+        return self.model.encode(
+            texts,
+            batch_size=len(texts),
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        )
+
+
+def build_encoder(model_id: str = DEFAULT_MODEL_ID) -> Encoder:
+    """
+    Luo encoder mallin ID:n perusteella.
+
+    Args:
+        model_id: sentence-transformers-mallin ID tai "hashing" / "hashing-<dim>" (stub)
+
+    Returns:
+        Encoder-instanssi
+    """
+    if model_id == "hashing":
+        return HashingEncoder()
+    if model_id.startswith("hashing-"):
+        return HashingEncoder(int(model_id.removeprefix("hashing-")))
+    return SentenceTransformerEncoder(model_id)
+
+
+def text_hash(text: str) -> str:
+    """Välimuistin avain: tarkan (ei normalisoidun) tekstin SHA1 hex-muodossa."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Append-only vektorivälimuisti tekstin hashin (text_hash) mukaan (float32).
+
+    Jokainen erä kirjoitetaan ensin vectors.bin:iin ja sitten hashes.bin:iin,
+    joten keskeytyksen jälkeen välimuistissa on vain kokonaiset rivit
+    (vajaat lopput katkaistaan avattaessa).
+    """
+
+    def __init__(self, path: str | Path, encoder_name: str, dim: int) -> None:
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.row_bytes = dim * 4
+
+        manifest_path = self.path / "manifest.json"
+        vectors_path = self.path / "vectors.bin"
+        hashes_path = self.path / "hashes.bin"
+        manifest = None
+        if manifest_path.exists():
+            with manifest_path.open("r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest["encoder"] != encoder_name or manifest["dim"] != dim:
+                raise ValueError(
+                    f"Välimuisti {self.path} on eri encoderille: "
+                    f"{manifest['encoder']} ({manifest['dim']})"
+                )
+            if manifest.get("key") != CACHE_KEY:
+                # Vanha välimuisti chunkin pienaakkoshashilla: vektorit eivät vastaa tekstiä
+                _log.warning(f"Välimuistin avain vaihtunut, tyhjennetään: {self.path}")
+                vectors_path.unlink(missing_ok=True)
+                hashes_path.unlink(missing_ok=True)
+                manifest = None
+        if manifest is None:
+            with manifest_path.open("w", encoding="utf-8") as f:
+                json.dump(
+                    {"encoder": encoder_name, "dim": dim, "dtype": "float32", "key": CACHE_KEY}, f, indent=2
+                )
+
+        vectors_path.touch()
+        hashes_path.touch()
+        rows = min(
+            hashes_path.stat().st_size // HASH_BYTES,
+            vectors_path.stat().st_size // self.row_bytes,
+        )
+        os.truncate(vectors_path, rows * self.row_bytes)
+        os.truncate(hashes_path, rows * HASH_BYTES)
+
+        hashes = hashes_path.read_bytes()
+        self._rows: dict[bytes, int] = {
+            hashes[i * HASH_BYTES:(i + 1) * HASH_BYTES]: i for i in range(rows)
+        }
+        self._vectors_file = vectors_path.open("ab")
+        self._hashes_file = hashes_path.open("ab")
+        self._reader = vectors_path.open("rb")
+        self._mmap: mmap.mmap | None = None
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, key: str) -> bool:
+        return bytes.fromhex(key) in self._rows
+
+    def add_batch(self, keys: list[str], vectors: Sequence[Sequence[float]]) -> None:
+        """Lisää erän vektorit ja tallenna ne levylle (fsync)."""
+        data = bytearray()
+        for vector in vectors:
+            if len(vector) != self.dim:
+                raise ValueError(f"Vektorin dimensio {len(vector)} != {self.dim}")
+            data += array("f", vector).tobytes()
+        self._vectors_file.write(data)
+        self._vectors_file.flush()
+        os.fsync(self._vectors_file.fileno())
+
+        first_row = len(self._rows)
+        for i, key in enumerate(keys):
+            key_bytes = bytes.fromhex(key)
+            self._hashes_file.write(key_bytes)
+            self._rows[key_bytes] = first_row + i
+        self._hashes_file.flush()
+        os.fsync(self._hashes_file.fileno())
+
+    def get_bytes(self, key: str) -> bytes:
+        """Palauta avaimen (text_hash) vektori float32-tavuina."""
+        row = self._rows[bytes.fromhex(key)]
+        end = (row + 1) * self.row_bytes
+        if self._mmap is None or len(self._mmap) < end:
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = mmap.mmap(self._reader.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap[row * self.row_bytes:end]
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._reader.close()
+        self._vectors_file.close()
+        self._hashes_file.close()
+
+
+class EmbeddingMatrix:
+    """
+    Lukee embedding-matriisin mmap:llä (rivi = normalized_chunks.jsonl:n rivi).
+
+    Käyttö:
+        with EmbeddingMatrix("106PDF_output/normalized_chunks.embeddings") as matrix:
+            vector = matrix.vector(0)
+            # tai numpy: np.frombuffer(matrix.buffer, dtype=matrix.dtype).reshape(len(matrix), matrix.dim)
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = resolve_directory(path)
+        with (self.path / "manifest.json").open("r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") != EMBEDDINGS_VERSION:
+            raise ValueError(f"Tuntematon matriisin versio: {self.manifest.get('version')}")
+        if self.manifest["byteorder"] != sys.byteorder:
+            raise ValueError(f"Matriisi on kirjoitettu {self.manifest['byteorder']}-endian-koneella")
+
+        self.rows: int = self.manifest["rows"]
+        self.dim: int = self.manifest["dim"]
+        self.dtype: str = self.manifest["dtype"]
+        self.encoder: str = self.manifest["encoder"]
+        self.source_fingerprint: str | None = self.manifest.get("source_fingerprint")
+        self._format = f"{self.dim}{DTYPE_FORMATS[self.dtype]}"
+        self._row_bytes = struct.calcsize(self._format)
+
+        self._mmap: mmap.mmap | None = None
+        with (self.path / "vectors.bin").open("rb") as f:
+            if f.seek(0, 2):
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self._mmap) if self._mmap is not None else memoryview(b"")
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def vector(self, row: int) -> tuple[float, ...]:
+        """Palauta rivin vektori."""
+        if not 0 <= row < self.rows:
+            raise IndexError(row)
+        return struct.unpack_from(self._format, self.buffer, row * self._row_bytes)
+
+    def close(self) -> None:
+        self.buffer.release()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self) -> "EmbeddingMatrix":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def _encode_pending(
+    pending: list[tuple[str, str]],
+    encoder: Encoder,
+    cache: EmbeddingCache,
+    batch_size: int,
+) -> None:
+    """Enkoodaa puuttuvat (text_hash, teksti) -parit pituusjärjestyksessä erinä."""
+    pending.sort(key=lambda item: len(item[1]))
+    total_batches = (len(pending) + batch_size - 1) // batch_size
+    for batch_number, start in enumerate(range(0, len(pending), batch_size), 1):
+        batch = pending[start:start + batch_size]
+        vectors = encoder.encode([text for _, text in batch])
+        cache.add_batch([key for key, _ in batch], vectors)
+        if batch_number % 10 == 0 or batch_number == total_batches:
+            _log.info(f"Embeddattu {min(start + batch_size, len(pending))}/{len(pending)} chunkkia")
+
+
+def embed_chunks(
+    input_jsonl: str | Path,
+    output_dir: str | Path,
+    encoder: Encoder,
+    cache_dir: str | Path,
+    batch_size: int = BATCH_SIZE,
+    dtype: str = "float32",
+) -> dict[str, Any]:
+    """
+    Laske embeddingit normalized_chunks.jsonl:lle ja kirjoita matriisi.
+
+    Vain chunkit, joiden tekstin hash puuttuu välimuistista, embeddataan. Keskeytyksen
+    jälkeen sama kutsu jatkaa viimeisestä tallennetusta erästä.
+
+    Args:
+        input_jsonl: Polku normalized_chunks.jsonl-tiedostoon
+        output_dir: Matriisin hakemisto (esim. normalized_chunks.embeddings)
+        encoder: Encoder-instanssi
+        cache_dir: Välimuistin juurihakemisto (alihakemisto per encoder)
+        batch_size: Tekstejä per encoder-kutsu
+        dtype: Matriisin tyyppi ("float32" tai "float16")
+
+    Returns:
+        Ajon tilastot (rows, embedded, cached)
+    """
+    if dtype not in DTYPE_FORMATS:
+        raise ValueError(f"Tuntematon dtype: {dtype} (tuetut: {', '.join(DTYPE_FORMATS)})")
+
+    cache_path = Path(cache_dir) / re.sub(r"[^\w.-]", "_", encoder.name)
+    cache = EmbeddingCache(cache_path, encoder.name, encoder.dim)
+    try:
+        # 1. Kerää puuttuvat chunkit (sama teksti embeddataan vain kerran)
+        pending: dict[str, str] = {}
+        rows = 0
+        for chunk in iter_jsonl(input_jsonl):
+            rows += 1
+            text = chunk.get("text", "")
+            key = text_hash(text)
+            if key not in pending and key not in cache:
+                pending[key] = text
+        _log.info(f"Chunkkeja: {rows}, välimuistissa: {rows - len(pending)}, embeddataan: {len(pending)}")
+
+        # 2. Embeddaa puuttuvat erinä (jokainen erä tallennetaan heti)
+        _encode_pending(list(pending.items()), encoder, cache, batch_size)
+
+        # 3. Kokoa matriisi rivijärjestyksessä välimuistista (hakemisto vaihdetaan atomisesti)
+        unpack = struct.Struct(f"{encoder.dim}f").unpack
+        pack = struct.Struct(f"{encoder.dim}{DTYPE_FORMATS[dtype]}").pack
+        fingerprint = SourceFingerprint()
+        with atomic_directory(output_dir) as staging:
+            with (staging / "vectors.bin").open("wb") as f:
+                for chunk in iter_jsonl(input_jsonl):
+                    text = chunk.get("text", "")
+                    fingerprint.update(text)
+                    data = cache.get_bytes(text_hash(text))
+                    f.write(data if dtype == "float32" else pack(*unpack(data)))
+
+            manifest = {
+                "version": EMBEDDINGS_VERSION,
+                "encoder": encoder.name,
+                "dim": encoder.dim,
+                "dtype": dtype,
+                "rows": rows,
+                "byteorder": sys.byteorder,
+                "source": Path(input_jsonl).name,
+                "source_fingerprint": fingerprint.hexdigest(),
+            }
+            with (staging / "manifest.json").open("w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+    finally:
+        cache.close()
+
+    return {"rows": rows, "embedded": len(pending), "cached": rows - len(pending)}
+
+
+def main():
+    """Pääfunktio."""
+    if len(sys.argv) > 1:
+        base_dir = Path(sys.argv[1])
+    else:
+        default_dir = Path("106PDF_output")
+        base_dir = default_dir if default_dir.exists() else Path(os.getenv("LAPUA_RAG_OUTPUT_DIR", "."))
+
+    input_jsonl = base_dir / "normalized_chunks.jsonl"
+    output_dir = base_dir / "normalized_chunks.embeddings"
+    cache_dir = base_dir / "embedding_cache"
+
+    try:
+        encoder = build_encoder(os.getenv("LAPUA_RAG_EMBED_MODEL", DEFAULT_MODEL_ID))
+        stats = embed_chunks(
+            input_jsonl,
+            output_dir,
+            encoder,
+            cache_dir,
+            batch_size=int(os.getenv("LAPUA_RAG_EMBED_BATCH_SIZE", str(BATCH_SIZE))),
+            dtype=os.getenv("LAPUA_RAG_EMBED_DTYPE", "float32"),  # tai float16
+        )
+
+        print("\n✅ Embedding-jobi valmis!")
+        print(f"   - Chunkkeja: {stats['rows']}")
+        print(f"   - Embeddattu nyt: {stats['embedded']}")
+        print(f"   - Välimuistista: {stats['cached']}")
+        print(f"   - Output: {output_dir}")
+
+    except Exception as e:
+        _log.error(f"Virhe embedding-jobissa: {e}", exc_info=True)
+        raise
+
+
+if __name__ == "__main__":
+    main()
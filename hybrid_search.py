@@ -0,0 +1,497 @@
+"""
+Hybridihaku: leksikaalinen (BM25) ja vektorihaku yhdistettynä.
+
+Tämä moduuli:
+- Laskee metatietosuodattimet kerran ennen hakua (MetadataIndex) ja antaa
+  sallitut rivit molemmille hauille (suodatus ennen pisteytystä, ei jälkeen)
+- Ajaa vektorihaun (kyselyn enkoodaus + ANN) taustasäikeessä samaan aikaan
+  kuin BM25-haun (numpy ja mallin laskenta vapauttavat GIL:n)
+- Yhdistää tulokset reciprocal rank fusionilla (RRF) tai painotetuilla
+  normalisoiduilla pisteillä
+- Palauttaa chunkit (id, source_file, pykala, ...) ja jokaisen vaiheen keston
+- Laajentaa pyydettäessä osumat koko pykälään (SectionIndex): saman pykälän
+  osumat yhdistetään yhdeksi tulokseksi, jossa on pykälän kaikki chunkit
+
+Vaaditut tiedostot output-hakemistossa:
+    normalized_chunks.bm25          - bm25_index.py
+    normalized_chunks.metaindex     - postprocess_docling_chunks.py
+    normalized_chunks.colstore      - postprocess_docling_chunks.py (tai .jsonl)
+Valinnaiset (vektorihaku):
+    normalized_chunks.embeddings    - embed_chunks.py
+    normalized_chunks.ann           - ann_index.py (ilman tätä tarkka haku matriisista)
+Valinnainen (pykälälaajennus):
+    normalized_chunks.sections      - postprocess_docling_chunks.py
+
+Käyttö:
+    python hybrid_search.py 106PDF_output "Virkiä superpesis"
+    python hybrid_search.py 106PDF_output --benchmark      # vaihekohtaiset p50/p95/p99
+
+    with HybridSearcher("106PDF_output") as searcher:
+        response = searcher.search("Virkiä superpesis", {"year": 2025}, k=10)
+        response["results"]     # [{"id", "source_file", "pykala", ...}]
+        response["timings_ms"]  # {"filter", "lexical", "encode", "vector", "fusion", "fetch", "total"}
+        response = searcher.search("takausvastuu", k=5, expand_sections=True)
+        response["results"][0]["section_text"]  # koko pykälä
+"""
+
+import json
+import logging
+import os
+import random
+import sys
+import time
+from collections.abc import Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from ann_index import DEFAULT_NPROBE, ANNIndex
+from bm25_index import BM25Index
+from chunk_store import ColumnarChunkStore, SourceFingerprint
+from embed_chunks import EmbeddingMatrix, Encoder, build_encoder
+from jsonl_io import iter_jsonl
+from metadata_index import MetadataIndex
+from section_index import SectionIndex
+
+# Konfiguroi logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+_log = logging.getLogger(__name__)
+
+# Konfiguraatiovakiot
+RRF_K = 60  # RRF:n tasoitusvakio (Cormack et al. 2009)
+CANDIDATE_FACTOR = 3  # Ehdokkaita per hakutapa: k * tämä
+MIN_CANDIDATES = 30
+LEXICAL_WEIGHT = 0.5  # Painotetussa fuusiossa BM25:n osuus (loput vektorihaulle)
+FUSION_METHODS = ("rrf", "weighted")
+
+# Tuloksiin palautettavat chunkin kentät
+RESULT_FIELDS = ("id", "source_file", "organisaatio", "kokous_pvm", "pykala", "section_type", "text")
+
+
+def reciprocal_rank_fusion(
+    rankings: list[list[tuple[int, float]]],
+    rrf_k: int = RRF_K,
+) -> list[tuple[int, float]]:
+    """
+    Yhdistä järjestetyt tuloslistat RRF:llä: pisteet = sum(1 / (rrf_k + sija)).
+
+    Args:
+        rankings: Tuloslistat [(rivi, pisteet)] paras ensin
+        rrf_k: Tasoitusvakio
+
+    Returns:
+        [(rivi, fuusiopisteet)] paras ensin (tasapisteissä pienempi rivi ensin)
+    """
+    fused: dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (row, _) in enumerate(ranking, start=1):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(fused.items(), key=lambda item: (-item[1], item[0]))
+
+
+def weighted_fusion(
+    lexical: list[tuple[int, float]],
+    vector: list[tuple[int, float]],
+    lexical_weight: float = LEXICAL_WEIGHT,
+) -> list[tuple[int, float]]:
+    """
+    Yhdistä pisteet painotettuna summana (molemmat min-max-normalisoituna 0..1).
+
+    Args:
+        lexical: BM25-tulokset [(rivi, pisteet)]
+        vector: Vektorihaun tulokset [(rivi, pisteet)]
+        lexical_weight: BM25:n paino (vektorihaun paino = 1 - tämä)
+
+    Returns:
+        [(rivi, yhdistetyt pisteet)] paras ensin
+    """
+    fused: dict[int, float] = {}
+    for results, weight in ((lexical, lexical_weight), (vector, 1.0 - lexical_weight)):
+        if not results:
+            continue
+        scores = [score for _, score in results]
+        low, high = min(scores), max(scores)
+        span = high - low
+        for row, score in results:
+            normalized = (score - low) / span if span else 1.0
+            fused[row] = fused.get(row, 0.0) + weight * normalized
+    return sorted(fused.items(), key=lambda item: (-item[1], item[0]))
+
+
+class HybridSearcher:
+    """
+    Yhden output-hakemiston hybridihaku.
+
+    Indeksit avataan kerran (mmap); search() on säieturvallinen lukuoperaatio,
+    mutta yksi vektorihakusäie palvelee kaikkia kutsuja.
+    """
+
+    def __init__(
+        self,
+        base_dir: str | Path,
+        encoder: Encoder | None = None,
+        nprobe: int = DEFAULT_NPROBE,
+    ) -> None:
+        """
+        Avaa indeksit.
+
+        Args:
+            base_dir: Output-hakemisto (esim. 106PDF_output)
+            encoder: Kyselyjen encoder (oletus: sama kuin embedding-matriisissa)
+            nprobe: ANN-haun läpikäytävien listojen määrä
+
+        Raises:
+            ValueError: Jos indeksit eivät ole samasta chunk-aineistosta (ks. _check_sources)
+        """
+        self.base_dir = Path(base_dir)
+        self.metadata_index: MetadataIndex | None = None
+        self.bm25: BM25Index | None = None
+        self.store: ColumnarChunkStore | None = None
+        self.chunks: list[dict[str, Any]] = []
+        self.sections: SectionIndex | None = None
+        # Vektorihaku on valinnainen: ilman embeddingejä haku on pelkkä BM25
+        self.matrix: EmbeddingMatrix | None = None
+        self.vectors: np.ndarray | None = None
+        self.ann: ANNIndex | None = None
+        self.encoder = encoder
+        self.nprobe = nprobe
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vector-search")
+        try:
+            self._open_indexes()
+            self._check_sources()
+        except BaseException:
+            self.close()
+            raise
+
+    def _open_indexes(self) -> None:
+        """Avaa output-hakemiston indeksit."""
+        self.metadata_index = MetadataIndex.load(self.base_dir / "normalized_chunks.metaindex")
+        self.bm25 = BM25Index.load(self.base_dir / "normalized_chunks.bm25", self.metadata_index)
+
+        colstore_dir = self.base_dir / "normalized_chunks.colstore"
+        if colstore_dir.exists():
+            self.store = ColumnarChunkStore(colstore_dir)
+        else:
+            self.chunks = list(iter_jsonl(self.base_dir / "normalized_chunks.jsonl"))
+
+        sections_dir = self.base_dir / "normalized_chunks.sections"
+        if sections_dir.exists():
+            self.sections = SectionIndex.load(sections_dir)
+
+        embeddings_dir = self.base_dir / "normalized_chunks.embeddings"
+        if embeddings_dir.exists():
+            self.matrix = EmbeddingMatrix(embeddings_dir)
+            self.vectors = np.frombuffer(self.matrix.buffer, dtype=self.matrix.dtype).reshape(
+                len(self.matrix), self.matrix.dim
+            )
+            if self.encoder is None:
+                self.encoder = build_encoder(self.matrix.encoder)
+            if self.encoder.name != self.matrix.encoder:
+                raise ValueError(
+                    f"Encoder {self.encoder.name} ei vastaa embeddingejä ({self.matrix.encoder})"
+                )
+            ann_dir = self.base_dir / "normalized_chunks.ann"
+            if ann_dir.exists():
+                self.ann = ANNIndex.load(ann_dir, self.metadata_index, rerank_vectors=self.vectors)
+
+    def _check_sources(self) -> None:
+        """
+        Varmista, että kaikki indeksit on rakennettu samasta chunk-aineistosta.
+
+        Indeksit rakennetaan eri skripteillä, joten uudelleenlataus voi osua
+        hetkeen, jolloin osa indekseistä on jo uudesta aineistosta. Rivinumerot
+        osoittaisivat silloin eri chunkkeihin (IndexError tai väärät tulokset).
+        Rivimäärien on oltava samat; sormenjälkiä verrataan niiltä indekseiltä,
+        joiden manifestissa se on (vanhat manifestit: vain rivimäärä).
+
+        Raises:
+            ValueError: Jos rivimäärät tai sormenjäljet eroavat
+        """
+        if self.store is not None:
+            chunk_source = ("colstore", self.store.rows, self.store.source_fingerprint)
+        else:
+            fingerprint = SourceFingerprint()
+            for chunk in self.chunks:
+                fingerprint.update(chunk.get("text", ""))
+            chunk_source = ("jsonl", len(self.chunks), fingerprint.hexdigest())
+        sources = [
+            ("metaindex", self.metadata_index.rows, self.metadata_index.source_fingerprint),
+            ("bm25", self.bm25.rows, self.bm25.source_fingerprint),
+            chunk_source,
+        ]
+        if self.sections is not None:
+            sources.append(("sections", self.sections.rows, self.sections.source_fingerprint))
+        if self.matrix is not None:
+            sources.append(("embeddings", self.matrix.rows, self.matrix.source_fingerprint))
+        if self.ann is not None:
+            sources.append(("ann", self.ann.rows, self.ann.source_fingerprint))
+
+        if len({rows for _, rows, _ in sources}) > 1:
+            counts = ", ".join(f"{name}={rows}" for name, rows, _ in sources)
+            raise ValueError(f"Indeksien rivimäärät eroavat ({counts}): rakenna indeksit uudelleen")
+        fingerprints = [(name, fingerprint) for name, _, fingerprint in sources if fingerprint]
+        if len({fingerprint for _, fingerprint in fingerprints}) > 1:
+            details = ", ".join(f"{name}={fingerprint[:12]}" for name, fingerprint in fingerprints)
+            raise ValueError(f"Indeksit on rakennettu eri chunk-aineistoista ({details}): rakenna indeksit uudelleen")
+
+    def _vector_search(
+        self,
+        query: str,
+        k: int,
+        rows: np.ndarray | None,
+        query_vector: np.ndarray | None = None,
+    ) -> tuple[list[tuple[int, float]], float, float]:
+        """Enkoodaa kysely ja hae k lähintä riviä. Palauttaa (tulokset, encode_ms, vector_ms)."""
+        start = time.perf_counter()
+        if query_vector is None:
+            query_vector = np.asarray(self.encoder.encode([query])[0], dtype=np.float32)
+        encoded = time.perf_counter()
+
+        if self.ann is not None:
+            results = self.ann.search(query_vector, k=k, nprobe=self.nprobe, rows=rows)
+        else:
+            # Ei ANN-indeksiä: tarkka haku koko matriisista tai sallituista riveistä
+            if rows is None:
+                candidates = np.arange(len(self.vectors))
+                scores = self.vectors @ query_vector.astype(self.vectors.dtype)
+            else:
+                candidates = rows
+                scores = self.vectors[rows] @ query_vector.astype(self.vectors.dtype)
+            if len(candidates) > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+                candidates, scores = candidates[top], scores[top]
+            order = np.lexsort((candidates, -scores))
+            results = [(int(candidates[i]), float(scores[i])) for i in order]
+        done = time.perf_counter()
+        return results, (encoded - start) * 1000, (done - encoded) * 1000
+
+    def _result(self, row: int, score: float, lexical_rank: int | None, vector_rank: int | None) -> dict[str, Any]:
+        """Muodosta tulosrivi chunkin kentistä."""
+        if self.store is not None:
+            result = {name: self.store.decode(name, row) for name in RESULT_FIELDS}
+        else:
+            chunk = self.chunks[row]
+            result = {name: chunk.get(name) for name in RESULT_FIELDS}
+        result.update(row=row, score=score, lexical_rank=lexical_rank, vector_rank=vector_rank)
+        return result
+
+    def _text(self, row: int) -> str:
+        """Palauta rivin chunkin teksti."""
+        if self.store is not None:
+            return self.store.text(row)
+        return self.chunks[row].get("text", "")
+
+    def _expand_sections(self, fused: list[tuple[int, float]], k: int) -> list[tuple[int, float, list[int]]]:
+        """
+        Ryhmittele fuusion rivit pykälittäin paremmuusjärjestyksessä.
+
+        Pykälän paras osuma edustaa pykälää; saman pykälän heikommat osumat
+        ohitetaan, jotta k tulosta kattaa k eri pykälää.
+
+        Returns:
+            [(rivi, pisteet, pykälän rivit)] enintään k kpl
+        """
+        expanded = []
+        seen: set[int] = set()
+        for row, score in fused:
+            section = self.sections.section_of(row)
+            if section is not None:
+                if section in seen:
+                    continue
+                seen.add(section)
+            expanded.append((row, score, self.sections.section_rows(row)))
+            if len(expanded) == k:
+                break
+        return expanded
+
+    def search(
+        self,
+        query: str,
+        filters: dict[str, Any] | None = None,
+        k: int = 10,
+        fusion: str = "rrf",
+        lexical_weight: float = LEXICAL_WEIGHT,
+        query_vector: Sequence[float] | None = None,
+        expand_sections: bool = False,
+        rows: Sequence[int] | None = None,
+    ) -> dict[str, Any]:
+        """
+        Hae k parasta chunkkia hybridihaulla.
+
+        Args:
+            query: Hakulause (esim. "§ 398 Virkiä")
+            filters: MetadataIndex.query()-suodattimet
+                     (organisaatio, pykala, section_type, year, month, date_from, date_to)
+            k: Palautettavien tulosten määrä
+            fusion: "rrf" tai "weighted"
+            lexical_weight: BM25:n paino painotetussa fuusiossa
+            query_vector: Valmiiksi enkoodattu kyselyvektori (esim. palvelun
+                          eräenkoodauksesta); None = enkoodataan tässä
+            expand_sections: Laajenna osumat koko pykälään (vaatii
+                             normalized_chunks.sections-indeksin); tuloksissa
+                             on lisäksi section_rows ja section_text
+            rows: Valmiiksi suodatetut rivit (metadata_index.query()); annettuna
+                  filters ohitetaan
+
+        Returns:
+            {"results": [chunk-dictit], "timings_ms": {vaihe: kesto}}
+        """
+        if fusion not in FUSION_METHODS:
+            raise ValueError(f"Tuntematon fuusio: {fusion} (tuetut: {', '.join(FUSION_METHODS)})")
+        if expand_sections and self.sections is None:
+            raise ValueError(f"Pykäläindeksiä ei löydy: {self.base_dir / 'normalized_chunks.sections'}")
+        timings: dict[str, float] = {}
+        start = time.perf_counter()
+
+        # 1. Suodattimet ensin: molemmat haut pisteyttävät vain sallitut rivit
+        if rows is None and filters:
+            rows = self.metadata_index.query(**filters)
+        timings["filter"] = (time.perf_counter() - start) * 1000
+        if k <= 0 or (rows is not None and len(rows) == 0):
+            timings["total"] = timings["filter"]
+            return {"results": [], "timings_ms": timings}
+
+        # 2. Vektorihaku taustalle, BM25 tässä säikeessä
+        candidates = max(k * CANDIDATE_FACTOR, MIN_CANDIDATES)
+        vector_future: Future | None = None
+        if self.encoder is not None and self.vectors is not None:
+            vector_rows = np.frombuffer(rows, dtype=np.uint32).astype(np.int64) if rows is not None else None
+            if query_vector is not None:
+                query_vector = np.asarray(query_vector, dtype=np.float32)
+            vector_future = self._executor.submit(
+                self._vector_search, query, candidates, vector_rows, query_vector
+            )
+
+        lexical_start = time.perf_counter()
+        lexical = self.bm25.search(query, k=candidates, rows=rows)
+        timings["lexical"] = (time.perf_counter() - lexical_start) * 1000
+
+        vector: list[tuple[int, float]] = []
+        if vector_future is not None:
+            vector, timings["encode"], timings["vector"] = vector_future.result()
+
+        # 3. Fuusio
+        fusion_start = time.perf_counter()
+        if fusion == "rrf":
+            fused = reciprocal_rank_fusion([lexical, vector])
+        else:
+            fused = weighted_fusion(lexical, vector, lexical_weight)
+        lexical_ranks = {row: rank for rank, (row, _) in enumerate(lexical, start=1)}
+        vector_ranks = {row: rank for rank, (row, _) in enumerate(vector, start=1)}
+        timings["fusion"] = (time.perf_counter() - fusion_start) * 1000
+
+        # 4. Chunkkien kentät vain palautettaville riveille
+        fetch_start = time.perf_counter()
+        if expand_sections:
+            results = []
+            for row, score, section_rows in self._expand_sections(fused, k):
+                result = self._result(row, score, lexical_ranks.get(row), vector_ranks.get(row))
+                result["section_rows"] = section_rows
+                result["section_text"] = "\n\n".join(self._text(section_row) for section_row in section_rows)
+                results.append(result)
+        else:
+            results = [
+                self._result(row, score, lexical_ranks.get(row), vector_ranks.get(row))
+                for row, score in fused[:k]
+            ]
+        done = time.perf_counter()
+        timings["fetch"] = (done - fetch_start) * 1000
+        timings["total"] = (done - start) * 1000
+        return {"results": results, "timings_ms": timings}
+
+    def close(self) -> None:
+        """Pysäytä hakusäie ja vapauta mmapit."""
+        self._executor.shutdown(wait=True)
+        self.ann = None
+        self.vectors = None
+        if self.matrix is not None:
+            self.matrix.close()
+        if self.store is not None:
+            self.store.close()
+        if self.sections is not None:
+            self.sections.close()
+        if self.bm25 is not None:
+            self.bm25.close()
+        if self.metadata_index is not None:
+            self.metadata_index.close()
+
+    def __enter__(self) -> "HybridSearcher":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    """Palauta arvojen persentiili (lähin sija)."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def benchmark_latency(searcher: HybridSearcher, queries: int = 300, k: int = 10, seed: int = 0) -> dict[str, dict[str, float]]:
+    """
+    Mittaa vaihekohtaiset latenssit chunkkien teksteistä poimituilla kyselyillä.
+
+    Joka toisessa kyselyssä on metatietosuodatin (satunnainen organisaatio).
+
+    Args:
+        searcher: Avattu HybridSearcher
+        queries: Kyselyjen määrä
+        k: Tuloksia per kysely
+        seed: Satunnaissiemen
+
+    Returns:
+        {vaihe: {"p50", "p95", "p99"}} millisekunteina
+    """
+    rng = random.Random(seed)
+    rows = len(searcher.store) if searcher.store is not None else len(searcher.chunks)
+    organisations = searcher.metadata_index.values("organisaatio")
+    samples: dict[str, list[float]] = {}
+    for i in range(queries):
+        row = rng.randrange(rows)
+        text = searcher._text(row)
+        words = text.split()
+        start = rng.randrange(max(1, len(words) - 4))
+        query = " ".join(words[start:start + rng.randint(2, 4)]) or "päätös"
+        filters = {"organisaatio": rng.choice(organisations)} if i % 2 and organisations else None
+        for stage, value in searcher.search(query, filters, k=k)["timings_ms"].items():
+            samples.setdefault(stage, []).append(value)
+    return {
+        stage: {name: _percentile(values, fraction) for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))}
+        for stage, values in samples.items()
+    }
+
+
+def main():
+    """Pääfunktio."""
+    if len(sys.argv) > 1:
+        base_dir = Path(sys.argv[1])
+    else:
+        default_dir = Path("106PDF_output")
+        base_dir = default_dir if default_dir.exists() else Path(os.getenv("LAPUA_RAG_OUTPUT_DIR", "."))
+
+    encoder_id = os.getenv("LAPUA_RAG_EMBED_MODEL")
+    with HybridSearcher(base_dir, build_encoder(encoder_id) if encoder_id else None) as searcher:
+        if len(sys.argv) > 2 and sys.argv[2] == "--benchmark":
+            for stage, values in benchmark_latency(searcher).items():
+                print(f"{stage:<8} p50 {values['p50']:7.2f} ms   p95 {values['p95']:7.2f} ms   "
+                      f"p99 {values['p99']:7.2f} ms")
+            return
+
+        query = sys.argv[2] if len(sys.argv) > 2 else "päätös"
+        filters = json.loads(sys.argv[3]) if len(sys.argv) > 3 else None  # esim. '{"year": 2025}'
+        response = searcher.search(query, filters, k=10)
+
+    for result in response["results"]:
+        print(f"{result['score']:.4f}  {result['id']}  {result['source_file']}  {result['pykala']}  "
+              f"(BM25 #{result['lexical_rank']}, vektori #{result['vector_rank']})")
+    print("Vaiheet (ms): " + ", ".join(f"{stage} {ms:.2f}" for stage, ms in response["timings_ms"].items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+JSONL- ja JSON-virtakirjoituksen apufunktiot.
+
+Tämä moduuli:
+- Lukee JSONL-tiedostoja rivi kerrallaan
+- Kirjoittaa suuria JSON-tiedostoja virtana (json.dump(..., indent=2) -muotoa
+  vastaavasti) ilman että koko data on muistissa
+
+Käytetään sekä batch-prosessoinnissa että postiprosessoinnissa, joten
+moduuli ei saa riippua Doclingista.
+"""
+
+import json
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Any, TextIO
+
+
+def iter_jsonl(path: str | Path) -> Iterator[dict[str, Any]]:
+    """
+    Lue JSONL-tiedosto rivi kerrallaan.
+
+    Args:
+        path: Polku JSONL-tiedostoon
+
+    Yields:
+        Yksi JSON-objekti per ei-tyhjä rivi
+    """
+    with Path(path).open("r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _write_indented_json_list(f: TextIO, key: str, items: Iterable[Any], last: bool) -> None:
+    """Kirjoita ylimmän tason avain ja lista alkio kerrallaan (indent=2 -muoto)."""
+    f.write(f"  {json.dumps(key)}: [")
+    empty = True
+    for item in items:
+        f.write("\n" if empty else ",\n")
+        item_json = json.dumps(item, ensure_ascii=False, indent=2)
+        f.write("\n".join("    " + line for line in item_json.split("\n")))
+        empty = False
+    f.write("]" if empty else "\n  ]")
+    f.write("\n" if last else ",\n")
+
+
+def write_json_streaming(
+    path: str | Path,
+    head: dict[str, Any],
+    lists: list[tuple[str, Iterable[Any]]],
+) -> None:
+    """
+    Kirjoita JSON-objekti, jonka listat luetaan iteraattoreista alkio kerrallaan.
+
+    Tulos on tavu tavulta sama kuin json.dump({**head, **lists}, f,
+    ensure_ascii=False, indent=2), mutta muistissa on kerrallaan vain yksi
+    listan alkio.
+
+    Args:
+        path: Output-tiedoston polku
+        head: Pienet kentät (esim. metadata), kirjoitetaan ensin
+        lists: [(avain, iteroitava)] -parit, kirjoitetaan headin jälkeen
+    """
+    with Path(path).open("w", encoding="utf-8") as f:
+        f.write("{\n")
+        for key, value in head.items():
+            value_json = json.dumps(value, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+            f.write(f"  {json.dumps(key)}: {value_json}")
+            f.write(",\n" if lists else "\n")
+        for i, (key, items) in enumerate(lists):
+            _write_indented_json_list(f, key, items, last=i == len(lists) - 1)
+        f.write("}")
@@ -0,0 +1,357 @@
+"""
+Metatietojen käänteisindeksi normalisoiduille chunkeille.
+
+Tämä moduuli:
+- Rakentaa järjestetyt posting-listat (rivinumerot) kentille organisaatio,
+  pykala, section_type sekä kokous_pvm:n vuodelle ja kuukaudelle
+- Tallentaa päivämäärät järjestettynä taulukkona aikavälihakuja varten (bisect)
+  sekä rivikohtaisena taulukkona (aikaväli lyhyen posting-listan ehtona)
+- Leikkaa useamman suodattimen posting-listat (pienin lista ensin)
+- Kirjoittaa indeksin hakemistoon ja lukee sen mmap:llä
+
+Rivinumero on chunkin järjestysnumero normalized_chunks.jsonl:ssä (sama kuin
+chunk_store.ColumnarChunkStore:n rivi).
+
+Hakemiston rakenne:
+    manifest.json   - kenttä -> arvo -> [offset, pituus] postings.bin:iin
+    postings.bin    - kaikki posting-listat uint32-taulukkoina peräkkäin
+
+Käyttö:
+    index = MetadataIndex.load("106PDF_output/normalized_chunks.metaindex")
+    rows = index.query(pykala="§ 81", year=2025)
+"""
+
+import json
+import mmap
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Iterable, Sequence
+from pathlib import Path
+from typing import Any
+
+from atomic_dir import atomic_directory, resolve_directory
+from chunk_store import SourceFingerprint, encode_date
+
+INDEX_VERSION = 2
+
+# Tarkalla arvolla indeksoitavat kentät (year ja month johdetaan kokous_pvm:stä)
+INDEXED_FIELDS = ("organisaatio", "pykala", "section_type", "year", "month")
+
+
+def _date_keys(date_str: str | None) -> tuple[int, str | None, str | None]:
+    """Palauta (YYYYMMDD, vuosi, "YYYY-MM") päivämäärästä."""
+    date_value = encode_date(date_str)
+    if not date_value:
+        return 0, None, None
+    return date_value, date_str[:4], date_str[:7]
+
+
+def intersect_postings(postings: Sequence[Sequence[int]]) -> array:
+    """
+    Leikkaa järjestetyt posting-listat.
+
+    Jos listat ovat samaa suuruusluokkaa, leikkaus tehdään joukoilla. Muuten
+    lyhin lista käydään läpi ja muista haetaan binäärihaulla, joten hinta on
+    O(k * log n), missä k on lyhimmän listan pituus.
+
+    Args:
+        postings: Järjestetyt rivinumerolistat
+
+    Returns:
+        Rivinumerot, jotka esiintyvät kaikissa listoissa (järjestettynä)
+    """
+    if not postings:
+        return array("I")
+    ordered = sorted(postings, key=len)
+    if len(ordered) > 1 and len(ordered[-1]) <= 32 * len(ordered[0]):
+        return array("I", sorted(set(ordered[0]).intersection(*ordered[1:])))
+    result = array("I", ordered[0])
+    for other in ordered[1:]:
+        if not result:
+            break
+        n = len(other)
+        kept = array("I")
+        lo = 0
+        for row in result:
+            lo = bisect_left(other, row, lo, n)
+            if lo == n:
+                break
+            if other[lo] == row:
+                kept.append(row)
+        result = kept
+    return result
+
+
+class MetadataIndex:
+    """
+    Metatietosuodattimien käänteisindeksi.
+
+    Posting-listat ovat järjestettyjä uint32-rivinumerotaulukoita (array tai
+    mmap-näkymä), joten yksittäinen suodatin on sanakirjahaku ja useampi
+    suodatin leikataan binäärihaulla.
+    """
+
+    def __init__(
+        self,
+        rows: int,
+        postings: dict[str, dict[str, Sequence[int]]],
+        dates: Sequence[int],
+        date_rows: Sequence[int],
+        row_dates: Sequence[int],
+    ) -> None:
+        self.rows = rows
+        self.postings = postings
+        self.dates = dates  # Järjestetyt YYYYMMDD-arvot
+        self.date_rows = date_rows  # Rivinumerot samassa järjestyksessä
+        self.row_dates = row_dates  # Rivi -> YYYYMMDD (0 = ei päivämäärää)
+        self.source_fingerprint: str | None = None  # Ks. chunk_store.SourceFingerprint
+        self._mmap: mmap.mmap | None = None
+        self._views: list[memoryview] = []
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[dict[str, Any]]) -> "MetadataIndex":
+        """Rakenna indeksi muistiin chunkeista (rivinumero = järjestys)."""
+        builder = MetadataIndexBuilder()
+        for chunk in chunks:
+            builder.add(chunk)
+        return builder.build()
+
+    @classmethod
+    def load(cls, path: str | Path) -> "MetadataIndex":
+        """
+        Lataa indeksi hakemistosta (posting-listat mapataan muistiin).
+
+        Args:
+            path: MetadataIndexBuilder.write():n kirjoittama hakemisto
+
+        Returns:
+            MetadataIndex
+        """
+        path = resolve_directory(path)
+        with (path / "manifest.json").open("r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != INDEX_VERSION:
+            raise ValueError(f"Tuntematon indeksin versio: {manifest.get('version')}")
+        if manifest["byteorder"] != sys.byteorder:
+            raise ValueError(f"Indeksi on kirjoitettu {manifest['byteorder']}-endian-koneella")
+
+        mapped = None
+        with (path / "postings.bin").open("rb") as f:
+            if f.seek(0, 2):
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        base = memoryview(mapped).cast("I") if mapped is not None else memoryview(array("I"))
+        views = [base]
+
+        def view(span: list[int]) -> memoryview:
+            offset, length = span
+            sliced = base[offset:offset + length]
+            views.append(sliced)
+            return sliced
+
+        postings = {
+            field: {value: view(span) for value, span in values.items()}
+            for field, values in manifest["fields"].items()
+        }
+        index = cls(
+            manifest["rows"],
+            postings,
+            view(manifest["dates"]),
+            view(manifest["date_rows"]),
+            view(manifest["row_dates"]),
+        )
+        index.source_fingerprint = manifest.get("source_fingerprint")
+        index._mmap = mapped
+        index._views = views
+        return index
+
+    def posting(self, field: str, value: Any) -> Sequence[int]:
+        """Palauta kentän arvon posting-lista (tyhjä jos arvoa ei ole)."""
+        return self.postings.get(field, {}).get(str(value), ())
+
+    def date_range(self, date_from: str | None = None, date_to: str | None = None) -> array:
+        """
+        Palauta rivit, joiden kokous_pvm on välillä [date_from, date_to].
+
+        Args:
+            date_from: Alkupäivä "YYYY-MM-DD" (None = ei alarajaa)
+            date_to: Loppupäivä "YYYY-MM-DD" (None = ei ylärajaa)
+
+        Returns:
+            Järjestetyt rivinumerot
+        """
+        lo, hi = self._date_bounds(date_from, date_to)
+        return array("I", sorted(self.date_rows[lo:hi]))
+
+    def _date_bounds(self, date_from: str | None, date_to: str | None) -> tuple[int, int]:
+        """Aikavälin alku- ja loppuindeksi järjestetyssä päivämäärätaulukossa."""
+        lo = bisect_left(self.dates, encode_date(date_from)) if date_from else 0
+        hi = bisect_right(self.dates, encode_date(date_to)) if date_to else len(self.dates)
+        return lo, hi
+
+    def query(
+        self,
+        organisaatio: str | None = None,
+        pykala: str | None = None,
+        section_type: str | None = None,
+        year: int | str | None = None,
+        month: str | None = None,
+        date_from: str | None = None,
+        date_to: str | None = None,
+    ) -> array:
+        """
+        Hae rivit, jotka täyttävät kaikki annetut suodattimet.
+
+        Args:
+            organisaatio: Esim. "Kaupunginhallitus"
+            pykala: Esim. "§ 81"
+            section_type: Esim. "paatos"
+            year: Kokousvuosi (esim. 2025)
+            month: Kokouskuukausi muodossa "YYYY-MM"
+            date_from: Aikavälin alku "YYYY-MM-DD"
+            date_to: Aikavälin loppu "YYYY-MM-DD"
+
+        Returns:
+            Järjestetyt rivinumerot (ilman suodattimia kaikki rivit)
+        """
+        filters = {
+            "organisaatio": organisaatio,
+            "pykala": pykala,
+            "section_type": section_type,
+            "year": year,
+            "month": month,
+        }
+        postings = [self.posting(field, value) for field, value in filters.items() if value is not None]
+        if date_from or date_to:
+            lo, hi = self._date_bounds(date_from, date_to)
+            if postings and min(map(len, postings)) < hi - lo:
+                # Lyhyempi lista suodatetaan rivin päivämäärällä: halvempi kuin
+                # aikavälin rivien järjestäminen
+                first = encode_date(date_from) if date_from else 1
+                last = encode_date(date_to) if date_to else 99999999
+                row_dates = self.row_dates
+                return array("I", [
+                    row for row in intersect_postings(postings)
+                    if first <= row_dates[row] <= last
+                ])
+            postings.append(self.date_range(date_from, date_to))
+        if not postings:
+            return array("I", range(self.rows))
+        return intersect_postings(postings)
+
+    def values(self, field: str) -> list[str]:
+        """Palauta kentän indeksoidut arvot (esim. kaikki organisaatiot)."""
+        return list(self.postings.get(field, {}))
+
+    def close(self) -> None:
+        """Vapauta mmap (vain load():lla avatulle indeksille)."""
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self) -> "MetadataIndex":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+class MetadataIndexBuilder:
+    """
+    Rakentaa metatietoindeksin chunk kerrallaan.
+
+    Muistissa pidetään vain rivinumerot (4 tavua per rivi per kenttä).
+
+    Käyttö:
+        builder = MetadataIndexBuilder()
+        for chunk in chunks:
+            builder.add(chunk)
+        builder.write("106PDF_output/normalized_chunks.metaindex")
+    """
+
+    def __init__(self) -> None:
+        self.rows = 0
+        self._postings: dict[str, dict[str, array]] = {field: {} for field in INDEXED_FIELDS}
+        self._dates = array("I")
+        self._date_rows = array("I")
+        self._row_dates = array("I")
+        self._fingerprint = SourceFingerprint()
+
+    def add(self, chunk: dict[str, Any]) -> None:
+        """Lisää seuraava chunk (rivinumero = lisäysjärjestys)."""
+        row = self.rows
+        date_value, year, month = _date_keys(chunk.get("kokous_pvm"))
+        values = {
+            "organisaatio": chunk.get("organisaatio"),
+            "pykala": chunk.get("pykala"),
+            "section_type": chunk.get("section_type"),
+            "year": year,
+            "month": month,
+        }
+        for field, value in values.items():
+            if value is not None:
+                self._postings[field].setdefault(value, array("I")).append(row)
+        if date_value:
+            self._dates.append(date_value)
+            self._date_rows.append(row)
+        self._row_dates.append(date_value)
+        self._fingerprint.update(chunk.get("text", ""))
+        self.rows += 1
+
+    def _sorted_dates(self) -> tuple[array, array]:
+        """Järjestä päivämäärät (vakaa järjestys: sama pvm -> rivijärjestys)."""
+        order = sorted(range(len(self._dates)), key=self._dates.__getitem__)
+        return (
+            array("I", (self._dates[i] for i in order)),
+            array("I", (self._date_rows[i] for i in order)),
+        )
+
+    def build(self) -> MetadataIndex:
+        """Palauta muistissa oleva indeksi."""
+        dates, date_rows = self._sorted_dates()
+        index = MetadataIndex(self.rows, self._postings, dates, date_rows, self._row_dates)
+        index.source_fingerprint = self._fingerprint.hexdigest()
+        return index
+
+    def write(self, path: str | Path) -> None:
+        """
+        Kirjoita indeksi hakemistoon atomisesti (ks. atomic_dir).
+
+        Args:
+            path: Output-hakemisto
+        """
+        with atomic_directory(path) as staging:
+            dates, date_rows = self._sorted_dates()
+            offset = 0
+
+            def write_array(f: Any, values: array) -> list[int]:
+                nonlocal offset
+                values.tofile(f)
+                span = [offset, len(values)]
+                offset += len(values)
+                return span
+
+            with (staging / "postings.bin").open("wb") as f:
+                fields = {
+                    field: {value: write_array(f, rows) for value, rows in values.items()}
+                    for field, values in self._postings.items()
+                }
+                dates_span = write_array(f, dates)
+                date_rows_span = write_array(f, date_rows)
+                row_dates_span = write_array(f, self._row_dates)
+
+            manifest = {
+                "version": INDEX_VERSION,
+                "rows": self.rows,
+                "source_fingerprint": self._fingerprint.hexdigest(),
+                "byteorder": sys.byteorder,
+                "dates": dates_span,
+                "date_rows": date_rows_span,
+                "row_dates": row_dates_span,
+                "fields": fields,
+            }
+            with (staging / "manifest.json").open("w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,197 @@
+"""
+Lähes identtisten chunkkien tunnistus (MinHash + LSH).
+
+Tämä moduuli:
+- Pilkkoo tekstin sanatason shingleiksi; päivämäärät korvataan yhdellä
+  tokenilla, joten pelkät kokouspäivät eivät erota
+  muutoksenhakuohjeita ja allekirjoituslohkoja toisistaan
+- Laskee MinHash-allekirjoituksen (NUM_PERM kerto-siirto-hashia, numpy)
+- Ryhmittelee allekirjoitukset LSH-kaistoihin, joten jokaista chunkkia
+  verrataan vain saman kaistan (ja saman ryhmän) ehdokkaisiin (lineaarinen aika)
+- Hyväksyy ehdokkaan duplikaatiksi, jos arvioitu Jaccard-samankaltaisuus
+  on vähintään kynnysarvo
+
+Samankaltaisuus ei tunne tekstin merkitystä: saman pohjan päätökset (esim.
+avustuspäätökset, joissa eroavat vain pykälä, hakija ja summa) ylittävät
+helposti kynnyksen 0.7. Kutsujan on siksi rajattava indeksiin vain
+vakiotekstit (muutoksenhakuohjeet, allekirjoitukset) ja erotettava eri
+pykälät ryhmillä (group), ks. postprocess_docling_chunks.
+
+Käyttö:
+    index = NearDuplicateIndex(threshold=0.7)
+    for row, chunk in enumerate(chunks):
+        representative = index.add(chunk["text"], row, group=chunk["pykala"])
+        if representative is not None:
+            ...  # chunk on lähes identtinen rivin `representative` kanssa
+"""
+
+import re
+import zlib
+from functools import lru_cache
+
+import numpy as np
+
+# Konfiguraatiovakiot
+DEFAULT_THRESHOLD = 0.7  # Arvioitu Jaccard-samankaltaisuus, josta alkaen duplikaatti
+NUM_PERM = 128  # MinHash-funktioiden määrä (allekirjoitus 512 tavua)
+SHINGLE_SIZE = 3  # Sanaa per shingle
+SEED = 1
+
+_SHINGLE_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)  # Polynomihashin kerroin (mod 2^64)
+_DATE_PATTERN = re.compile(r"\d{1,2}\.\d{1,2}\.(?:\d{4}|\d{2})?")
+_PUNCTUATION = ".,;:!?()[]\"'-–"
+
+
+@lru_cache(maxsize=1 << 18)
+def _token_hash(token: str) -> int:
+    """
+    Sanan 32-bittinen hash (deterministinen, toisin kuin hash()).
+
+    Välimerkit poistetaan sanan reunoilta ja päivämäärät ("12.3.2024")
+    korvataan samalla tokenilla. Välimuistin ansiosta tämä lasketaan
+    kerran per erilainen sana.
+    """
+    word = token.strip(_PUNCTUATION)
+    if _DATE_PATTERN.fullmatch(word):
+        word = "pvm"
+    return zlib.crc32(word.encode("utf-8"))
+
+
+def shingle_hashes(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    """
+    Palauta tekstin uniikkien sanashinglejen 64-bittiset hashit.
+
+    Shinglen hash yhdistetään sen sanojen hasheista numpyllä, joten
+    shingle-merkkijonoja ei muodosteta.
+
+    Args:
+        text: Teksti
+        size: Sanaa per shingle
+
+    Returns:
+        uint64-taulukko (tyhjä tekstille ilman sanoja)
+    """
+    tokens = text.lower().split()
+    if not tokens:
+        return np.empty(0, dtype=np.uint64)
+    token_hashes = np.fromiter(map(_token_hash, tokens), dtype=np.uint64, count=len(tokens))
+    size = min(size, len(tokens))  # Lyhyt teksti on yksi shingle
+    count = len(tokens) - size + 1
+    shingles = np.zeros(count, dtype=np.uint64)
+    for offset in range(size):
+        shingles = shingles * _SHINGLE_MULTIPLIER + token_hashes[offset:offset + count]
+    return np.unique(shingles)
+
+
+@lru_cache(maxsize=None)
+def lsh_parameters(threshold: float, num_perm: int = NUM_PERM) -> tuple[int, int]:
+    """
+    Valitse kaistojen määrä ja kaistan leveys kynnysarvolle.
+
+    Valitaan (bands, rows), joka minimoi väärien positiivisten ja väärien
+    negatiivisten todennäköisyyksien summan (törmäystodennäköisyys
+    1 - (1 - s^rows)^bands integroituna kynnyksen ala- ja yläpuolella).
+
+    Args:
+        threshold: Jaccard-kynnys (0-1)
+        num_perm: Allekirjoituksen pituus
+
+    Returns:
+        (bands, rows), bands * rows <= num_perm
+    """
+    def collision(s: float, bands: int, rows: int) -> float:
+        return 1.0 - (1.0 - s ** rows) ** bands
+
+    steps = 100
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        below = sum(collision(threshold * (i + 0.5) / steps, bands, rows) for i in range(steps)) * threshold / steps
+        above = sum(
+            1.0 - collision(threshold + (1 - threshold) * (i + 0.5) / steps, bands, rows)
+            for i in range(steps)
+        ) * (1 - threshold) / steps
+        error = below + above
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+class NearDuplicateIndex:
+    """
+    Virtana täytettävä LSH-indeksi lähes identtisten tekstien tunnistukseen.
+
+    Muistissa pidetään vain säilytettyjen (ei-duplikaattien) tekstien
+    allekirjoitukset (num_perm * 4 tavua) ja kaistojen ämpärit.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, num_perm: int = NUM_PERM, seed: int = SEED) -> None:
+        """
+        Args:
+            threshold: Arvioitu Jaccard-samankaltaisuus, josta alkaen teksti on duplikaatti
+            num_perm: MinHash-funktioiden määrä
+            seed: Hash-funktioiden siemen (sama siemen -> sama tulos)
+        """
+        if not 0 < threshold <= 1:
+            raise ValueError(f"Kynnysarvon pitää olla välillä (0, 1]: {threshold}")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands, self.rows = lsh_parameters(threshold, num_perm)
+        rng = np.random.default_rng(seed)
+        # Kerto-siirto-hash: (a * x + b) mod 2^64, ylimmät 32 bittiä
+        self._a = rng.integers(1, 2**63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+        self._buckets: list[dict[bytes, list[int]]] = [{} for _ in range(self.bands)]
+        self._signatures: dict[int, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def signature(self, text: str) -> np.ndarray | None:
+        """MinHash-allekirjoitus (uint32 x num_perm), None tekstille ilman sanoja."""
+        hashes = shingle_hashes(text)
+        if len(hashes) == 0:
+            return None
+        permuted = (hashes[:, None] * self._a + self._b) >> np.uint64(32)
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def add(self, text: str, key: int, group: str | None = None) -> int | None:
+        """
+        Lisää teksti tai palauta sen lähes identtinen aiempi teksti.
+
+        Args:
+            text: Teksti
+            key: Tekstin tunniste (esim. säilytettyjen chunkkien järjestysnumero)
+            group: Ryhmä (esim. pykälä); tekstiä verrataan vain saman ryhmän
+                   teksteihin (None on oma ryhmänsä)
+
+        Returns:
+            Samankaltaisimman aiemman tekstin avain, jos samankaltaisuus on
+            vähintään kynnysarvo (tekstiä ei lisätä); muuten None (lisätty)
+        """
+        signature = self.signature(text)
+        if signature is None:
+            return None
+
+        prefix = b"\x00" if group is None else b"\x01" + group.encode("utf-8") + b"\x00"
+        band_keys = [
+            prefix + signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            for band in range(self.bands)
+        ]
+        best_key, best_similarity = None, 0.0
+        checked: set[int] = set()
+        for band, band_key in enumerate(band_keys):
+            for candidate in self._buckets[band].get(band_key, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                similarity = np.count_nonzero(signature == self._signatures[candidate]) / self.num_perm
+                if similarity > best_similarity:
+                    best_key, best_similarity = candidate, similarity
+        if best_key is not None and best_similarity >= self.threshold:
+            return best_key
+
+        self._signatures[key] = signature
+        for band, band_key in enumerate(band_keys):
+            self._buckets[band].setdefault(band_key, []).append(key)
+        return None
@@ -5,7 +5,8 @@ Tämä skripti:
 1. Normalisoi chunkit selkeään skeemaan
 2. Suodattaa taulukot pois pääindeksistä
 3. Poimii metatiedot (organisaatio, päivämäärä, pykälä)
-4. Deduplikoi toistuvat muutoksenhakuohjeet
+4. Deduplikoi toistuvat muutoksenhakuohjeet (identtiset SHA1:llä, lähes
+   identtiset MinHash/LSH:lla)
 5. Luo lopullisen RAG-indeksiformaatin
 """
 
@@ -15,11 +16,26 @@ import logging
 import os
 import re
 import sys
-from collections.abc import Iterator
+from collections import deque
+from contextlib import nullcontext
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
 from datetime import datetime
+from itertools import islice
 from pathlib import Path
 from typing import Any
 
+from chunk_shards import DEFAULT_SHARDS, PARTITIONS as SHARD_PARTITIONS, ShardedChunkWriter
+from chunk_store import ColumnarChunkWriter
+from dedup_stats import DedupStats
+from fix_source_paths import normalize_source_path
+from jsonl_io import iter_jsonl, write_json_streaming
+from metadata_index import MetadataIndexBuilder
+from near_duplicates import NearDuplicateIndex
+from section_index import SectionIndexBuilder
+from table_index import TableIndexBuilder
+from token_counter import TokenCounter
+
 # Konfiguroi logging
 logging.basicConfig(
     level=logging.INFO,
@@ -32,6 +48,11 @@ MIN_CHUNK_TOKENS = 30  # Vähimmäiskoko ennen yhdistämistä (mikrochunkit)
 TARGET_CHUNK_TOKENS = 384  # Tavoitekoko chunkille
 MAX_CHUNK_TOKENS = 512  # Maksimikoko chunkille
 TOKENS_PER_CHAR = 4  # Token-estimaatio: ~4 merkkiä per token
+MERGE_COUNT_BATCH = 256  # Yhdistettyjä chunkkeja per token-laskentaerä (tokenizer)
+# Lähes identtisten poisto koskee vain vakiotekstejä: muutoksenhakuohjeet ja
+# lyhyet "muu"-lohkot (allekirjoitukset, otsakkeet). Päätöstekstejä ei verrata.
+NEAR_DUPLICATE_SECTION_TYPES = ("muutoksenhaku",)
+NEAR_DUPLICATE_MAX_TOKENS = 60  # "muu"-chunkit tätä lyhyemmät
 
 
 # Organisaatiotunnisteet
@@ -99,6 +120,173 @@ def calculate_hash(text: str) -> str:
     return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
 
 
+class MetadataExtractor:
+    """
+    Poimii chunkin metatiedot esikäännetyillä säännöllisillä lausekkeilla.
+
+    Kaikki patternit käännetään kerran konstruktorissa, ja extract() täyttää
+    kaikki metatietokentät yhdellä kutsulla (teksti pienennetään vain kerran).
+    Tiedostopolusta johdetut tiedot lasketaan kerran per source_file ja
+    jaetaan saman dokumentin kaikille chunkeille ja taulukoille.
+    Tulokset ovat samat kuin moduulin extract_*-funktioilla, jotka käyttävät
+    oletusinstanssia.
+    """
+
+    def __init__(
+        self,
+        organisations: list[str] = ORGANISAATIOT,
+        section_patterns: dict[str, list[str]] = SECTION_PATTERNS,
+    ) -> None:
+        # Organisaatiot prioriteettijärjestyksessä (valmiiksi pienennettyinä)
+        self._organisations = [(org.lower(), org) for org in organisations]
+
+        # Yksi alternaatio per section-tyyppi (prioriteettijärjestyksessä)
+        self._section_types = [
+            (section_type, re.compile("|".join(f"(?:{p})" for p in patterns)))
+            for section_type, patterns in section_patterns.items()
+        ]
+
+        # Pykälät prioriteettijärjestyksessä: §, "pykälä", "pyk."
+        # (§-merkillä ei ole kirjainkokoa, joten IGNORECASE on turha)
+        self._section_res = [
+            re.compile(r"§\s*(\d+)"),
+            re.compile(r"pykälä\s+(\d+)", re.IGNORECASE),
+            re.compile(r"pyk\.\s*(\d+)", re.IGNORECASE),
+        ]
+
+        # Päivämäärä tiedostonimestä (esim. "... - 02.06.2025, klo 17_00.pdf")
+        self._filename_date_re = re.compile(r"(\d{2})\.(\d{2})\.(\d{4})")
+        # Päivämäärä tekstistä (10.11.2025). Vanha ISO-pattern (2025-11-10)
+        # ei voinut koskaan tuottaa tulosta (ryhmät luettiin d, m, y -järjestyksessä),
+        # joten sitä ei tarvitse ajaa.
+        self._text_date_re = re.compile(r"(\d{1,2})\.(\d{1,2})\.(\d{4})")
+
+        # Dokumenttikohtainen välimuisti: source_file -> polusta johdetut tiedot
+        self._document_cache: dict[str, dict[str, str | None]] = {}
+
+    def document_metadata(self, file_path: str) -> dict[str, str | None]:
+        """
+        Palauta tiedostopolusta johdetut metatiedot (lasketaan kerran per polku).
+
+        Args:
+            file_path: Lähdetiedoston polku
+
+        Returns:
+            Dict: organisaatio (polusta), kokous_pvm (tiedostonimestä, jos
+            järkevä) ja source_file (normalize_source_path-muodossa)
+        """
+        cached = self._document_cache.get(file_path)
+        if cached is None:
+            file_date = self.date_from_filename(file_path)
+            cached = {
+                "organisaatio": self.organisation_from_path(file_path),
+                "kokous_pvm": (
+                    f"{file_date.year:04d}-{file_date.month:02d}-{file_date.day:02d}"
+                    if is_plausible_year(file_date) else None
+                ),
+                "source_file": normalize_source_path(file_path),
+            }
+            self._document_cache[file_path] = cached
+        return cached
+
+    def organisation(self, text: str, file_path: str) -> str | None:
+        """Poimi organisaatio tiedostopolusta tai tekstin alusta (500 merkkiä)."""
+        org = self.document_metadata(file_path)["organisaatio"]
+        if org:
+            return org
+        return self._organisation_from_sample(text[:500].lower())
+
+    def organisation_from_path(self, file_path: str) -> str | None:
+        """Poimi organisaatio tiedostopolusta."""
+        return self._organisation_from_sample(file_path.lower())
+
+    def _organisation_from_sample(self, sample_lower: str) -> str | None:
+        for org_lower, org in self._organisations:
+            if org_lower in sample_lower:
+                return org
+        return None
+
+    def date_from_filename(self, path: str) -> datetime | None:
+        """Poimi päivämäärä tiedostonimestä datetime-objektina."""
+        match = self._filename_date_re.search(path)
+        if not match:
+            return None
+        d, m, y = match.groups()
+        try:
+            return datetime(int(y), int(m), int(d))
+        except ValueError:
+            return None
+
+    def date(self, text: str, file_path: str) -> str | None:
+        """Poimi päivämäärä tiedostonimestä (ensisijaisesti) tai tekstistä (1000 merkkiä)."""
+        return self.document_metadata(file_path)["kokous_pvm"] or self.date_from_text(text)
+
+    def date_from_text(self, text: str) -> str | None:
+        """Poimi ensimmäinen dd.mm.yyyy-päivämäärä tekstin alusta jos se on järkevä."""
+        match = self._text_date_re.search(text, 0, 1000)
+        if not match:
+            return None
+        d, m, y = match.groups()
+        year_int = int(y)
+        if not 2000 <= year_int <= 2035:
+            return None
+        try:
+            datetime(year_int, int(m), int(d))
+        except ValueError:
+            return None
+        return f"{year_int:04d}-{int(m):02d}-{int(d):02d}"
+
+    def section(self, text: str) -> str | None:
+        """Poimi pykälä (esim. "§ 81") tekstin alusta (500 merkkiä)."""
+        for pattern in self._section_res:
+            match = pattern.search(text, 0, 500)
+            if match:
+                return f"§ {match.group(1)}"
+        return None
+
+    def section_type(self, text_lower: str) -> str:
+        """Päättele section-tyyppi valmiiksi pienennetystä tekstistä."""
+        for section_type, pattern in self._section_types:
+            if pattern.search(text_lower):
+                return section_type
+        return "muu"
+
+    def extract(self, text: str, file_path: str) -> dict[str, str | None]:
+        """
+        Poimi kaikki metatiedot yhdellä kutsulla.
+
+        Args:
+            text: Chunkin teksti
+            file_path: Tiedostopolku
+
+        Returns:
+            Dict: organisaatio, kokous_pvm, pykala, section_type
+        """
+        text_lower = text.lower()
+        document = self.document_metadata(file_path)
+
+        organisaatio = document["organisaatio"]
+        if organisaatio is None:
+            # text[:500].lower() == text.lower()[:500] paitsi jos pienennys
+            # muuttaa merkkien määrää (esim. "İ")
+            if len(text_lower) == len(text):
+                sample_lower = text_lower[:500]
+            else:
+                sample_lower = text[:500].lower()
+            organisaatio = self._organisation_from_sample(sample_lower)
+
+        return {
+            "organisaatio": organisaatio,
+            "kokous_pvm": document["kokous_pvm"] or self.date_from_text(text),
+            "pykala": self.section(text),
+            "section_type": self.section_type(text_lower),
+        }
+
+
+# Oletusinstanssi moduulin funktioille
+_metadata_extractor = MetadataExtractor()
+
+
 def extract_organisation(text: str, file_path: str) -> str | None:
     """
     Poimi organisaatio tekstistä tai tiedostopolusta.
@@ -110,19 +298,7 @@ def extract_organisation(text: str, file_path: str) -> str | None:
     Returns:
         Organisaation nimi tai None
     """
-    # Tarkista ensin tiedostopolku
-    path_lower = file_path.lower()
-    for org in ORGANISAATIOT:
-        if org.lower() in path_lower:
-            return org
-
-    # Tarkista tekstistä (ensimmäiset 500 merkkiä)
-    text_sample = text[:500].lower()
-    for org in ORGANISAATIOT:
-        if org.lower() in text_sample:
-            return org
-
-    return None
+    return _metadata_extractor.organisation(text, file_path)
 
 
 def parse_date_from_filename(path: str) -> datetime | None:
@@ -135,15 +311,7 @@ def parse_date_from_filename(path: str) -> datetime | None:
     Returns:
         datetime-objekti tai None
     """
-    # Etsi päivämäärä tiedostonimestä (esim. "Pöytäkirja-Kaupunginvaltuusto - 02.06.2025, klo 17_00.pdf")
-    match = re.search(r"(\d{2}\.\d{2}\.\d{4})", path)
-    if not match:
-        return None
-
-    try:
-        return datetime.strptime(match.group(1), "%d.%m.%Y")
-    except ValueError:
-        return None
+    return _metadata_extractor.date_from_filename(path)
 
 
 def is_plausible_year(date_obj: datetime | None) -> bool:
@@ -170,38 +338,9 @@ def extract_date(text: str, file_path: str) -> str | None:
         file_path: Tiedostopolku
 
     Returns:
-        Päivämäärä YYYY-MM-DD -muodossa tai None
+        Päivämäärä YYYY-MM-DD -muodossa tai None (EI 1123-01-01 -placeholderia)
     """
-    # 1. Ensisijaisesti: tiedostonimi
-    file_date = parse_date_from_filename(file_path)
-    if is_plausible_year(file_date):
-        return file_date.strftime("%Y-%m-%d")
-
-    # 2. Backup: etsi päivämäärä tekstistä (dd.mm.yyyy)
-    date_patterns = [
-        r"(\d{1,2})\.(\d{1,2})\.(\d{4})",  # 10.11.2025
-        r"(\d{4})-(\d{1,2})-(\d{1,2})",  # 2025-11-10
-    ]
-
-    text_sample = text[:1000]  # Tarkista ensimmäiset 1000 merkkiä
-
-    for pattern in date_patterns:
-        match = re.search(pattern, text_sample)
-        if match:
-            if len(match.groups()) == 3:
-                d, m, y = match.groups()
-                try:
-                    year_int = int(y)
-                    # Tarkista että vuosi on järkevä
-                    if 2000 <= year_int <= 2035:
-                        date_obj = datetime(year_int, int(m), int(d))
-                        if is_plausible_year(date_obj):
-                            return date_obj.strftime("%Y-%m-%d")
-                except (ValueError, TypeError):
-                    continue
-
-    # 3. Jos ei löydy, palauta None (EI 1123-01-01 -placeholderia)
-    return None
+    return _metadata_extractor.date(text, file_path)
 
 
 def extract_section(text: str) -> str | None:
@@ -214,21 +353,7 @@ def extract_section(text: str) -> str | None:
     Returns:
         Pykälä (esim. "§ 81") tai None
     """
-    # Etsi §-merkki
-    section_patterns = [
-        r"§\s*(\d+)",
-        r"pykälä\s+(\d+)",
-        r"pyk\.\s*(\d+)",
-    ]
-
-    text_sample = text[:500]  # Tarkista ensimmäiset 500 merkkiä
-
-    for pattern in section_patterns:
-        match = re.search(pattern, text_sample, re.IGNORECASE)
-        if match:
-            return f"§ {match.group(1)}"
-
-    return None
+    return _metadata_extractor.section(text)
 
 
 def detect_section_type(text: str) -> str:
@@ -241,15 +366,46 @@ def detect_section_type(text: str) -> str:
     Returns:
         Section-tyyppi: "paatos", "perustelut", "muutoksenhaku", "talous", "muu"
     """
-    text_lower = text.lower()
+    return _metadata_extractor.section_type(text.lower())
 
-    # Tarkista patternit järjestyksessä
-    for section_type, patterns in SECTION_PATTERNS.items():
-        for pattern in patterns:
-            if re.search(pattern, text_lower):
-                return section_type
 
-    return "muu"
+class SectionPropagator:
+    """
+    Periyttää pykälän dokumentin peräkkäisille chunkeille.
+
+    extract_section() etsii pykälää vain chunkin alusta, joten pykälän
+    jatko-osat (esittely, päätös, muutoksenhaku) jäävät ilman pykälää.
+    Chunkit tulevat dokumentin järjestyksessä, joten viimeisin pykälä on
+    voimassa seuraavaan pykälään tai dokumentin vaihtumiseen asti. Tila on
+    nykyinen dokumentti ja pykälä, joten passi kulkee normalisoinnin virrassa
+    ilman erillistä läpikäyntiä.
+    """
+
+    def __init__(self) -> None:
+        self._source_file: str | None = None
+        self._pykala: str | None = None
+
+    def fill(self, chunk: dict[str, Any]) -> bool:
+        """
+        Päivitä nykyinen pykälä chunkista tai täydennä chunkin puuttuva pykälä.
+
+        Args:
+            chunk: Normalisoitu chunk (muokataan paikallaan)
+
+        Returns:
+            True, jos pykälä periytettiin edellisestä chunkista
+        """
+        source_file = chunk.get("source_file")
+        if source_file != self._source_file:
+            self._source_file = source_file
+            self._pykala = None
+        if chunk.get("pykala"):
+            self._pykala = chunk["pykala"]
+            return False
+        if self._pykala:
+            chunk["pykala"] = self._pykala
+            return True
+        return False
 
 
 def is_table_chunk(chunk: dict[str, Any]) -> bool:
@@ -271,8 +427,11 @@ def is_table_chunk(chunk: dict[str, Any]) -> bool:
                     return True
                 if hasattr(item, "label") and str(item.label) == "table":
                     return True
+            if any(isinstance(item, dict) and item.get("ref") for item in metadata["doc_items"]):
+                # Uusi ingest (elementtiviittaukset): Doclingin label on luotettava
+                return False
 
-    # Tarkista myös tekstistä (taulukot sisältävät usein | merkkejä)
+    # Vanhat datasetit: tarkista myös tekstistä (taulukot sisältävät usein | merkkejä)
     text = chunk.get("text", "") or chunk.get("contextualized_text", "")
     if "|" in text and text.count("|") > 5:
         # Voi olla markdown-taulukko
@@ -283,6 +442,39 @@ def is_table_chunk(chunk: dict[str, Any]) -> bool:
     return False
 
 
+def table_record(chunk: dict[str, Any], source_file: str) -> dict[str, Any]:
+    """
+    Muodosta taulukkochunkista tables_normalized.jsonl:n rivi.
+
+    Suhteellinen polku sekä polusta johdettu organisaatio ja pvm lasketaan
+    kerran per dokumentti. Jos ingest kirjoitti taulukoiden solut
+    sivutiedostoon, rivi viittaa siihen (table_cells) ja chunkin
+    taulukoihin (table_refs), joten soluja ei tarvitse jäsentää tekstistä.
+
+    Args:
+        chunk: Taulukkochunk Doclingista
+        source_file: Alkuperäinen lähdetiedoston polku
+
+    Returns:
+        Taulukon tiedot
+    """
+    table_text = chunk.get("contextualized_text") or chunk.get("text", "")
+    table_data = {
+        "source_file": _metadata_extractor.document_metadata(source_file)["source_file"],
+        "text": table_text,
+        "organisaatio": extract_organisation(table_text, source_file),
+        "kokous_pvm": extract_date(table_text, source_file),
+    }
+    metadata = chunk.get("metadata", {})
+    if metadata.get("table_cells"):
+        table_data["table_cells"] = metadata["table_cells"]
+        table_data["table_refs"] = [
+            item["ref"] for item in metadata.get("doc_items", [])
+            if item.get("label") == "table" and item.get("ref")
+        ]
+    return table_data
+
+
 def estimate_tokens(text: str) -> int:
     """
     Arvioi tokenien määrä tekstistä (nopea arvio: ~4 merkkiä per token).
@@ -296,13 +488,30 @@ def estimate_tokens(text: str) -> int:
     return len(text) // TOKENS_PER_CHAR
 
 
+def count_tokens(text: str, token_counter: TokenCounter | None = None) -> int:
+    """
+    Laske tekstin tokenit: tokenizerilla, jos annettu, muuten arviona.
+
+    Args:
+        text: Teksti
+        token_counter: Tokenizer-pohjainen laskuri (None = estimate_tokens)
+
+    Returns:
+        Tokenien määrä
+    """
+    if token_counter is None:
+        return estimate_tokens(text)
+    return token_counter.count(text)
+
+
 def normalize_chunk(
     chunk: dict[str, Any],
     document_index: int,
     source_file: str,
-    seen_hashes: set[str],
+    seen_hashes: set[str] | None,
     min_tokens: int = 150,
     max_tokens: int = 512,
+    token_counter: TokenCounter | None = None,
 ) -> dict[str, Any] | None:
     """
     Normalisoi yksi chunk lopulliseen skeemaan.
@@ -312,6 +521,8 @@ def normalize_chunk(
         document_index: Dokumentin indeksi
         source_file: Lähdetiedoston polku
         seen_hashes: Set nähtyjä hasheja deduplikaatiota varten
+                     (None = ei deduplikaatiota, kutsuja hoitaa sen itse)
+        token_counter: Tokenizer-pohjainen laskuri (None = arvio merkkimäärästä)
 
     Returns:
         Normalisoitu chunk tai None jos se pitää jättää pois
@@ -322,8 +533,11 @@ def normalize_chunk(
     if not text or len(text.strip()) < 10:
         return None  # Liian lyhyt chunk
 
+    # Laske hash deduplikaatiota varten
+    text_hash = calculate_hash(text)
+
     # Tarkista tokenien määrä
-    estimated_tokens = estimate_tokens(text)
+    estimated_tokens = count_tokens(text, token_counter)
 
     # Filtteröi liian lyhyet chunkit (mikrochunkit)
     if estimated_tokens < MIN_CHUNK_TOKENS:
@@ -347,23 +561,19 @@ def normalize_chunk(
             f"(max: {max_tokens})"
         )
 
-    # Laske hash deduplikaatiota varten
-    text_hash = calculate_hash(text)
-
     # Deduplikaatio: jos hash on jo nähty, jätä pois
-    if text_hash in seen_hashes:
-        return None
+    if seen_hashes is not None:
+        if text_hash in seen_hashes:
+            return None
+        seen_hashes.add(text_hash)
+
+    # Poimi metatiedot yhdellä kutsulla (päivämäärä: tiedostonimi ensin, sitten teksti).
+    # Polusta johdetut tiedot ja suhteellinen polku lasketaan kerran per dokumentti.
+    metadata = _metadata_extractor.extract(text, source_file)
+    source_relative = _metadata_extractor.document_metadata(source_file)["source_file"]
+    organisaatio = metadata["organisaatio"]
+    kokous_pvm = metadata["kokous_pvm"]
 
-    seen_hashes.add(text_hash)
-
-    # Poimi metatiedot ja normalisoi source_file-poluksi suhteellinen polku
-    source_relative = normalize_source_path(source_file)
-
-    organisaatio = extract_organisation(text, source_file)
-    
-    # Poimi päivämäärä (tiedostonimi ensin, sitten teksti)
-    kokous_pvm = extract_date(text, source_file)
-    
     # Korjauspassi: jos päivämäärä on 1123, yritä uudestaan
     if kokous_pvm and kokous_pvm.startswith("1123-"):
         # Yritä uudestaan: ensin tiedostonimi, sitten tekstipvm; jos ei onnistu -> None
@@ -377,9 +587,9 @@ def normalize_chunk(
                 kokous_pvm = text_date_str
             else:
                 kokous_pvm = None
-    
-    pykala = extract_section(text)
-    section_type = detect_section_type(text)
+
+    pykala = metadata["pykala"]
+    section_type = metadata["section_type"]
 
     # Rakenna lopullinen chunk
     final_chunk = {
@@ -399,80 +609,170 @@ def normalize_chunk(
     return final_chunk
 
 
+def _sections_compatible(run_section: str, section: str) -> bool:
+    """Sama section_type tai toinen on "muu"."""
+    return run_section == section or run_section == "muu" or section == "muu"
+
+
+def _join_run(run: list[dict[str, Any]]) -> dict[str, Any]:
+    """
+    Muodosta yksi chunk vähintään kahden chunkin ajosta (teksti yhdistetään
+    ja hashataan kerran).
+
+    Ensimmäisen chunkin kentät (myös pykälä, ks. iter_merge_small_chunks)
+    säilyvät; chunk_index on pienin.
+    """
+    merged = run[0].copy()
+    merged["text"] = "\n\n".join(chunk.get("text", "") for chunk in run)
+    merged["chunk_index"] = min(chunk.get("chunk_index", 0) for chunk in run)
+    merged["hash"] = calculate_hash(merged["text"])
+    return merged
+
+
+def iter_merge_small_chunks(
+    chunks: Iterable[dict[str, Any]],
+    min_tokens: int = MIN_CHUNK_TOKENS,
+    target_tokens: int = TARGET_CHUNK_TOKENS,
+    token_counter: TokenCounter | None = None,
+    max_tokens: int | None = None,
+) -> Iterator[dict[str, Any]]:
+    """
+    Pakkaa peräkkäiset chunkit ahneesti kohti tavoitekokoa virtana.
+
+    Ajoon lisätään seuraava chunk, jos se on samasta dokumentista ja
+    organisaatiosta, section_type on yhteensopiva (sama tai toinen "muu"),
+    chunk ei aloita uutta pykälää (sen pykälä on tyhjä tai sama kuin ajon;
+    pykälällinen chunk ei liity pykälättömään ajoon) ja
+    - ajo on vielä liian lyhyt (< min_tokens) ja yhdistetty koko on
+      korkeintaan target_tokens * 1.5 (eikä max_tokens), tai
+    - ajo ja chunk ovat pelkkiä lyhyitä chunkkeja (kukin < min_tokens) ja
+      yhdistetty koko on korkeintaan target_tokens (pirstaleiset ajot).
+    Vähintään min_tokens-kokoisia chunkkeja ei pakata keskenään.
+
+    Ajon koko pidetään yllä inkrementaalisesti: arviossa merkkimäärästä,
+    tokenizerilla chunkkien token-määrien summana (välimerkkinä oleva
+    tyhjä rivi ei lisää tokeneita). Summa on vain yhdistämispäätöksen arvio:
+    tokenizerin kanssa yhdistettyjen tekstien todelliset määrät lasketaan
+    välimuistiin erissä (MERGE_COUNT_BATCH), joten tilastot ja tallennettu
+    välimuisti eivät sisällä arvioita. Jokainen chunk mitataan kerran, ja
+    yhdistetty teksti muodostetaan ja hashataan kerran per tulos-chunk.
+    Yhdistämättömät chunkit palautetaan sellaisinaan (ei kopiota).
+
+    Args:
+        chunks: Iteroitava normalisoituja chunkkeja
+        min_tokens: Vähimmäiskoko ennen yhdistämistä
+        target_tokens: Tavoitekoko
+        token_counter: Tokenizer-pohjainen laskuri (None = arvio merkkimäärästä);
+                       yhdistetyt tekstit tokenisoidaan erissä sen välimuistiin
+        max_tokens: Yhdistetyn chunkin ehdoton yläraja (esim. embedding-mallin
+                    maksimipituus); None = vain target_tokens * 1.5
+
+    Yields:
+        Yhdistetyt chunkit alkuperäisessä järjestyksessä
+    """
+    merge_limit = target_tokens * 1.5 if max_tokens is None else min(target_tokens * 1.5, max_tokens)
+    separator_chars = len("\n\n")
+    run: list[dict[str, Any]] = []
+    run_tokens = 0
+    run_chars = 0
+    run_section = "muu"
+    run_pykala = None
+    run_small = False  # Kaikki ajon chunkit < min_tokens
+    output: list[dict[str, Any]] = []  # Erä tuloksia, joiden yhdistetyt tekstit lasketaan kerralla
+    joined_texts: list[str] = []
+
+    def emit(run: list[dict[str, Any]]) -> None:
+        if len(run) == 1:
+            output.append(run[0])
+            return
+        merged = _join_run(run)
+        output.append(merged)
+        if token_counter is not None:
+            joined_texts.append(merged["text"])
+
+    def flush() -> list[dict[str, Any]]:
+        if joined_texts:
+            token_counter.count_batch(joined_texts)
+            joined_texts.clear()
+        batch = output.copy()
+        output.clear()
+        return batch
+
+    for chunk in chunks:
+        text = chunk.get("text", "")
+        if token_counter is None:
+            tokens = len(text) // TOKENS_PER_CHAR  # estimate_tokens
+        else:
+            tokens = token_counter.count(text)
+        section = chunk.get("section_type", "muu")
+        pykala = chunk.get("pykala")
+        small = tokens < min_tokens
+
+        # Uusi pykälä tai ajo jo riittävän kokoinen: aloita uusi ilman muita tarkistuksia
+        if (
+            run
+            and (not pykala or pykala == run_pykala)
+            and (run_tokens < min_tokens or (run_small and small))
+        ):
+            if token_counter is None:
+                combined_tokens = (run_chars + separator_chars + len(text)) // TOKENS_PER_CHAR
+            else:
+                combined_tokens = run_tokens + tokens
+            first = run[0]
+            if (
+                first.get("source_file") == chunk.get("source_file")
+                and first.get("organisaatio") == chunk.get("organisaatio")
+                and _sections_compatible(run_section, section)
+                and (
+                    (run_tokens < min_tokens and combined_tokens <= merge_limit)
+                    or (run_small and small and combined_tokens <= target_tokens)
+                )
+            ):
+                run.append(chunk)
+                run_tokens = combined_tokens
+                run_chars += separator_chars + len(text)
+                if run_section == "muu":
+                    run_section = section
+                run_small = run_small and small
+                continue
+        if run:
+            emit(run)
+            if len(output) >= MERGE_COUNT_BATCH:
+                yield from flush()
+
+        run = [chunk]
+        run_tokens = tokens
+        run_chars = len(text)
+        run_section = section
+        run_pykala = pykala
+        run_small = small
+
+    if run:
+        emit(run)
+    yield from flush()
+
+
 def merge_small_chunks(
     chunks: list[dict[str, Any]],
     min_tokens: int = MIN_CHUNK_TOKENS,
     target_tokens: int = TARGET_CHUNK_TOKENS,
+    token_counter: TokenCounter | None = None,
+    max_tokens: int | None = None,
 ) -> list[dict[str, Any]]:
     """
-    Yhdistä liian lyhyet chunkit seuraavaan chunkkiin.
+    Pakkaa peräkkäiset lyhyet chunkit (ks. iter_merge_small_chunks).
 
     Args:
         chunks: Lista normalisoituja chunkkeja
         min_tokens: Vähimmäiskoko ennen yhdistämistä
         target_tokens: Tavoitekoko
+        token_counter: Tokenizer-pohjainen laskuri (None = arvio merkkimäärästä)
+        max_tokens: Yhdistetyn chunkin ehdoton yläraja (None = vain target_tokens * 1.5)
 
     Returns:
         Yhdistetty lista chunkkeja
     """
-    if not chunks:
-        return []
-
-    merged = []
-    i = 0
-
-    while i < len(chunks):
-        current = chunks[i].copy()
-        current_tokens = estimate_tokens(current.get("text", ""))
-
-        # Jos chunk on liian lyhyt, yritä yhdistää seuraavaan
-        if current_tokens < min_tokens and i + 1 < len(chunks):
-            next_chunk = chunks[i + 1]
-
-            # Yhdistä vain jos:
-            # 1. Molemmat ovat samasta dokumentista
-            # 2. Sama organisaatio
-            # 3. Sama section_type (tai toinen on "muu")
-            # 4. Yhdistetty koko ei ylitä target_tokens * 1.5
-            if (
-                current.get("source_file") == next_chunk.get("source_file")
-                and current.get("organisaatio") == next_chunk.get("organisaatio")
-            ):
-                # Tarkista section_type-yhteensopivuus
-                current_section = current.get("section_type", "muu")
-                next_section = next_chunk.get("section_type", "muu")
-                sections_compatible = (
-                    current_section == next_section
-                    or current_section == "muu"
-                    or next_section == "muu"
-                )
-
-                if sections_compatible:
-                    combined_text = current.get("text", "") + "\n\n" + next_chunk.get("text", "")
-                    combined_tokens = estimate_tokens(combined_text)
-
-                    if combined_tokens <= target_tokens * 1.5:
-                        # Yhdistä chunkit
-                        current["text"] = combined_text
-                        current["chunk_index"] = min(
-                            current.get("chunk_index", 0),
-                            next_chunk.get("chunk_index", 0),
-                        )
-                        # Yhdistä pykälät jos saatavilla
-                        if not current.get("pykala") and next_chunk.get("pykala"):
-                            current["pykala"] = next_chunk.get("pykala")
-                        # Päivitä hash
-                        current["hash"] = calculate_hash(combined_text)
-                        i += 1  # Ohita seuraava chunk (se on nyt yhdistetty)
-                    else:
-                        # Liian suuri yhdistettynä, jätä nykyinen sellaisenaan
-                        pass
-            # Jos eivät täytä ehtoja, jätä nykyinen sellaisenaan
-
-        merged.append(current)
-        i += 1
-
-    return merged
+    return list(iter_merge_small_chunks(chunks, min_tokens, target_tokens, token_counter, max_tokens))
 
 
 def process_combined_dataset(
@@ -483,6 +783,9 @@ def process_combined_dataset(
     max_tokens: int = MAX_CHUNK_TOKENS,
     merge_small: bool = True,
     target_tokens: int = TARGET_CHUNK_TOKENS,
+    dedup_report: str | Path | None = None,
+    token_counter: TokenCounter | None = None,
+    propagate_sections: bool = True,
 ) -> dict[str, Any]:
     """
     Prosessoi yhdistetyn Docling-datasetin ja normalisoi chunkit.
@@ -491,6 +794,11 @@ def process_combined_dataset(
         input_json: Polku combined_chunks_only.json -tiedostoon
         output_json: Polku output JSON-tiedostoon
         output_jsonl: Polku output JSONL-tiedostoon (valinnainen)
+        dedup_report: Polku deduplikaatioraportille
+                      (oletus: dedup_report.json output_json:n vieressä)
+        token_counter: Tokenizer-pohjainen laskuri (None = arvio merkkimäärästä)
+        propagate_sections: Periytä pykälä dokumentin seuraaville chunkeille
+                            (ks. SectionPropagator)
 
     Returns:
         Yhteenveto prosessoinnista
@@ -508,13 +816,15 @@ def process_combined_dataset(
 
     # Prosessoi chunkit
     final_chunks = []
-    seen_hashes: set[str] = set()
-    hash_counts: dict[str, int] = {}  # Laske hashien esiintymät deduplikaation debug:ia varten
+    seen_hashes: dict[str, str] = {}  # hash -> edustajan chunk-id
+    dedup = DedupStats()  # Klusterit ja esimerkit kerätään samalla läpikäynnillä
+    propagator = SectionPropagator() if propagate_sections else None
     tables: list[dict[str, Any]] = []  # Tallenna taulukot erilliseen tiedostoon
     tables_count = 0
     duplicates_count = 0
     processed_count = 0
     too_short_count = 0
+    propagated_count = 0
 
     _log.info("Aloitetaan normalisointi...")
 
@@ -528,42 +838,37 @@ def process_combined_dataset(
 
         # Tarkista onko taulukko
         if is_table_chunk(chunk):
-            # Normalisoi source_file-poluksi suhteellinen polku
-            source_relative = normalize_source_path(source_file)
-            
             # Tallenna taulukko erilliseen listaan
-            table_data = {
-                "source_file": source_relative,
-                "text": chunk.get("contextualized_text") or chunk.get("text", ""),
-                "organisaatio": extract_organisation(
-                    chunk.get("contextualized_text") or chunk.get("text", ""), source_file
-                ),
-                "kokous_pvm": extract_date(
-                    chunk.get("contextualized_text") or chunk.get("text", ""), source_file
-                ),
-            }
-            tables.append(table_data)
+            tables.append(table_record(chunk, source_file))
             tables_count += 1
             continue
 
-        # Laske hash deduplikaation debug:ia varten (ennen normalisointia)
-        chunk_text = chunk.get("contextualized_text") or chunk.get("text", "")
-        if chunk_text:
-            text_hash = calculate_hash(chunk_text)
-            hash_counts[text_hash] = hash_counts.get(text_hash, 0) + 1
-
-        # Normalisoi chunk
+        # Normalisoi chunk (hash lasketaan kerran normalize_chunkissa)
         normalized = normalize_chunk(
-            chunk, document_index, source_file, seen_hashes, min_tokens, max_tokens
+            chunk, document_index, source_file, None, min_tokens, max_tokens, token_counter
         )
 
+        # Liian lyhyt: jätä pois
         if normalized is None:
-            # Tarkista miksi jätettiin pois
             duplicates_count += 1
             continue
 
+        # Ennen deduplikaatiota, jotta poistettavankin chunkin pykälä jää voimaan
+        if propagator and propagator.fill(normalized):
+            propagated_count += 1
+
+        # Identtinen kuin aiempi chunk: jätä pois
+        text_hash = normalized["hash"]
+        representative_id = seen_hashes.get(text_hash)
+        if representative_id is not None:
+            dedup.add_duplicate(text_hash, representative_id, normalized["text"])
+            duplicates_count += 1
+            continue
+        seen_hashes[text_hash] = normalized["id"]
+        dedup.add_unique()
+
         # Tarkista onko liian lyhyt (yhdistetään myöhemmin)
-        if estimate_tokens(normalized.get("text", "")) < MIN_CHUNK_TOKENS:
+        if count_tokens(normalized["text"], token_counter) < MIN_CHUNK_TOKENS:
             too_short_count += 1
 
         final_chunks.append(normalized)
@@ -573,25 +878,28 @@ def process_combined_dataset(
     _log.info("NORMALISOINTI VALMIS!")
     _log.info(f"{'='*60}")
     # Laske token-tilastot
-    token_stats = [estimate_tokens(c.get("text", "")) for c in final_chunks]
+    token_stats = [count_tokens(c.get("text", ""), token_counter) for c in final_chunks]
     avg_tokens = sum(token_stats) / len(token_stats) if token_stats else 0
 
     _log.info(f"Alkuperäisiä chunkkeja: {len(chunks)}")
     _log.info(f"Normalisoituja chunkkeja: {len(final_chunks)}")
     _log.info(f"Taulukoita tallennettu: {tables_count}")
     _log.info(f"Duplikaatteja jätetty pois: {duplicates_count}")
+    _log.info(f"Pykälä periytetty edellisestä chunkista: {propagated_count}")
     _log.info(f"Liian lyhyitä chunkkeja (<{MIN_CHUNK_TOKENS} tokenia): {too_short_count}")
 
     # Yhdistä liian lyhyet chunkit
     if merge_small:
         _log.info(f"\nYhdistetään liian lyhyet chunkit (<{min_tokens} tokenia)...")
         before_merge = len(final_chunks)
-        final_chunks = merge_small_chunks(final_chunks, min_tokens, target_tokens)
+        # Oikeilla token-määrillä yhdistetty chunk ei saa ylittää mallin rajaa
+        merge_max = max_tokens if token_counter is not None else None
+        final_chunks = merge_small_chunks(final_chunks, min_tokens, target_tokens, token_counter, merge_max)
         after_merge = len(final_chunks)
         _log.info(f"Yhdistetty: {before_merge} → {after_merge} chunkkia")
 
     # Laske token-tilastot
-    token_stats = [estimate_tokens(c.get("text", "")) for c in final_chunks]
+    token_stats = [count_tokens(c.get("text", ""), token_counter) for c in final_chunks]
     avg_tokens = sum(token_stats) / len(token_stats) if token_stats else 0
 
     _log.info(f"\nKeskimääräinen chunk-koko: ~{avg_tokens:.0f} tokenia")
@@ -601,30 +909,18 @@ def process_combined_dataset(
     # Laske kuinka monta chunkkia on tavoite-alueella
     target_range = [
         c for c in final_chunks
-        if target_tokens * 0.7 <= estimate_tokens(c.get("text", "")) <= max_tokens
+        if target_tokens * 0.7 <= count_tokens(c.get("text", ""), token_counter) <= max_tokens
     ]
     _log.info(f"Chunkkeja tavoite-alueella ({int(target_tokens * 0.7)}-{max_tokens} tokenia): {len(target_range)}/{len(final_chunks)} ({len(target_range)/len(final_chunks)*100:.1f}%)")
     
     _log.info(f"{'='*60}\n")
 
-    # Deduplikaation debug-logit
+    # Deduplikaation debug-logit (kerätty jo läpikäynnin aikana)
     _log.info("Deduplikaation debug-tilastot:")
-    top_hashes = sorted(hash_counts.items(), key=lambda x: -x[1])[:10]
-    _log.info(f"Top-10 hashit (eniten esiintymiä):")
-    for i, (hash_val, count) in enumerate(top_hashes, 1):
-        if count > 1:  # Näytä vain duplikaatit
-            # Etsi esimerkkiteksti tälle hashille
-            example_text = None
-            for chunk in chunks:
-                chunk_text = chunk.get("contextualized_text") or chunk.get("text", "")
-                if calculate_hash(chunk_text) == hash_val:
-                    example_text = chunk_text[:200]  # Ensimmäiset 200 merkkiä
-                    break
-            _log.info(
-                f"  {i}. Hash {hash_val[:16]}...: {count} esiintymää"
-            )
-            if example_text:
-                _log.info(f"     Esimerkki: {example_text}...")
+    dedup.log_top(10)
+    report_path = Path(dedup_report) if dedup_report else Path(output_json).parent / "dedup_report.json"
+    dedup.write_report(report_path)
+    _log.info(f"✅ Deduplikaatioraportti: {report_path}")
 
     _log.info(f"{'='*60}\n")
 
@@ -637,6 +933,9 @@ def process_combined_dataset(
                 f.write(json.dumps(table, ensure_ascii=False) + "\n")
         _log.info(f"✅ Taulukot tallennettu: {len(tables)} taulukkoa")
 
+    if token_counter is not None:
+        token_counter.save()
+
     # Tallenna JSON
     output_path = Path(output_json)
     output_path.parent.mkdir(parents=True, exist_ok=True)
@@ -644,7 +943,7 @@ def process_combined_dataset(
     # Laske token-tilastot
     token_stats = []
     for chunk in final_chunks:
-        tokens = estimate_tokens(chunk.get("text", ""))
+        tokens = count_tokens(chunk.get("text", ""), token_counter)
         token_stats.append(tokens)
 
     avg_tokens = sum(token_stats) / len(token_stats) if token_stats else 0
@@ -658,6 +957,7 @@ def process_combined_dataset(
             "tables_saved": tables_count,
             "duplicates_filtered": duplicates_count,
             "too_short_before_merge": too_short_count,
+            "pykala_propagated": propagated_count,
             "processing_date": data.get("metadata", {}).get("processing_date", ""),
             "chunk_size_stats": {
                 "avg_tokens": round(avg_tokens, 1),
@@ -685,6 +985,530 @@ def process_combined_dataset(
     return output_data
 
 
+def iter_input_chunks(
+    input_path: str | Path,
+    input_metadata: dict[str, Any] | None = None,
+) -> Iterator[dict[str, Any]]:
+    """
+    Lue Docling-chunkit tiedostosta.
+
+    JSONL-tiedosto (combined_chunks.jsonl) luetaan rivi kerrallaan ja sen
+    metadata viereisestä combined_metadata.json -tiedostosta. JSON-tiedosto
+    (combined_chunks_only.json) on ladattava kokonaan, joten suurilla
+    aineistoilla kannattaa käyttää JSONL-syötettä.
+
+    Args:
+        input_path: Polku combined_chunks.jsonl tai combined_chunks_only.json -tiedostoon
+        input_metadata: Jos annettu, ingest-ajon metadata päivitetään tähän
+
+    Yields:
+        Chunk-dictit syötejärjestyksessä
+    """
+    input_path = Path(input_path)
+    if input_metadata is None:
+        input_metadata = {}
+
+    if input_path.suffix == ".jsonl":
+        metadata_path = input_path.parent / "combined_metadata.json"
+        if metadata_path.exists():
+            with metadata_path.open("r", encoding="utf-8") as f:
+                input_metadata.update(json.load(f))
+        yield from iter_jsonl(input_path)
+    else:
+        with input_path.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+        input_metadata.update(data.get("metadata", {}))
+        yield from data.get("chunks", [])
+
+
+def prepare_chunk(
+    chunk: dict[str, Any],
+    min_tokens: int = MIN_CHUNK_TOKENS,
+    max_tokens: int = MAX_CHUNK_TOKENS,
+    token_counter: TokenCounter | None = None,
+) -> tuple[str, str | None, Any, int]:
+    """
+    Esikäsittele yksi chunk ilman globaalia tilaa (taulukkotunnistus,
+    metatiedot, hash ja token-määrä). Deduplikaatio tehdään myöhemmin
+    järjestyksessä.
+
+    Args:
+        chunk: Alkuperäinen chunk Doclingista
+        min_tokens: Vähimmäiskoko
+        max_tokens: Maksimikoko
+        token_counter: Tokenizer-pohjainen laskuri (None = arvio merkkimäärästä)
+
+    Returns:
+        ("table", None, taulukko-dict, 0) taulukoille,
+        ("chunk", hash, normalisoitu chunk, tokenit) normalisoiduille chunkeille tai
+        ("skipped", None, None, 0) liian lyhyille
+    """
+    # Hae lähdetiedosto
+    source_file = chunk.get("metadata", {}).get("source_file", "")
+    document_index = chunk.get("metadata", {}).get("document_index", 0)
+
+    # Tarkista onko taulukko
+    if is_table_chunk(chunk):
+        return "table", None, table_record(chunk, source_file), 0
+
+    normalized = normalize_chunk(
+        chunk, document_index, source_file, None, min_tokens, max_tokens, token_counter
+    )
+
+    if normalized is None:
+        return "skipped", None, None, 0
+    tokens = count_tokens(normalized["text"], token_counter)  # Välimuistista
+    return "chunk", normalized["hash"], normalized, tokens
+
+
+# Työprosessin token-laskuri (asetetaan kerran per prosessi, ks. _init_worker)
+_worker_token_counter: TokenCounter | None = None
+
+
+def _init_worker(token_counter: TokenCounter | None) -> None:
+    """Aseta työprosessin token-laskuri (ei lähetetä jokaisen erän mukana)."""
+    global _worker_token_counter
+    _worker_token_counter = token_counter
+
+
+def _prepare_batch(
+    batch: list[dict[str, Any]],
+    min_tokens: int,
+    max_tokens: int,
+    token_counter: TokenCounter | None = None,
+) -> list[tuple[str, str | None, Any, int]]:
+    """
+    Esikäsittele erä chunkkeja (ajetaan työprosessissa tai sarjallisesti).
+
+    Tokenizerin kanssa koko erän token-määrät lasketaan ensin yhdellä
+    eräkutsulla, joten prepare_chunk saa ne välimuistista.
+    """
+    if token_counter is None:
+        token_counter = _worker_token_counter
+    if token_counter is not None:
+        texts = [
+            chunk.get("contextualized_text") or chunk.get("text", "")
+            for chunk in batch
+            if not is_table_chunk(chunk)
+        ]
+        texts = [text for text in texts if text and len(text.strip()) >= 10]
+        token_counter.count_batch(texts)
+    return [prepare_chunk(chunk, min_tokens, max_tokens, token_counter) for chunk in batch]
+
+
+def iter_prepared_chunks(
+    chunks: Iterable[dict[str, Any]],
+    min_tokens: int = MIN_CHUNK_TOKENS,
+    max_tokens: int = MAX_CHUNK_TOKENS,
+    workers: int = 1,
+    batch_size: int = 1000,
+    token_counter: TokenCounter | None = None,
+) -> Iterator[tuple[str, str | None, Any, int]]:
+    """
+    Esikäsittele chunkit (prepare_chunk) syötejärjestyksessä.
+
+    Kun workers > 1, syöte jaetaan batch_size-kokoisiin eriin, jotka
+    käsitellään prosessipoolissa. Käsittelyssä on kerrallaan korkeintaan
+    2 * workers erää, joten muistinkulutus pysyy rajattuna. Tokenizerin
+    kanssa myös sarjallinen ajo käsittelee erissä (eräkohtainen tokenisointi).
+
+    Args:
+        chunks: Iteroitava Docling-chunkkeja
+        min_tokens: Vähimmäiskoko
+        max_tokens: Maksimikoko
+        workers: Rinnakkaisten työprosessien määrä (1 = sarjallinen ajo)
+        batch_size: Chunkkeja per erä
+        token_counter: Tokenizer-pohjainen laskuri (None = arvio merkkimäärästä);
+                       kopioidaan kerran jokaiseen työprosessiin
+
+    Yields:
+        prepare_chunk-tulokset syötejärjestyksessä
+    """
+    if workers <= 1:
+        if token_counter is None:
+            for chunk in chunks:
+                yield prepare_chunk(chunk, min_tokens, max_tokens)
+            return
+        chunk_iter = iter(chunks)
+        while batch := list(islice(chunk_iter, batch_size)):
+            yield from _prepare_batch(batch, min_tokens, max_tokens, token_counter)
+        return
+
+    chunk_iter = iter(chunks)
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(token_counter,)
+    ) as executor:
+        in_flight: deque[Future] = deque()
+        while True:
+            while len(in_flight) < workers * 2:
+                batch = list(islice(chunk_iter, batch_size))
+                if not batch:
+                    break
+                in_flight.append(
+                    executor.submit(_prepare_batch, batch, min_tokens, max_tokens)
+                )
+            if not in_flight:
+                break
+            yield from in_flight.popleft().result()
+
+
+def is_boilerplate(chunk: dict[str, Any], tokens: int) -> bool:
+    """
+    Onko chunk vakioteksti, jonka lähes identtiset toistot voi poistaa.
+
+    Päätökset ja perustelut toistavat usein samaa pohjaa (vain pykälä, hakija
+    ja summa vaihtuvat), joten MinHash-samankaltaisuus ei erota niitä
+    luotettavasti. Vain muutoksenhakuohjeet ja lyhyet "muu"-lohkot
+    (allekirjoitukset, otsakkeet) ovat ehdokkaita.
+
+    Args:
+        chunk: Normalisoitu chunk
+        tokens: Chunkin token-määrä
+
+    Returns:
+        True, jos chunkin saa verrata lähes identtisiin
+    """
+    section_type = chunk.get("section_type")
+    if section_type in NEAR_DUPLICATE_SECTION_TYPES:
+        return True
+    return section_type == "muu" and tokens < NEAR_DUPLICATE_MAX_TOKENS
+
+
+def iter_normalized_chunks(
+    chunks: Iterable[dict[str, Any]],
+    on_table: Callable[[dict[str, Any]], None],
+    stats: dict[str, Any],
+    min_tokens: int = MIN_CHUNK_TOKENS,
+    max_tokens: int = MAX_CHUNK_TOKENS,
+    workers: int = 1,
+    batch_size: int = 1000,
+    near_duplicate_threshold: float | None = None,
+    dedup: DedupStats | None = None,
+    token_counter: TokenCounter | None = None,
+    propagate_sections: bool = True,
+) -> Iterator[dict[str, Any]]:
+    """
+    Normalisoi, suodata taulukot ja deduplikoi chunkit virtana.
+
+    Per-chunk-työ (metatiedot ja hash) voidaan ajaa rinnakkain
+    (workers > 1); deduplikaatio tehdään aina tässä järjestyksessä, joten
+    tulos on sama kuin sarjallisessa ajossa. Duplikaateista säilytetään
+    ensimmäinen esiintymä (klusterin edustaja).
+
+    Args:
+        chunks: Iteroitava Docling-chunkkeja
+        on_table: Kutsutaan jokaiselle taulukolle (esim. kirjoitus JSONL:ään)
+        stats: Laskurit päivitetään tähän dict:iin (total_original_chunks,
+               tables_saved, duplicates_filtered, near_duplicates_filtered,
+               too_short_before_merge, pykala_propagated)
+        min_tokens: Vähimmäiskoko
+        max_tokens: Maksimikoko
+        workers: Rinnakkaisten työprosessien määrä esikäsittelylle
+        batch_size: Chunkkeja per erä rinnakkaisajossa
+        near_duplicate_threshold: MinHash-Jaccard-kynnys lähes identtisille
+                                  vakioteksteille (None = vain identtiset,
+                                  ks. is_boilerplate)
+        dedup: Duplikaattiklusterien tilastot (None = uusi, ei palauteta)
+        token_counter: Tokenizer-pohjainen laskuri (None = arvio merkkimäärästä);
+                       työprosessien laskemat määrät tallennetaan sen välimuistiin
+        propagate_sections: Periytä pykälä dokumentin seuraaville chunkeille
+                            (ks. SectionPropagator)
+
+    Yields:
+        Normalisoidut chunkit
+    """
+    # seen_hashes kasvaa uniikkien chunkkien määrän mukaan: hash -> edustajan
+    # järjestysnumero säilytettyjen chunkkien joukossa
+    seen_hashes: dict[str, int] = {}
+    representatives: list[tuple[str, str]] = []  # Järjestysnumero -> (hash, id)
+    near_index = NearDuplicateIndex(near_duplicate_threshold) if near_duplicate_threshold else None
+    if dedup is None:
+        dedup = DedupStats()
+    stats.setdefault("near_duplicates_filtered", 0)
+    stats.setdefault("pykala_propagated", 0)
+    # Pykälän periytys tarvitsee syötejärjestyksen, joten se tehdään tässä
+    # eikä työprosesseissa
+    propagator = SectionPropagator() if propagate_sections else None
+
+    prepared = iter_prepared_chunks(chunks, min_tokens, max_tokens, workers, batch_size, token_counter)
+    for i, (kind, text_hash, data, tokens) in enumerate(prepared):
+        stats["total_original_chunks"] += 1
+        if (i + 1) % 1000 == 0:
+            _log.info(f"Prosessoitu {i + 1} chunkkia...")
+
+        if kind == "table":
+            on_table(data)
+            stats["tables_saved"] += 1
+            continue
+
+        # Liian lyhyt: jätä pois
+        if kind == "skipped":
+            stats["duplicates_filtered"] += 1
+            continue
+        if token_counter is not None:
+            token_counter.remember(data["text"], tokens)
+
+        # Ennen deduplikaatiota, jotta poistettavankin chunkin pykälä jää voimaan
+        if propagator and propagator.fill(data):
+            stats["pykala_propagated"] += 1
+
+        # Identtinen (sama SHA1) kuin aiempi chunk: jätä pois
+        representative = seen_hashes.get(text_hash)
+        if representative is not None:
+            stats["duplicates_filtered"] += 1
+            dedup.add_duplicate(*representatives[representative], data["text"])
+            continue
+
+        # Lähes identtinen (MinHash/LSH) vakioteksti saman pykälän aiemman chunkin kanssa: jätä pois
+        if near_index is not None and is_boilerplate(data, tokens):
+            representative = near_index.add(data["text"], len(representatives), group=data.get("pykala"))
+            if representative is not None:
+                seen_hashes[text_hash] = representative
+                stats["near_duplicates_filtered"] += 1
+                dedup.add_duplicate(*representatives[representative], data["text"], near=True)
+                continue
+
+        seen_hashes[text_hash] = len(representatives)
+        representatives.append((text_hash, data["id"]))
+        dedup.add_unique()
+
+        # Tarkista onko liian lyhyt (yhdistetään myöhemmin)
+        if tokens < MIN_CHUNK_TOKENS:
+            stats["too_short_before_merge"] += 1
+
+        yield data
+
+
+def stream_combined_dataset(
+    input_path: str | Path,
+    output_jsonl: str | Path,
+    output_json: str | Path | None = None,
+    tables_jsonl: str | Path | None = None,
+    output_columnar: str | Path | None = None,
+    output_metadata_index: str | Path | None = None,
+    output_table_index: str | Path | None = None,
+    output_section_index: str | Path | None = None,
+    output_shards: str | Path | None = None,
+    shard_by: str = "hash",
+    num_shards: int = DEFAULT_SHARDS,
+    min_tokens: int = MIN_CHUNK_TOKENS,
+    max_tokens: int = MAX_CHUNK_TOKENS,
+    merge_small: bool = True,
+    target_tokens: int = TARGET_CHUNK_TOKENS,
+    workers: int = 1,
+    batch_size: int = 1000,
+    near_duplicate_threshold: float | None = None,
+    dedup_report: str | Path | None = None,
+    token_counter: TokenCounter | None = None,
+    propagate_sections: bool = True,
+) -> dict[str, Any]:
+    """
+    Prosessoi Docling-datasetin virtana: luku, normalisointi, taulukoiden
+    suodatus, deduplikaatio, yhdistäminen ja kirjoitus chunk kerrallaan.
+
+    Muistinkulutus ei kasva chunkkien mukana (poikkeuksena deduplikaation
+    hash-joukot). Tulos on sama kuin process_combined_dataset-funktiolla.
+
+    Args:
+        input_path: Polku combined_chunks.jsonl (suositus) tai combined_chunks_only.json
+        output_jsonl: Polku output JSONL-tiedostoon
+        output_json: Polku output JSON-tiedostoon (valinnainen, johdetaan JSONL:stä)
+        tables_jsonl: Polku taulukoiden JSONL-tiedostoon
+                      (oletus: tables_normalized.jsonl output_jsonl:n vieressä)
+        output_columnar: Hakemisto sarakepohjaiselle tallenteelle (valinnainen,
+                         ks. chunk_store.ColumnarChunkStore)
+        output_metadata_index: Hakemisto metatietoindeksille (valinnainen,
+                               ks. metadata_index.MetadataIndex)
+        output_table_index: Hakemisto taulukkosolujen indeksille (valinnainen,
+                            ks. table_index.TableIndex)
+        output_section_index: Hakemisto pykäläindeksille (valinnainen,
+                              ks. section_index.SectionIndex)
+        output_shards: Hakemisto chunkkien shardeille (valinnainen,
+                       ks. chunk_shards.ShardedChunkWriter)
+        shard_by: Shardien jako: "hash" (source_file) tai "organisaatio_year"
+        num_shards: Shardien määrä hash-jaossa
+        workers: Rinnakkaisten työprosessien määrä metatietojen poimintaan
+                 (tulos on tavu tavulta sama kuin sarjallisessa ajossa)
+        batch_size: Chunkkeja per erä rinnakkaisajossa
+        near_duplicate_threshold: MinHash-Jaccard-kynnys lähes identtisten
+                                  vakiotekstien poistolle (None = vain identtiset,
+                                  ks. is_boilerplate)
+        dedup_report: Polku deduplikaatioraportille
+                      (oletus: dedup_report.json output_jsonl:n vieressä)
+        token_counter: Tokenizer-pohjainen laskuri (ks. token_counter.TokenCounter);
+                       None = arvio merkkimäärästä (estimate_tokens)
+        propagate_sections: Periytä pykälä dokumentin seuraaville chunkeille
+                            samassa virrassa (ks. SectionPropagator)
+
+    Returns:
+        Prosessoinnin metadata (ilman chunkkeja)
+    """
+    input_path = Path(input_path)
+    if not input_path.exists():
+        raise FileNotFoundError(f"Input-tiedostoa ei löydy: {input_path}")
+    if output_shards and shard_by not in SHARD_PARTITIONS:
+        raise ValueError(f"Tuntematon shardien jako: {shard_by} (tuetut: {', '.join(SHARD_PARTITIONS)})")
+
+    jsonl_path = Path(output_jsonl)
+    jsonl_path.parent.mkdir(parents=True, exist_ok=True)
+    tables_path = Path(tables_jsonl) if tables_jsonl else jsonl_path.parent / "tables_normalized.jsonl"
+    report_path = Path(dedup_report) if dedup_report else jsonl_path.parent / "dedup_report.json"
+
+    stats: dict[str, Any] = {
+        "total_original_chunks": 0,
+        "tables_saved": 0,
+        "duplicates_filtered": 0,
+        "too_short_before_merge": 0,
+        "pykala_propagated": 0,
+    }
+    size_stats = {"count": 0, "sum": 0, "min": None, "max": None, "in_target": 0}
+    target_min = target_tokens * 0.7
+    input_metadata: dict[str, Any] = {}
+    index_builder = MetadataIndexBuilder() if output_metadata_index else None
+    # Taulukkosivutiedostojen polut ovat suhteellisia ingestin output-kansioon
+    table_index_builder = TableIndexBuilder(input_path.parent) if output_table_index else None
+    section_builder = SectionIndexBuilder() if output_section_index else None
+    dedup = DedupStats()
+
+    _log.info(f"Luetaan dataset virtana: {input_path}")
+    _log.info("Aloitetaan normalisointi...")
+
+    with tables_path.open("w", encoding="utf-8") as tables_file, \
+         jsonl_path.open("w", encoding="utf-8") as out_file, \
+         (ColumnarChunkWriter(output_columnar) if output_columnar else nullcontext()) as columnar, \
+         (ShardedChunkWriter(output_shards, shard_by, num_shards) if output_shards else nullcontext()) as shards:
+
+        def write_table(table: dict[str, Any]) -> None:
+            tables_file.write(json.dumps(table, ensure_ascii=False) + "\n")
+            if table_index_builder:
+                table_index_builder.add_table(table)
+
+        final_chunks = iter_normalized_chunks(
+            iter_input_chunks(input_path, input_metadata),
+            write_table,
+            stats,
+            min_tokens,
+            max_tokens,
+            workers,
+            batch_size,
+            near_duplicate_threshold,
+            dedup,
+            token_counter,
+            propagate_sections,
+        )
+        if merge_small:
+            # Oikeilla token-määrillä yhdistetty chunk ei saa ylittää mallin rajaa
+            merge_max = max_tokens if token_counter is not None else None
+            final_chunks = iter_merge_small_chunks(final_chunks, min_tokens, target_tokens, token_counter, merge_max)
+
+        for chunk in final_chunks:
+            line = json.dumps(chunk, ensure_ascii=False) + "\n"
+            out_file.write(line)
+            if columnar:
+                columnar.append(chunk)
+            if shards:
+                shards.append(chunk, line)
+            if index_builder:
+                index_builder.add(chunk)
+            if section_builder:
+                section_builder.add(chunk)
+
+            tokens = count_tokens(chunk.get("text", ""), token_counter)
+            size_stats["count"] += 1
+            size_stats["sum"] += tokens
+            size_stats["min"] = tokens if size_stats["min"] is None else min(size_stats["min"], tokens)
+            size_stats["max"] = tokens if size_stats["max"] is None else max(size_stats["max"], tokens)
+            if target_min <= tokens <= max_tokens:
+                size_stats["in_target"] += 1
+
+    total = size_stats["count"]
+    avg_tokens = size_stats["sum"] / total if total else 0
+
+    _log.info(f"\n{'='*60}")
+    _log.info("NORMALISOINTI VALMIS!")
+    _log.info(f"{'='*60}")
+    _log.info(f"Alkuperäisiä chunkkeja: {stats['total_original_chunks']}")
+    _log.info(f"Normalisoituja chunkkeja (yhdistämisen jälkeen): {total}")
+    _log.info(f"Taulukoita tallennettu: {stats['tables_saved']}")
+    _log.info(f"Duplikaatteja jätetty pois: {stats['duplicates_filtered']}")
+    _log.info(f"Pykälä periytetty edellisestä chunkista: {stats['pykala_propagated']}")
+    if near_duplicate_threshold:
+        _log.info(
+            f"Lähes identtisiä jätetty pois (Jaccard >= {near_duplicate_threshold}): "
+            f"{stats['near_duplicates_filtered']}"
+        )
+    _log.info(f"Liian lyhyitä chunkkeja (<{MIN_CHUNK_TOKENS} tokenia): {stats['too_short_before_merge']}")
+    _log.info(f"\nKeskimääräinen chunk-koko: ~{avg_tokens:.0f} tokenia")
+    _log.info(f"Chunk-koko vaihteluväli: {size_stats['min'] or 0} - {size_stats['max'] or 0} tokenia")
+    _log.info(
+        f"Chunkkeja tavoite-alueella ({int(target_min)}-{max_tokens} tokenia): "
+        f"{size_stats['in_target']}/{total} ({size_stats['in_target']/total*100 if total else 0:.1f}%)"
+    )
+    _log.info(f"{'='*60}\n")
+
+    # Deduplikaation klusterit (esimerkit kerätty jo virran aikana)
+    dedup.log_top(10)
+    dedup.write_report(report_path, near_duplicate_threshold=near_duplicate_threshold)
+    _log.info(f"{'='*60}\n")
+
+    _log.info(f"✅ Taulukot tallennettu: {stats['tables_saved']} taulukkoa ({tables_path})")
+    _log.info(f"✅ JSONL tallennettu: {jsonl_path}")
+    _log.info(f"✅ Deduplikaatioraportti: {report_path}")
+    if output_columnar:
+        _log.info(f"✅ Sarakepohjainen tallenne: {output_columnar}")
+    if output_shards:
+        _log.info(f"✅ Shardit ({shard_by}): {output_shards}")
+    if index_builder:
+        index_builder.write(output_metadata_index)
+        _log.info(f"✅ Metatietoindeksi: {output_metadata_index}")
+    if section_builder:
+        section_builder.write(output_section_index)
+        _log.info(f"✅ Pykäläindeksi: {output_section_index} ({section_builder.sections} pykälää)")
+    if table_index_builder:
+        table_index_builder.write(output_table_index)
+        _log.info(
+            f"✅ Taulukkoindeksi: {output_table_index} "
+            f"({table_index_builder.rows} solua {table_index_builder.tables} taulukosta, "
+            f"{table_index_builder.structured_tables} sivutiedostosta)"
+        )
+    if token_counter is not None:
+        token_counter.save()
+        _log.info(
+            f"✅ Token-määrät ({token_counter.name}): {token_counter.misses} tokenisoitu, "
+            f"{token_counter.hits} välimuistista"
+        )
+
+    metadata = {
+        "total_original_chunks": stats["total_original_chunks"],
+        "total_normalized_chunks": total,
+        "tables_saved": stats["tables_saved"],
+        "duplicates_filtered": stats["duplicates_filtered"],
+        "too_short_before_merge": stats["too_short_before_merge"],
+        "pykala_propagated": stats["pykala_propagated"],
+        "processing_date": input_metadata.get("processing_date", ""),
+        "chunk_size_stats": {
+            "avg_tokens": round(avg_tokens, 1),
+            "min_tokens": size_stats["min"] or 0,
+            "max_tokens": size_stats["max"] or 0,
+            "target_tokens": TARGET_CHUNK_TOKENS,
+            "max_tokens_limit": max_tokens,
+        },
+    }
+    if near_duplicate_threshold:
+        metadata["near_duplicate_threshold"] = near_duplicate_threshold
+        metadata["near_duplicates_filtered"] = stats["near_duplicates_filtered"]
+        metadata["duplicate_clusters"] = len(dedup.clusters)
+    if token_counter is not None:
+        metadata["chunk_size_stats"]["tokenizer"] = token_counter.name
+
+    # Johda pretty-printattu JSON JSONL:stä (valinnainen)
+    if output_json:
+        _log.info(f"Tallennetaan JSON: {output_json}")
+        write_json_streaming(output_json, {"metadata": metadata}, [("chunks", iter_jsonl(jsonl_path))])
+
+    return metadata
+
+
 def main():
     """Pääfunktio."""
     # Input ja output -tiedostot
@@ -699,26 +1523,57 @@ def main():
         else:
             base_dir = Path(os.getenv("LAPUA_RAG_OUTPUT_DIR", "."))
     
-    input_json = base_dir / "combined_chunks_only.json"
+    # Suosi batch-prosessoinnin streaming-tilan JSONL-tiedostoa (luetaan virtana)
+    input_path = base_dir / "combined_chunks.jsonl"
+    if not input_path.exists():
+        input_path = base_dir / "combined_chunks_only.json"
     output_json = base_dir / "normalized_chunks.json"
     output_jsonl = base_dir / "normalized_chunks.jsonl"
+    output_columnar = base_dir / "normalized_chunks.colstore"
+    output_metadata_index = base_dir / "normalized_chunks.metaindex"
+    output_table_index = base_dir / "tables_normalized.tableindex"
+    output_section_index = base_dir / "normalized_chunks.sections"
+    # Shardit rinnakkaiselle jatkokäsittelylle (tyhjä = ei shardeja)
+    shard_by = os.getenv("LAPUA_RAG_SHARD_BY", "")
+    output_shards = base_dir / "normalized_chunks.shards" if shard_by else None
+
+    # Sama tokenizer kuin embedding-mallilla (tyhjä = arvio ~4 merkkiä per token)
+    tokenizer_id = os.getenv("LAPUA_RAG_TOKENIZER")
+    token_counter = (
+        TokenCounter.from_pretrained(tokenizer_id, cache_dir=base_dir / "token_cache")
+        if tokenizer_id else None
+    )
 
     try:
-        result = process_combined_dataset(
-            input_json=input_json,
-            output_json=output_json,
+        metadata = stream_combined_dataset(
+            input_path=input_path,
             output_jsonl=output_jsonl,
+            output_json=output_json,
+            output_columnar=output_columnar,  # Nopeasti ladattava mmap-tallenne
+            output_metadata_index=output_metadata_index,  # Suodatinhaut ilman skannausta
+            output_table_index=output_table_index,  # Budjettitaulukoiden solut suoraan haettaviksi
+            output_section_index=output_section_index,  # Osuma -> koko pykälä yhdellä haulla
+            output_shards=output_shards,  # LAPUA_RAG_SHARD_BY=hash|organisaatio_year
+            shard_by=shard_by or "hash",
+            num_shards=int(os.getenv("LAPUA_RAG_SHARDS", str(DEFAULT_SHARDS))),
             min_tokens=MIN_CHUNK_TOKENS,
             max_tokens=MAX_CHUNK_TOKENS,
             merge_small=True,  # Yhdistä liian lyhyet chunkit
             target_tokens=TARGET_CHUNK_TOKENS,
+            workers=int(os.getenv("LAPUA_RAG_WORKERS", "1")),  # Rinnakkaiset työprosessit
+            # Lähes identtiset muutoksenhakuohjeet ja allekirjoitukset
+            # (oletus pois, esim. LAPUA_RAG_NEAR_DUP_THRESHOLD=0.7)
+            near_duplicate_threshold=float(os.getenv("LAPUA_RAG_NEAR_DUP_THRESHOLD", "0")) or None,
+            token_counter=token_counter,  # LAPUA_RAG_TOKENIZER (välimuisti token_cache/)
         )
 
         print(f"\n✅ Postiprosessointi valmis!")
-        print(f"   - Normalisoituja chunkkeja: {len(result['chunks'])}")
-        print(f"   - Taulukoita tallennettu: {result['metadata']['tables_saved']}")
-        print(f"   - Duplikaatteja suodatettu: {result['metadata']['duplicates_filtered']}")
-        print(f"   - Output: {output_json}")
+        print(f"   - Normalisoituja chunkkeja: {metadata['total_normalized_chunks']}")
+        print(f"   - Taulukoita tallennettu: {metadata['tables_saved']}")
+        print(f"   - Duplikaatteja suodatettu: {metadata['duplicates_filtered']}")
+        if "near_duplicates_filtered" in metadata:
+            print(f"   - Lähes identtisiä suodatettu: {metadata['near_duplicates_filtered']}")
+        print(f"   - Output: {output_jsonl}")
 
     except Exception as e:
         _log.error(f"Virhe postiprosessoinnissa: {e}", exc_info=True)
@@ -9,11 +9,14 @@ Tämä skripti:
 - Luo myös yksittäiset tiedostot jokaiselle dokumentille
 """
 
+import hashlib
 import json
 import logging
 import os
 import sys
 import time
+from collections.abc import Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
 from pathlib import Path
 from typing import Any
 
@@ -29,7 +32,10 @@ from docling.datamodel.document import ConversionResult
 from docling.datamodel.pipeline_options import PdfPipelineOptions
 from docling.document_converter import DocumentConverter, PdfFormatOption
 from docling.backend.docling_parse_v4_backend import DoclingParseV4DocumentBackend
-from docling_core.types.doc import ImageRefMode
+from docling_core.types.doc import DoclingDocument, ImageRefMode
+
+from jsonl_io import iter_jsonl, write_json_streaming
+from table_cells import TABLE_CELLS_VERSION, extract_table_cells, table_cells_path, write_table_cells
 
 # Konfiguroi logging
 logging.basicConfig(
@@ -38,6 +44,31 @@ logging.basicConfig(
 )
 _log = logging.getLogger(__name__)
 
+# PDF-pipelinen asetukset (osa inkrementaalisen välimuistin avainta)
+PIPELINE_OPTIONS = {
+    "do_ocr": True,
+    "do_table_structure": True,
+}
+
+# Suuret PDF:t konvertoidaan sivualueina (rinnakkain työprosesseissa) ja
+# yhdistetään ennen chunkkausta. Alueen koko on kiinteä, joten tulos ei riipu
+# työprosessien määrästä.
+PAGES_PER_RANGE = 25
+MIN_SPLIT_PAGES = 2 * PAGES_PER_RANGE  # Tätä lyhyemmät konvertoidaan kerralla
+
+# Rinnakkaisajossa kesken (annettu pooliin, ei vielä palautettu) olevia
+# dokumentteja per työprosessi: rajaa järjestystä odottavien tulosten muistin
+DOCUMENTS_IN_FLIGHT_PER_WORKER = 2
+
+# Inkrementaalisen ajon manifesti output-kansiossa
+MANIFEST_FILENAME = "ingest_manifest.json"
+MANIFEST_VERSION = 2  # 2: dokumenttikansiot sisältöhashilla (<stem>_<hash>)
+
+# Streaming-tilan tiedostot output-kansiossa
+CHUNKS_JSONL_FILENAME = "combined_chunks.jsonl"
+DOCUMENTS_JSONL_FILENAME = "combined_documents.jsonl"
+COMBINED_METADATA_FILENAME = "combined_metadata.json"
+
 
 def find_all_pdfs(root_dir: str | Path) -> list[Path]:
     """
@@ -55,11 +86,316 @@ def find_all_pdfs(root_dir: str | Path) -> list[Path]:
     return sorted(pdf_files)
 
 
+def build_converter() -> DocumentConverter:
+    """
+    Luo DocumentConverterin RAG-prosessoinnin asetuksilla (OCR + taulukkorakenne).
+
+    Returns:
+        DocumentConverter-instanssi
+    """
+    pipeline_options = PdfPipelineOptions(**PIPELINE_OPTIONS)
+
+    pdf_format_option = PdfFormatOption(
+        pipeline_options=pipeline_options,
+        backend=DoclingParseV4DocumentBackend,
+    )
+
+    return DocumentConverter(
+        format_options={InputFormat.PDF: pdf_format_option}
+    )
+
+
+def build_chunker(
+    embed_model_id: str | None = None,
+    max_tokens: int | None = None,
+) -> HybridChunker:
+    """
+    Luo HybridChunkerin annetulla tokenizerilla ja maksimikoolla.
+
+    Args:
+        embed_model_id: Embedding-mallin ID (jos None, käytetään oletustokenizeria)
+        max_tokens: Chunkkien maksimikoko tokenissa (jos None, tokenizerin oletus)
+
+    Returns:
+        HybridChunker-instanssi
+    """
+    if not (embed_model_id or max_tokens):
+        _log.info("Käytetään oletus-chunkeria (oletusarvo ~512 tokenia)")
+        return HybridChunker()
+
+    from docling_core.transforms.chunker.tokenizer.huggingface import (
+        HuggingFaceTokenizer,
+    )
+    from transformers import AutoTokenizer
+
+    # Jos embed_model_id on määritelty, käytä sitä
+    # Muuten käytä oletustokenizeria
+    if embed_model_id:
+        model_id = embed_model_id
+        _log.info(f"Käytetään embedding-mallia: {embed_model_id}")
+    else:
+        # Oletustokenizer (sentence-transformers/all-MiniLM-L6-v2)
+        model_id = "sentence-transformers/all-MiniLM-L6-v2"
+        _log.info(f"Käytetään oletustokenizeria: {model_id}")
+
+    tokenizer_obj = AutoTokenizer.from_pretrained(model_id)
+
+    # Jos max_tokens on määritelty, käytä sitä
+    # Muuten käytä tokenizerin oletusarvoa
+    tokenizer_kwargs = {}
+    if max_tokens is not None:
+        tokenizer_kwargs["max_tokens"] = max_tokens
+        _log.info(f"Chunkkien maksimikoko: {max_tokens} tokenia")
+    else:
+        default_max = getattr(tokenizer_obj, "model_max_length", 512)
+        _log.info(f"Käytetään tokenizerin oletusarvoa: {default_max} tokenia")
+
+    tokenizer = HuggingFaceTokenizer(
+        tokenizer=tokenizer_obj,
+        **tokenizer_kwargs,
+    )
+    return HybridChunker(tokenizer=tokenizer)
+
+
+def count_pdf_pages(pdf_path: Path) -> int | None:
+    """
+    Laske PDF:n sivumäärä ilman konversiota (pypdfium2, Doclingin riippuvuus).
+
+    Args:
+        pdf_path: Polku PDF-tiedostoon
+
+    Returns:
+        Sivumäärä tai None, jos tiedostoa ei voitu lukea
+    """
+    try:
+        import pypdfium2
+
+        pdf = pypdfium2.PdfDocument(str(pdf_path))
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    except Exception as e:
+        _log.warning(f"Sivumäärää ei voitu lukea ({pdf_path.name}): {e}")
+        return None
+
+
+def page_ranges(
+    page_count: int | None,
+    pages_per_range: int = PAGES_PER_RANGE,
+    min_split_pages: int = MIN_SPLIT_PAGES,
+) -> list[tuple[int, int]] | None:
+    """
+    Jaa suuri dokumentti sivualueisiin.
+
+    Args:
+        page_count: Dokumentin sivumäärä (None = tuntematon, ei jaeta)
+        pages_per_range: Sivuja per alue
+        min_split_pages: Pienin jaettava sivumäärä (0 = ei jakoa)
+
+    Returns:
+        Lista (alku, loppu)-pareja (1-pohjaiset, suljetut välit) tai None,
+        jos dokumentti konvertoidaan kerralla
+    """
+    if not page_count or min_split_pages <= 0 or page_count < min_split_pages:
+        return None
+    return [
+        (start, min(start + pages_per_range - 1, page_count))
+        for start in range(1, page_count + 1, pages_per_range)
+    ]
+
+
+def convert_page_range(
+    pdf_path: Path,
+    converter: DocumentConverter,
+    page_range: tuple[int, int],
+) -> tuple[DoclingDocument | None, str]:
+    """
+    Konvertoi yksi sivualue.
+
+    Doclingin sivualueen sivut säilyttävät alkuperäiset sivunumeronsa.
+
+    Args:
+        pdf_path: Polku PDF-tiedostoon
+        converter: DocumentConverter-instanssi
+        page_range: (alku, loppu), 1-pohjainen suljettu väli
+
+    Returns:
+        (dokumentti tai None jos konversio epäonnistui tai alueen ensimmäinen
+        tai viimeinen sivu puuttuu, status)
+    """
+    start, end = page_range
+    try:
+        result: ConversionResult = converter.convert(pdf_path, page_range=page_range)
+    except Exception as e:
+        _log.error(f"❌ Sivujen {start}-{end} konversio epäonnistui ({pdf_path.name}): {e}")
+        return None, ConversionStatus.FAILURE.value
+    if result.status == ConversionStatus.FAILURE:
+        return None, result.status.value
+    # Yhdistäminen siirtää alueen sivunumeroita (edellisen alueen viimeinen sivu -
+    # tämän ensimmäinen + 1), joten alueen on alettava ja päätyttävä rajoihinsa
+    pages = result.document.pages
+    if not pages or min(pages) != start or max(pages) != end:
+        found = f"{min(pages)}-{max(pages)}" if pages else "ei sivuja"
+        _log.warning(
+            f"Sivualueelta {start}-{end} puuttuu reunasivu ({pdf_path.name}: {found}, "
+            f"{result.status.value}), aluetta ei yhdistetä"
+        )
+        return None, result.status.value
+    return result.document, result.status.value
+
+
+def stitch_page_ranges(parts: list[tuple[DoclingDocument | None, str]]) -> tuple[DoclingDocument | None, str]:
+    """
+    Yhdistä sivualueiden dokumentit yhdeksi DoclingDocumentiksi.
+
+    DoclingDocument.concatenate siirtää jokaisen alueen sivunumeroita
+    määrällä (edellisen alueen suurin sivu - alueen pienin sivu + 1). Kun
+    alueet ovat peräkkäiset ja jokainen alkaa ja päättyy rajoihinsa, siirto
+    on nolla ja chunkkien doc_items-provenanssi viittaa alkuperäisen PDF:n
+    sivuihin. Puuttuva alue tai reunasivu siirtäisi myöhempien alueiden
+    sivunumeroita, joten convert_page_range palauttaa sellaiselle alueelle
+    None ja koko yhdistäminen hylätään (kutsuja konvertoi kokonaisena).
+    Alueen sisältä puuttuva sivu ei siirrä numerointia (PARTIAL_SUCCESS).
+
+    Args:
+        parts: convert_page_range-tulokset sivujärjestyksessä
+
+    Returns:
+        (yhdistetty dokumentti, status) tai (None, "failure")
+    """
+    if any(doc is None for doc, _ in parts):
+        return None, ConversionStatus.FAILURE.value
+    doc = DoclingDocument.concatenate([doc for doc, _ in parts])
+    success = all(status == ConversionStatus.SUCCESS.value for _, status in parts)
+    status = ConversionStatus.SUCCESS if success else ConversionStatus.PARTIAL_SUCCESS
+    return doc, status.value
+
+
+def chunk_document(
+    pdf_path: Path,
+    doc: DoclingDocument,
+    status: str,
+    chunker: HybridChunker,
+    output_dir: Path,
+    content_hash: str | None = None,
+) -> dict[str, Any]:
+    """
+    Chunkkaa konvertoitu dokumentti ja tallenna yksittäiset tiedostot.
+
+    Args:
+        pdf_path: Polku PDF-tiedostoon
+        doc: Konvertoitu (tai sivualueista yhdistetty) dokumentti
+        status: Konversion status
+        chunker: HybridChunker-instanssi
+        output_dir: Output-kansio
+        content_hash: PDF:n SHA256, jos jo laskettu (None = lasketaan)
+
+    Returns:
+        Dict chunkkeineen
+    """
+    # Chunkkaa dokumentti
+    chunks = list(chunker.chunk(doc))
+
+    # Sisältöhash kansion nimeen: samannimiset PDF:t eri kansioista eivät
+    # kirjoita toistensa päälle (myös taulukkosivutiedosto ja Markdown)
+    if content_hash is None:
+        content_hash = file_content_hash(pdf_path)
+    doc_json_path = document_json_path(pdf_path, output_dir, content_hash)
+    doc_output_dir = doc_json_path.parent
+    doc_output_dir.mkdir(parents=True, exist_ok=True)
+
+    # Taulukoiden solut sivutiedostoon (rakenne säilyy tekstiksi linearisoinnin ohi)
+    tables = extract_table_cells(doc)
+    tables_path = table_cells_path(doc_json_path)
+    if tables:
+        write_table_cells(tables_path, tables)
+    elif tables_path.exists():
+        tables_path.unlink()  # Edellisen konversion taulukot
+    tables_relative = tables_path.relative_to(output_dir).as_posix() if tables else None
+
+    # Kerää chunkit metadataineen
+    chunk_data = []
+    for i, chunk in enumerate(chunks):
+        contextualized_text = chunker.contextualize(chunk)
+
+        chunk_info = {
+            "chunk_id": i,
+            "text": chunk.text,
+            "contextualized_text": contextualized_text,
+            "metadata": {
+                "source_file": str(pdf_path),
+                "source_name": pdf_path.name,
+                "source_relative_path": str(pdf_path.relative_to(pdf_path.parent.parent.parent)),
+                "chunk_index": i,
+                "total_chunks_in_document": len(chunks),
+            },
+        }
+
+        # Lisää chunkin metadata jos saatavilla
+        if hasattr(chunk, "meta") and chunk.meta:
+            if hasattr(chunk.meta, "doc_items") and chunk.meta.doc_items:
+                chunk_info["metadata"]["doc_items"] = [
+                    {
+                        "label": str(item.label) if hasattr(item, "label") else None,
+                        # Sivunumero provenanssista (alkuperäisen PDF:n sivu)
+                        "page": item.prov[0].page_no if getattr(item, "prov", None) else None,
+                        # Viittaus dokumentin elementtiin (taulukoilla sivutiedoston taulukko)
+                        "ref": getattr(item, "self_ref", None),
+                    }
+                    for item in chunk.meta.doc_items
+                ]
+                if tables_relative and any(
+                    item["label"] == "table" for item in chunk_info["metadata"]["doc_items"]
+                ):
+                    # Polku output-kansiosta, kuten manifestissa
+                    chunk_info["metadata"]["table_cells"] = tables_relative
+
+        chunk_data.append(chunk_info)
+
+    # Tallenna yksittäinen dokumentti (valinnainen)
+    # JSON chunkkeineen
+    doc_data = {
+        "source_file": str(pdf_path),
+        "source_name": pdf_path.name,
+        "content_sha256": content_hash,
+        "total_chunks": len(chunks),
+        "chunks": chunk_data,
+        "document_metadata": {
+            "title": getattr(doc, "title", None),
+            "pages": len(doc.pages) if hasattr(doc, "pages") else None,
+            "tables": len(tables),
+            "table_cells": tables_relative,
+        },
+    }
+    # Atomisesti: saman sisällön kopiot voivat valmistua samaan aikaan eri työprosesseissa
+    tmp_path = doc_json_path.with_name(f"{doc_json_path.name}.{os.getpid()}.tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump(doc_data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, doc_json_path)
+
+    # Markdown
+    md_output_path = doc_output_dir / f"{pdf_path.stem}_full.md"
+    markdown_content = doc.export_to_markdown()
+    with md_output_path.open("w", encoding="utf-8") as f:
+        f.write(markdown_content)
+
+    _log.info(f"✅ {pdf_path.name}: {len(chunks)} chunkkia luotu ({status})")
+
+    return {
+        "document": doc_data,
+        "chunks": chunk_data,
+        "status": status,
+    }
+
+
 def process_single_document(
     pdf_path: Path,
     converter: DocumentConverter,
     chunker: HybridChunker,
     output_dir: Path,
+    ranges: list[tuple[int, int]] | None = None,
+    content_hash: str | None = None,
 ) -> dict[str, Any] | None:
     """
     Prosessoi yhden dokumentin ja palauttaa chunkit.
@@ -69,10 +405,17 @@ def process_single_document(
         converter: DocumentConverter-instanssi
         chunker: HybridChunker-instanssi
         output_dir: Output-kansio
+        ranges: Sivualueet (page_ranges); annettuna alueet konvertoidaan
+                peräkkäin ja yhdistetään ennen chunkkausta
+        content_hash: PDF:n SHA256, jos jo laskettu (None = lasketaan)
 
     Returns:
         Dict chunkkeineen tai None jos prosessointi epäonnistui
     """
+    if ranges:
+        parts = [convert_page_range(pdf_path, converter, page_range) for page_range in ranges]
+        return process_converted_ranges(pdf_path, parts, converter, chunker, output_dir, content_hash)
+
     try:
         _log.info(f"Prosessoidaan: {pdf_path.name}")
 
@@ -87,89 +430,579 @@ def process_single_document(
             if result.status == ConversionStatus.FAILURE:
                 return None
 
-        doc = result.document
-
-        # Chunkkaa dokumentti
-        chunks = list(chunker.chunk(doc))
-
-        # Kerää chunkit metadataineen
-        chunk_data = []
-        for i, chunk in enumerate(chunks):
-            contextualized_text = chunker.contextualize(chunk)
-
-            chunk_info = {
-                "chunk_id": i,
-                "text": chunk.text,
-                "contextualized_text": contextualized_text,
-                "metadata": {
-                    "source_file": str(pdf_path),
-                    "source_name": pdf_path.name,
-                    "source_relative_path": str(pdf_path.relative_to(pdf_path.parent.parent.parent)),
-                    "chunk_index": i,
-                    "total_chunks_in_document": len(chunks),
-                },
-            }
+        return chunk_document(
+            pdf_path, result.document, result.status.value, chunker, output_dir, content_hash
+        )
 
-            # Lisää chunkin metadata jos saatavilla
-            if hasattr(chunk, "meta") and chunk.meta:
-                if hasattr(chunk.meta, "doc_items") and chunk.meta.doc_items:
-                    chunk_info["metadata"]["doc_items"] = [
-                        {
-                            "label": str(item.label) if hasattr(item, "label") else None,
-                            "page": getattr(item, "page", None),
-                        }
-                        for item in chunk.meta.doc_items
-                    ]
-
-            chunk_data.append(chunk_info)
-
-        # Tallenna yksittäinen dokumentti (valinnainen)
-        doc_output_dir = output_dir / "individual_documents" / pdf_path.stem
-        doc_output_dir.mkdir(parents=True, exist_ok=True)
-
-        # JSON chunkkeineen
-        doc_json_path = doc_output_dir / f"{pdf_path.stem}_rag.json"
-        doc_data = {
-            "source_file": str(pdf_path),
-            "source_name": pdf_path.name,
-            "total_chunks": len(chunks),
-            "chunks": chunk_data,
-            "document_metadata": {
-                "title": getattr(doc, "title", None),
-                "pages": len(doc.pages) if hasattr(doc, "pages") else None,
-            },
-        }
-        with doc_json_path.open("w", encoding="utf-8") as f:
-            json.dump(doc_data, f, ensure_ascii=False, indent=2)
+    except Exception as e:
+        _log.error(f"❌ Virhe prosessoinnissa {pdf_path.name}: {e}", exc_info=True)
+        return None
 
-        # Markdown
-        md_output_path = doc_output_dir / f"{pdf_path.stem}_full.md"
-        markdown_content = doc.export_to_markdown()
-        with md_output_path.open("w", encoding="utf-8") as f:
-            f.write(markdown_content)
 
-        _log.info(
-            f"✅ {pdf_path.name}: {len(chunks)} chunkkia luotu "
-            f"({result.status.value})"
-        )
+def process_converted_ranges(
+    pdf_path: Path,
+    parts: list[tuple[DoclingDocument | None, str]],
+    converter: DocumentConverter,
+    chunker: HybridChunker,
+    output_dir: Path,
+    content_hash: str | None = None,
+) -> dict[str, Any] | None:
+    """
+    Yhdistä konvertoidut sivualueet ja chunkkaa dokumentti.
 
-        return {
-            "document": doc_data,
-            "chunks": chunk_data,
-            "status": result.status.value,
-        }
+    Jos jokin alue epäonnistui, dokumentti konvertoidaan kokonaisena.
+
+    Args:
+        pdf_path: Polku PDF-tiedostoon
+        parts: convert_page_range-tulokset sivujärjestyksessä
+        converter: DocumentConverter-instanssi (varakonversiota varten)
+        chunker: HybridChunker-instanssi
+        output_dir: Output-kansio
+        content_hash: PDF:n SHA256, jos jo laskettu (None = lasketaan)
+
+    Returns:
+        Dict chunkkeineen tai None jos prosessointi epäonnistui
+    """
+    try:
+        doc, status = stitch_page_ranges(parts)
+        if doc is None:
+            _log.warning(f"Sivualueen konversio epäonnistui, konvertoidaan kokonaisena: {pdf_path.name}")
+            return process_single_document(
+                pdf_path, converter, chunker, output_dir, content_hash=content_hash
+            )
+        if status != ConversionStatus.SUCCESS.value:
+            _log.warning(f"Dokumentti {pdf_path.name} prosessoitu osittain: {status}")
+        _log.info(f"{pdf_path.name}: {len(parts)} sivualuetta yhdistetty ({len(doc.pages)} sivua)")
+        return chunk_document(pdf_path, doc, status, chunker, output_dir, content_hash)
 
     except Exception as e:
         _log.error(f"❌ Virhe prosessoinnissa {pdf_path.name}: {e}", exc_info=True)
         return None
 
 
+def document_json_path(pdf_path: Path, output_dir: Path, content_hash: str) -> Path:
+    """
+    Palauta dokumentin <stem>_rag.json -polku individual_documents-kansiossa.
+
+    Kansio on <stem>_<sisältöhashin alku>, joten eri PDF:t eivät jaa kansiota,
+    vaikka tiedostonimi olisi sama (esim. "Pöytäkirja.pdf" usean toimielimen alla).
+
+    Args:
+        pdf_path: Polku PDF-tiedostoon
+        output_dir: Output-kansio
+        content_hash: PDF:n SHA256 (file_content_hash)
+    """
+    doc_dir = f"{pdf_path.stem}_{content_hash[:12]}"
+    return output_dir / "individual_documents" / doc_dir / f"{pdf_path.stem}_rag.json"
+
+
+def file_content_hash(path: Path, block_size: int = 1 << 20) -> str:
+    """
+    Laske tiedoston SHA256-hash lohkoittain (ei lue koko tiedostoa muistiin).
+
+    Args:
+        path: Tiedoston polku
+        block_size: Lukulohkon koko tavuina
+
+    Returns:
+        SHA256-hash hex-muodossa
+    """
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def pipeline_config_key(
+    embed_model_id: str | None,
+    max_tokens: int | None,
+    min_split_pages: int = MIN_SPLIT_PAGES,
+) -> str:
+    """
+    Laske pipeline- ja chunker-konfiguraation tunniste välimuistin avaimeksi.
+
+    Docling-version vaihtuessa kaikki dokumentit konvertoidaan uudelleen.
+
+    Args:
+        embed_model_id: Embedding-mallin ID
+        max_tokens: Chunkkien maksimikoko tokenissa
+        min_split_pages: Sivualueisiin jaon raja (jako vaikuttaa chunkkeihin)
+
+    Returns:
+        Lyhyt hex-tunniste konfiguraatiolle
+    """
+    try:
+        from importlib.metadata import version
+
+        docling_version = version("docling")
+    except Exception:
+        docling_version = None
+
+    config = {
+        "pipeline_options": PIPELINE_OPTIONS,
+        "backend": DoclingParseV4DocumentBackend.__name__,
+        "embed_model_id": embed_model_id,
+        "max_tokens": max_tokens,
+        "docling_version": docling_version,
+        "page_ranges": [PAGES_PER_RANGE, min_split_pages],
+        "table_cells": TABLE_CELLS_VERSION,
+    }
+    encoded = json.dumps(config, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def load_manifest(output_dir: Path) -> dict[str, Any]:
+    """
+    Lataa inkrementaalisen ajon manifesti (tai tyhjä manifesti jos ei ole).
+
+    Manifestin rakenne:
+        entries: {"<pdf-sha256>:<config-key>": {"rag_json": ..., "status": ...}}
+        files: {"<pdf-polku>": {"size": ..., "mtime_ns": ..., "sha256": ...}}
+
+    files-osio on stat-välimuisti: muuttumattomia PDF:iä ei tarvitse lukea
+    uudelleen hashin laskemiseksi.
+
+    Args:
+        output_dir: Output-kansio
+
+    Returns:
+        Manifesti-dict
+    """
+    manifest_path = output_dir / MANIFEST_FILENAME
+    if manifest_path.exists():
+        try:
+            with manifest_path.open("r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") == MANIFEST_VERSION:
+                return manifest
+            _log.warning(f"Manifestin versio ei täsmää, aloitetaan tyhjästä: {manifest_path}")
+        except (OSError, json.JSONDecodeError) as e:
+            _log.warning(f"Manifestia ei voitu lukea ({e}), aloitetaan tyhjästä")
+    return {"version": MANIFEST_VERSION, "entries": {}, "files": {}}
+
+
+def save_manifest(output_dir: Path, manifest: dict[str, Any]) -> None:
+    """Tallenna manifesti atomisesti (kirjoitus väliaikaiseen tiedostoon + rename)."""
+    manifest_path = output_dir / MANIFEST_FILENAME
+    tmp_path = manifest_path.with_suffix(".json.tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def cached_content_hash(pdf_path: Path, manifest: dict[str, Any]) -> str:
+    """
+    Palauta PDF:n sisältöhash, käyttäen manifestin stat-välimuistia jos
+    tiedoston koko ja muokkausaika eivät ole muuttuneet.
+
+    Args:
+        pdf_path: Polku PDF-tiedostoon
+        manifest: Manifesti-dict (päivitetään)
+
+    Returns:
+        SHA256-hash hex-muodossa
+    """
+    stat = pdf_path.stat()
+    key = str(pdf_path)
+    known = manifest["files"].get(key)
+    if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+        return known["sha256"]
+
+    content_hash = file_content_hash(pdf_path)
+    manifest["files"][key] = {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": content_hash,
+    }
+    return content_hash
+
+
+def load_cached_document(pdf_path: Path, rag_json_path: Path, status: str, content_hash: str) -> dict[str, Any]:
+    """
+    Lataa aiemmin konvertoidun dokumentin chunkit <stem>_rag.json -tiedostosta.
+
+    Jos sama sisältö löytyy uudesta polusta (tiedosto siirretty tai kopioitu),
+    lähdetiedot päivitetään vastaamaan nykyistä polkua.
+
+    Args:
+        pdf_path: Nykyinen polku PDF-tiedostoon
+        rag_json_path: Polku välimuistissa olevaan _rag.json -tiedostoon
+        status: Alkuperäisen konversion status
+        content_hash: PDF:n nykyinen SHA256
+
+    Returns:
+        Dict samassa muodossa kuin process_single_document palauttaa
+
+    Raises:
+        ValueError: _rag.json on konvertoitu eri sisällöstä
+    """
+    with rag_json_path.open("r", encoding="utf-8") as f:
+        doc_data = json.load(f)
+    if doc_data.get("content_sha256") != content_hash:
+        raise ValueError(f"{rag_json_path} ei vastaa PDF:n sisältöä")
+
+    if doc_data.get("source_file") != str(pdf_path):
+        doc_data["source_file"] = str(pdf_path)
+        doc_data["source_name"] = pdf_path.name
+        relative_path = str(pdf_path.relative_to(pdf_path.parent.parent.parent))
+        for chunk_info in doc_data["chunks"]:
+            chunk_info["metadata"]["source_file"] = str(pdf_path)
+            chunk_info["metadata"]["source_name"] = pdf_path.name
+            chunk_info["metadata"]["source_relative_path"] = relative_path
+
+    return {
+        "document": doc_data,
+        "chunks": doc_data["chunks"],
+        "status": status,
+    }
+
+
+class CombinedJsonlWriter:
+    """
+    Kirjoittaa dokumenttien chunkit JSONL-tiedostoihin heti dokumentin valmistuttua.
+
+    Chunkit menevät tiedostoon combined_chunks.jsonl (yksi chunk per rivi) ja
+    dokumenttien tiedot ilman chunkkeja tiedostoon combined_documents.jsonl.
+    Tiedostot fsync-ataan checkpointeissa, joten kaatuminen kesken ajon ei
+    hävitä jo kirjoitettuja dokumentteja.
+    """
+
+    def __init__(self, output_dir: Path, checkpoint_every: int = 10) -> None:
+        self.chunks_path = output_dir / CHUNKS_JSONL_FILENAME
+        self.documents_path = output_dir / DOCUMENTS_JSONL_FILENAME
+        self.checkpoint_every = checkpoint_every
+        self._documents_since_checkpoint = 0
+        self._chunks_file = self.chunks_path.open("w", encoding="utf-8")
+        self._documents_file = self.documents_path.open("w", encoding="utf-8")
+
+    def write_document(self, document: dict[str, Any], chunks: list[dict[str, Any]]) -> None:
+        """Kirjoita yhden dokumentin tiedot ja chunkit."""
+        # "chunks"-avain säilytetään paikallaan, jotta yhdistetty JSON voidaan
+        # rakentaa myöhemmin samassa avainjärjestyksessä
+        document_line = {**document, "chunks": None}
+        self._documents_file.write(json.dumps(document_line, ensure_ascii=False) + "\n")
+        for chunk in chunks:
+            self._chunks_file.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+
+        self._documents_since_checkpoint += 1
+        if self._documents_since_checkpoint >= self.checkpoint_every:
+            self.checkpoint()
+
+    def checkpoint(self) -> None:
+        """Pakota kirjoitetut rivit levylle (flush + fsync)."""
+        for f in (self._chunks_file, self._documents_file):
+            f.flush()
+            os.fsync(f.fileno())
+        self._documents_since_checkpoint = 0
+
+    def close(self) -> None:
+        """Tee viimeinen checkpoint ja sulje tiedostot."""
+        self.checkpoint()
+        self._chunks_file.close()
+        self._documents_file.close()
+
+    def __enter__(self) -> "CombinedJsonlWriter":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def write_combined_json_from_jsonl(output_dir: Path, metadata: dict[str, Any]) -> None:
+    """
+    Johda combined_rag_dataset.json ja combined_chunks_only.json JSONL-tiedostoista.
+
+    Tiedostot kirjoitetaan virtana: muistissa on kerrallaan vain yhden
+    dokumentin chunkit.
+
+    Args:
+        output_dir: Output-kansio jossa JSONL-tiedostot ovat
+        metadata: Yhdistetyn datasetin metadata
+    """
+    chunks_path = output_dir / CHUNKS_JSONL_FILENAME
+    documents_path = output_dir / DOCUMENTS_JSONL_FILENAME
+
+    def iter_documents_with_chunks() -> Iterator[dict[str, Any]]:
+        chunk_iter = iter_jsonl(chunks_path)
+        for document in iter_jsonl(documents_path):
+            document["chunks"] = [next(chunk_iter) for _ in range(document["total_chunks"])]
+            yield document
+
+    combined_json_path = output_dir / "combined_rag_dataset.json"
+    _log.info(f"Tallennetaan yhdistetty dataset: {combined_json_path}")
+    write_json_streaming(
+        combined_json_path,
+        {"metadata": metadata},
+        [("documents", iter_documents_with_chunks()), ("all_chunks", iter_jsonl(chunks_path))],
+    )
+    _log.info(f"✅ Yhdistetty dataset tallennettu: {combined_json_path}")
+
+    chunks_only_path = output_dir / "combined_chunks_only.json"
+    write_json_streaming(
+        chunks_only_path, {"metadata": metadata}, [("chunks", iter_jsonl(chunks_path))]
+    )
+    _log.info(f"✅ Chunkit tallennettu: {chunks_only_path}")
+
+
+# Työprosessikohtaiset instanssit: converter ja chunker alustetaan kerran
+# per prosessi (mallien lataus on hidasta), ei jokaiselle PDF:lle erikseen.
+_worker_converter: DocumentConverter | None = None
+_worker_chunker: HybridChunker | None = None
+
+
+def _init_worker(embed_model_id: str | None, max_tokens: int | None) -> None:
+    """Alusta työprosessin converter ja chunker (ProcessPoolExecutorin initializer)."""
+    global _worker_converter, _worker_chunker
+    _worker_converter = build_converter()
+    _worker_chunker = build_chunker(embed_model_id, max_tokens)
+
+
+def _process_in_worker(
+    pdf_path: Path, output_dir: Path, content_hash: str | None = None
+) -> dict[str, Any] | None:
+    """Prosessoi yksi dokumentti työprosessin omilla instansseilla."""
+    return process_single_document(
+        pdf_path, _worker_converter, _worker_chunker, output_dir, content_hash=content_hash
+    )
+
+
+def _convert_range_in_worker(
+    pdf_path: Path, page_range: tuple[int, int]
+) -> tuple[DoclingDocument | None, str]:
+    """Konvertoi yksi sivualue työprosessin converterilla."""
+    return convert_page_range(pdf_path, _worker_converter, page_range)
+
+
+def _finish_in_worker(
+    pdf_path: Path,
+    parts: list[tuple[DoclingDocument | None, str]],
+    output_dir: Path,
+    content_hash: str | None = None,
+) -> dict[str, Any] | None:
+    """Yhdistä sivualueet ja chunkkaa dokumentti työprosessissa."""
+    return process_converted_ranges(
+        pdf_path, parts, _worker_converter, _worker_chunker, output_dir, content_hash
+    )
+
+
+def iter_document_results(
+    pdf_files: list[Path],
+    output_dir: Path,
+    embed_model_id: str | None = None,
+    max_tokens: int | None = None,
+    workers: int = 1,
+    cached: dict[Path, tuple[Path, str, str]] | None = None,
+    min_split_pages: int = MIN_SPLIT_PAGES,
+    content_hashes: dict[Path, str] | None = None,
+) -> Iterator[tuple[Path, dict[str, Any] | None, str | None]]:
+    """
+    Prosessoi dokumentit ja palauttaa tulokset pdf_files-järjestyksessä.
+
+    Välimuistissa olevat dokumentit ladataan suoraan _rag.json -tiedostosta
+    ilman Doclingia; converter ja chunker luodaan vain jos jotain konvertoidaan.
+
+    Kun workers > 1, dokumentit prosessoidaan rinnakkain prosessipoolissa:
+    jokainen työprosessi alustaa oman converterin ja chunkerin kerran ja
+    ottaa PDF:iä jonosta. Valmistuneet tulokset puskuroidaan ja palautetaan
+    alkuperäisessä järjestyksessä, jotta global_chunk_id ja document_index
+    ovat samat kuin sarjallisessa ajossa. Dokumentit annetaan pooliin
+    syötejärjestyksessä liukuvana ikkunana (korkeintaan
+    DOCUMENTS_IN_FLIGHT_PER_WORKER * workers kesken), joten puskurissa odottaa
+    rajattu määrä tuloksia eikä muisti kasva dokumenttien määrän mukaan.
+
+    Vähintään min_split_pages-sivuiset PDF:t jaetaan PAGES_PER_RANGE-sivun
+    alueisiin, jotka konvertoidaan erillisinä tehtävinä ja yhdistetään
+    ennen chunkkausta. Näin yksi suuri PDF ei varaa yhtä työprosessia koko
+    ajon loppua kohden muiden odottaessa. Alueiden koko ei riipu
+    työprosessien määrästä, joten sarjallinen ajo jakaa samoin ja tulos on
+    sama. Ikkunaan kerralla lisättävät tehtävät annetaan pooliin sivumäärän
+    mukaan laskevasti.
+
+    Args:
+        pdf_files: Lista PDF-tiedostojen polkuja
+        output_dir: Output-kansio
+        embed_model_id: Embedding-mallin ID chunkerille
+        max_tokens: Chunkkien maksimikoko tokenissa
+        workers: Rinnakkaisten työprosessien määrä
+        cached: {pdf_path: (rag_json-polku, status, sisältöhash)} välimuistissa oleville
+        min_split_pages: Pienin sivualueisiin jaettava sivumäärä (0 = ei jakoa)
+        content_hashes: {pdf_path: SHA256} jo lasketut sisältöhashit; annetaan
+                        työprosesseille, jotta PDF:ää ei lueta uudelleen hashia varten
+
+    Yields:
+        (pdf_path, tulos tai None, virheilmoitus tai None)
+    """
+    cached = cached or {}
+    content_hashes = content_hashes or {}
+    to_convert = [pdf_path for pdf_path in pdf_files if pdf_path not in cached]
+
+    def load_cached(pdf_path: Path) -> tuple[dict[str, Any] | None, str | None]:
+        rag_json_path, status, content_hash = cached[pdf_path]
+        try:
+            return load_cached_document(pdf_path, rag_json_path, status, content_hash), None
+        except (OSError, json.JSONDecodeError, KeyError, ValueError) as e:
+            _log.error(f"❌ Välimuistin lataus epäonnistui: {pdf_path.name}: {e}")
+            return None, f"{type(e).__name__}: {e}"
+
+    if not to_convert:
+        for pdf_path in pdf_files:
+            yield pdf_path, *load_cached(pdf_path)
+        return
+
+    # Sivumäärät vain jos jakoa käytetään (pypdfium2 lukee vain rakenteen)
+    page_counts: dict[Path, int | None] = {}
+    split: dict[Path, list[tuple[int, int]]] = {}
+    if min_split_pages > 0:
+        for pdf_path in to_convert:
+            page_counts[pdf_path] = count_pdf_pages(pdf_path)
+            ranges = page_ranges(page_counts[pdf_path], min_split_pages=min_split_pages)
+            if ranges:
+                split[pdf_path] = ranges
+                _log.info(f"{pdf_path.name}: {page_counts[pdf_path]} sivua, {len(ranges)} sivualuetta")
+
+    if workers <= 1:
+        converter = build_converter()
+        chunker = build_chunker(embed_model_id, max_tokens)
+        for pdf_path in pdf_files:
+            if pdf_path in cached:
+                yield pdf_path, *load_cached(pdf_path)
+                continue
+            result = process_single_document(
+                pdf_path, converter, chunker, output_dir, split.get(pdf_path), content_hashes.get(pdf_path)
+            )
+            error = None if result else "Prosessointi epäonnistui (katso loki)"
+            yield pdf_path, result, error
+        return
+
+    _log.info(f"Rinnakkaisprosessointi: {workers} työprosessia")
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(embed_model_id, max_tokens),
+    ) as executor:
+        # Tehtävä -> (dokumentin indeksi, sivualueen indeksi tai None)
+        pending: dict[Future, tuple[int, int | None]] = {}
+        parts: dict[int, list[tuple[DoclingDocument | None, str] | None]] = {}
+
+        # Konvertoitavat syötejärjestyksessä; ikkunaan otetaan seuraavat kunnes
+        # kesken on max_in_flight dokumenttia. Ensimmäinen palauttamaton
+        # dokumentti on aina ikkunassa, joten järjestyksessä eteneminen ei jumiudu.
+        convert_order = [index for index, pdf_path in enumerate(pdf_files) if pdf_path not in cached]
+        max_in_flight = DOCUMENTS_IN_FLIGHT_PER_WORKER * workers
+        admitted = 0
+        in_flight = 0
+
+        def submit_window() -> None:
+            nonlocal admitted, in_flight
+            batch = convert_order[admitted:admitted + max_in_flight - in_flight]
+            admitted += len(batch)
+            in_flight += len(batch)
+            # Pisimmät ensin: suuri PDF ei jää erän hännille yhden prosessin varaan
+            for index in sorted(batch, key=lambda index: -(page_counts.get(pdf_files[index]) or 0)):
+                pdf_path = pdf_files[index]
+                if pdf_path in split:
+                    parts[index] = [None] * len(split[pdf_path])
+                    for part, page_range in enumerate(split[pdf_path]):
+                        future = executor.submit(_convert_range_in_worker, pdf_path, page_range)
+                        pending[future] = (index, part)
+                else:
+                    future = executor.submit(
+                        _process_in_worker, pdf_path, output_dir, content_hashes.get(pdf_path)
+                    )
+                    pending[future] = (index, None)
+
+        submit_window()
+
+        # Puskuroi epäjärjestyksessä valmistuneet tulokset (korkeintaan ikkunan verran)
+        ready: dict[int, tuple[dict[str, Any] | None, str | None]] = {}
+        next_index = 0
+
+        def drain_cached() -> Iterator[tuple[Path, dict[str, Any] | None, str | None]]:
+            # Välimuistin dokumentit ladataan vasta vuorollaan (muisti pysyy pienenä)
+            nonlocal next_index
+            while next_index < len(pdf_files) and pdf_files[next_index] in cached:
+                yield pdf_files[next_index], *load_cached(pdf_files[next_index])
+                next_index += 1
+
+        yield from drain_cached()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, part = pending.pop(future)
+                pdf_path = pdf_files[index]
+                try:
+                    outcome = future.result()
+                except Exception as e:
+                    # Työprosessi kaatui (esim. muisti loppui): raportoi tiedostokohtaisesti
+                    _log.error(f"❌ Työprosessi epäonnistui: {pdf_path.name}: {e}")
+                    if part is None:
+                        ready[index] = (None, f"{type(e).__name__}: {e}")
+                        continue
+                    outcome = (None, ConversionStatus.FAILURE.value)
+
+                if part is None:
+                    ready[index] = (outcome, None if outcome else "Prosessointi epäonnistui (katso loki)")
+                    continue
+
+                # Sivualue valmis: kun kaikki ovat valmiita, yhdistä ja chunkkaa
+                parts[index][part] = outcome
+                if all(done_part is not None for done_part in parts[index]):
+                    try:
+                        future = executor.submit(
+                            _finish_in_worker, pdf_path, parts.pop(index), output_dir,
+                            content_hashes.get(pdf_path),
+                        )
+                    except Exception as e:
+                        _log.error(f"❌ Työprosessi epäonnistui: {pdf_path.name}: {e}")
+                        ready[index] = (None, f"{type(e).__name__}: {e}")
+                        continue
+                    pending[future] = (index, None)
+
+            while next_index in ready:
+                result, error = ready.pop(next_index)
+                yield pdf_files[next_index], result, error
+                next_index += 1
+                in_flight -= 1
+                yield from drain_cached()
+            submit_window()
+
+
+def _log_summary(
+    metadata: dict[str, Any],
+    elapsed_time: float,
+    total_documents: int,
+    output_dir: Path,
+) -> None:
+    """Kirjaa prosessoinnin yhteenveto lokiin."""
+    _log.info(f"\n{'='*60}")
+    _log.info("PROSESSOINTI VALMIS!")
+    _log.info(f"{'='*60}")
+    _log.info(f"Käsitelty dokumentteja: {metadata['processed_documents']}/{total_documents}")
+    _log.info(f"Epäonnistuneita: {metadata['failed_documents']}")
+    for failed in metadata["failed_files"]:
+        _log.info(f"  - {failed['source_file']}: {failed['error']}")
+    _log.info(f"Yhteensä chunkkeja: {metadata['total_chunks']}")
+    _log.info(f"Kokonaisaika: {elapsed_time/60:.1f} minuuttia")
+    _log.info(f"Keskimääräinen aika/dokumentti: {elapsed_time/total_documents:.1f} sekuntia")
+    _log.info(f"Output-kansio: {output_dir}")
+    _log.info(f"{'='*60}\n")
+
+
 def process_all_documents_for_rag(
     root_dir: str | Path,
     output_dir: str | Path | None = None,
     embed_model_id: str | None = None,
     max_tokens: int | None = None,
     save_individual: bool = True,
+    workers: int = 1,
+    incremental: bool = True,
+    streaming: bool = False,
+    write_combined_json: bool = True,
+    checkpoint_every: int = 10,
+    min_split_pages: int = MIN_SPLIT_PAGES,
 ) -> dict[str, Any]:
     """
     Prosessoi kaikki PDF-dokumentit kansiosta ja yhdistää ne RAG:ia varten.
@@ -183,9 +1016,24 @@ def process_all_documents_for_rag(
                     Jos None, käytetään tokenizerin oletusarvoa (~512)
                     Suuremmat arvot = suuremmat chunkit = vähemmän chunkkeja
         save_individual: Tallenna myös yksittäiset dokumentit
+        workers: Rinnakkaisten työprosessien määrä (1 = sarjallinen ajo).
+                 Tulokset yhdistetään aina samassa järjestyksessä.
+        incremental: Käytä sisältöhashiin perustuvaa välimuistia: muuttumattomat
+                     PDF:t ladataan olemassa olevista _rag.json -tiedostoista
+                     ilman Docling-konversiota. False = konvertoi kaikki.
+        streaming: Kirjoita jokaisen dokumentin chunkit combined_chunks.jsonl
+                   -tiedostoon heti dokumentin valmistuttua sen sijaan että kaikki
+                   pidetään muistissa. Muistinkulutus rajoittuu suurimpaan dokumenttiin.
+        write_combined_json: Streaming-tilassa johda lopuksi myös
+                             combined_rag_dataset.json ja combined_chunks_only.json
+        checkpoint_every: Streaming-tilassa fsync joka N:n dokumentin jälkeen
+        min_split_pages: Vähintään näin monisivuiset PDF:t konvertoidaan
+                         PAGES_PER_RANGE-sivun alueina rinnakkain ja yhdistetään
+                         ennen chunkkausta (0 = ei jakoa)
 
     Returns:
-        Dict joka sisältää kaikki chunkit yhdistettynä
+        Dict joka sisältää kaikki chunkit yhdistettynä. Streaming-tilassa vain
+        metadata ja output-tiedostojen polut (chunkit ovat JSONL-tiedostossa).
     """
     root_dir = Path(root_dir)
     if not root_dir.exists():
@@ -208,62 +1056,35 @@ def process_all_documents_for_rag(
     if not pdf_files:
         raise ValueError(f"Ei löydetty PDF-tiedostoja kansiosta: {root_dir}")
 
-    # Konfiguroi converter
-    pipeline_options = PdfPipelineOptions(
-        do_ocr=True,
-        do_table_structure=True,
-    )
-
-    pdf_format_option = PdfFormatOption(
-        pipeline_options=pipeline_options,
-        backend=DoclingParseV4DocumentBackend,
-    )
-
-    converter = DocumentConverter(
-        format_options={InputFormat.PDF: pdf_format_option}
-    )
-
-    # Alusta chunker
-    if embed_model_id or max_tokens:
-        from docling_core.transforms.chunker.tokenizer.huggingface import (
-            HuggingFaceTokenizer,
+    # Laske sisältöhashit ja tarkista mitkä dokumentit löytyvät jo välimuistista
+    manifest = load_manifest(output_dir)
+    config_key = pipeline_config_key(embed_model_id, max_tokens, min_split_pages)
+    cache_keys: dict[Path, str] = {}
+    content_hashes: dict[Path, str] = {}
+    cached: dict[Path, tuple[Path, str, str]] = {}
+    for pdf_path in pdf_files:
+        content_hash = content_hashes[pdf_path] = cached_content_hash(pdf_path, manifest)
+        cache_key = f"{content_hash}:{config_key}"
+        cache_keys[pdf_path] = cache_key
+        entry = manifest["entries"].get(cache_key)
+        if incremental and entry:
+            rag_json_path = output_dir / entry["rag_json"]
+            if rag_json_path.exists():
+                cached[pdf_path] = (rag_json_path, entry["status"], content_hash)
+    if incremental:
+        _log.info(
+            f"Inkrementaalinen ajo: {len(cached)} dokumenttia välimuistista, "
+            f"{len(pdf_files) - len(cached)} konvertoidaan"
         )
-        from transformers import AutoTokenizer
-
-        # Jos embed_model_id on määritelty, käytä sitä
-        # Muuten käytä oletustokenizeria
-        if embed_model_id:
-            model_id = embed_model_id
-            _log.info(f"Käytetään embedding-mallia: {embed_model_id}")
-        else:
-            # Oletustokenizer (sentence-transformers/all-MiniLM-L6-v2)
-            model_id = "sentence-transformers/all-MiniLM-L6-v2"
-            _log.info(f"Käytetään oletustokenizeria: {model_id}")
-
-        tokenizer_obj = AutoTokenizer.from_pretrained(model_id)
-        
-        # Jos max_tokens on määritelty, käytä sitä
-        # Muuten käytä tokenizerin oletusarvoa
-        tokenizer_kwargs = {}
-        if max_tokens is not None:
-            tokenizer_kwargs["max_tokens"] = max_tokens
-            _log.info(f"Chunkkien maksimikoko: {max_tokens} tokenia")
-        else:
-            default_max = getattr(tokenizer_obj, "model_max_length", 512)
-            _log.info(f"Käytetään tokenizerin oletusarvoa: {default_max} tokenia")
 
-        tokenizer = HuggingFaceTokenizer(
-            tokenizer=tokenizer_obj,
-            **tokenizer_kwargs,
-        )
-        chunker = HybridChunker(tokenizer=tokenizer)
-    else:
-        chunker = HybridChunker()
-        _log.info("Käytetään oletus-chunkeria (oletusarvo ~512 tokenia)")
+    # Manifestiin jäävät vain tämän ajon dokumentit
+    new_entries: dict[str, dict[str, str]] = {}
 
     # Prosessoi kaikki dokumentit
     all_chunks = []
     all_documents = []
+    jsonl_writer = CombinedJsonlWriter(output_dir, checkpoint_every) if streaming else None
+    failed_files: list[dict[str, str]] = []
     processed_count = 0
     failed_count = 0
     total_chunks = 0
@@ -274,24 +1095,43 @@ def process_all_documents_for_rag(
     _log.info(f"Prosessoidaan {len(pdf_files)} dokumenttia...")
     _log.info(f"{'='*60}\n")
 
-    for i, pdf_path in enumerate(pdf_files, 1):
+    document_results = iter_document_results(
+        pdf_files, output_dir, embed_model_id, max_tokens, workers, cached, min_split_pages,
+        content_hashes,
+    )
+    for i, (pdf_path, result, error) in enumerate(document_results, 1):
         _log.info(f"[{i}/{len(pdf_files)}] {pdf_path.name}")
 
-        result = process_single_document(pdf_path, converter, chunker, output_dir)
-
         if result:
-            all_documents.append(result["document"])
-            # Lisää dokumentin chunkit globaaliin listaan
+            document_index = processed_count
             for chunk in result["chunks"]:
                 # Lisää globaali chunk_id
-                chunk["global_chunk_id"] = len(all_chunks)
-                chunk["document_index"] = len(all_documents) - 1
-                all_chunks.append(chunk)
+                chunk["global_chunk_id"] = total_chunks
+                chunk["document_index"] = document_index
                 total_chunks += 1
 
+            if jsonl_writer:
+                jsonl_writer.write_document(result["document"], result["chunks"])
+            else:
+                # Lisää dokumentin chunkit globaaliin listaan
+                all_documents.append(result["document"])
+                all_chunks.extend(result["chunks"])
+
             processed_count += 1
+            if pdf_path in cached:
+                rag_json_path = cached[pdf_path][0]
+            else:
+                rag_json_path = document_json_path(
+                    pdf_path, output_dir, result["document"]["content_sha256"]
+                )
+            new_entries[cache_keys[pdf_path]] = {
+                "source_file": str(pdf_path),
+                "rag_json": rag_json_path.relative_to(output_dir).as_posix(),
+                "status": result["status"],
+            }
         else:
             failed_count += 1
+            failed_files.append({"source_file": str(pdf_path), "error": error or ""})
 
         # Progress-indikaattori
         if i % 10 == 0 or i == len(pdf_files):
@@ -303,23 +1143,64 @@ def process_all_documents_for_rag(
                 f"{processed_count} onnistui, {failed_count} epäonnistui. "
                 f"Arvioitu aika jäljellä: {remaining/60:.1f} min"
             )
+            # Checkpoint: keskeytetty ajo jatkuu tästä seuraavalla kerralla
+            save_manifest(
+                output_dir,
+                {**manifest, "entries": {**manifest["entries"], **new_entries}},
+            )
+
+    if jsonl_writer:
+        jsonl_writer.close()
+
+    manifest["entries"] = new_entries
+    manifest["files"] = {
+        key: value for key, value in manifest["files"].items()
+        if Path(key) in cache_keys
+    }
+    save_manifest(output_dir, manifest)
 
     elapsed_time = time.time() - start_time
 
+    metadata = {
+        "total_documents": len(pdf_files),
+        "processed_documents": processed_count,
+        "failed_documents": failed_count,
+        "failed_files": failed_files,
+        "cached_documents": len(cached),
+        "total_chunks": total_chunks,
+        "processing_date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "root_directory": str(root_dir),
+    }
+
+    if jsonl_writer:
+        metadata_path = output_dir / COMBINED_METADATA_FILENAME
+        with metadata_path.open("w", encoding="utf-8") as f:
+            json.dump(metadata, f, ensure_ascii=False, indent=2)
+        _log.info(f"✅ Chunkit tallennettu (JSONL): {jsonl_writer.chunks_path}")
+
+        if write_combined_json:
+            _log.info(f"\n{'='*60}")
+            _log.info("Johdetaan yhdistetyt JSON-tiedostot JSONL:stä...")
+            _log.info(f"{'='*60}\n")
+            write_combined_json_from_jsonl(output_dir, metadata)
+
+        _log_summary(metadata, elapsed_time, len(pdf_files), output_dir)
+        return {
+            "metadata": metadata,
+            "output_files": {
+                "chunks_jsonl": str(jsonl_writer.chunks_path),
+                "documents_jsonl": str(jsonl_writer.documents_path),
+                "metadata_json": str(metadata_path),
+            },
+        }
+
     # Yhdistä kaikki chunkit yhteen tiedostoon
     _log.info(f"\n{'='*60}")
     _log.info("Yhdistetään kaikki chunkit yhteen tiedostoon...")
     _log.info(f"{'='*60}\n")
 
     combined_data = {
-        "metadata": {
-            "total_documents": len(pdf_files),
-            "processed_documents": processed_count,
-            "failed_documents": failed_count,
-            "total_chunks": total_chunks,
-            "processing_date": time.strftime("%Y-%m-%d %H:%M:%S"),
-            "root_directory": str(root_dir),
-        },
+        "metadata": metadata,
         "documents": all_documents,
         "all_chunks": all_chunks,
     }
@@ -341,17 +1222,7 @@ def process_all_documents_for_rag(
         json.dump(chunks_only_data, f, ensure_ascii=False, indent=2)
     _log.info(f"✅ Chunkit tallennettu: {chunks_only_path}")
 
-    # Yhteenveto
-    _log.info(f"\n{'='*60}")
-    _log.info("PROSESSOINTI VALMIS!")
-    _log.info(f"{'='*60}")
-    _log.info(f"Käsitelty dokumentteja: {processed_count}/{len(pdf_files)}")
-    _log.info(f"Epäonnistuneita: {failed_count}")
-    _log.info(f"Yhteensä chunkkeja: {total_chunks}")
-    _log.info(f"Kokonaisaika: {elapsed_time/60:.1f} minuuttia")
-    _log.info(f"Keskimääräinen aika/dokumentti: {elapsed_time/len(pdf_files):.1f} sekuntia")
-    _log.info(f"Output-kansio: {output_dir}")
-    _log.info(f"{'='*60}\n")
+    _log_summary(metadata, elapsed_time, len(pdf_files), output_dir)
 
     return combined_data
 
@@ -378,6 +1249,8 @@ def main():
             embed_model_id=None,  # Käytä oletusta, tai määritä oma malli
             max_tokens=512,  # Chunkkien maksimikoko tokenissa (Lapua-RAG optimaalinen: 384-512)
             save_individual=True,  # Tallenna myös yksittäiset dokumentit
+            workers=int(os.getenv("LAPUA_RAG_WORKERS", "1")),  # Rinnakkaiset työprosessit
+            streaming=True,  # Kirjoita chunkit JSONL:ään dokumentti kerrallaan
         )
 
         print(f"\n✅ Prosessointi valmis!")
@@ -0,0 +1,279 @@
+"""
+Hakutulosten välimuisti (LRU + valinnainen TTL + datasetin versio).
+
+Tämä moduuli:
+- Normalisoi kyselyn (pienet kirjaimet, välilyönnit, "§398" -> "§ 398") ja
+  suodattimet välimuistin avaimeksi, joten samat pykälä-, organisaatio- ja
+  vuosikyselyt osuvat samaan tulokseen
+- Rajaa välimuistin koon arvioituna muistinkäyttönä (tavuina) ja poistaa
+  vanhimmin käytetyt tulokset ensin (LRU)
+- Vanhentaa tulokset valinnaisesti TTL:n jälkeen
+- Laskee datasetin version (dataset_version: ingest- ja indeksimanifestien
+  sisältö sekä normalized_chunks.jsonl:n koko ja mtime) ja tyhjentää
+  välimuistin, kun versio vaihtuu (set_version)
+- Laskee osumat, ohitukset, poistot ja muistinkäytön metriikoiksi
+
+Käyttö:
+    cache = QueryCache(max_bytes=64 * 1024 * 1024, ttl=300,
+                       version=dataset_version("106PDF_output"))
+    key = cache_key("§ 81 takausvastuu", {"year": 2025}, k=10)
+    version = cache.version
+    results = cache.get(key)
+    if results is None:
+        results = searcher.search(...)["results"]
+        cache.put(key, results, version)
+
+    # Taustatarkistus (ei pyyntöjen yhteydessä, ks. search_service)
+    cache.set_version(dataset_version("106PDF_output"))
+"""
+
+import hashlib
+import re
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+from atomic_dir import resolve_directory
+
+# Konfiguraatiovakiot
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+ENTRY_OVERHEAD_BYTES = 200  # Avain, OrderedDict-solmu ja aikaleima per tulos
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+_PYKALA_PATTERN = re.compile(r"§\s*(\d+)")
+
+# Pienet tiedostot, joiden sisältö määrää datasetin version (output-hakemiston suhteen)
+VERSION_FILES = ("ingest_manifest.json",)
+
+# Indeksit: versioon otetaan käytössä olevan version nimi ja sen manifest.json.
+# Indeksit julkaistaan versiohakemistoina (atomic_dir), joten jokainen
+# uudelleenrakennus vaihtaa version.
+VERSION_INDEX_DIRS = (
+    "normalized_chunks.metaindex",
+    "normalized_chunks.bm25",
+    "normalized_chunks.colstore",
+    "normalized_chunks.embeddings",
+    "normalized_chunks.ann",
+    "normalized_chunks.sections",
+)
+
+# Iso lähdetiedosto: versioon otetaan vain koko ja mtime (ei sisällön hashia)
+SOURCE_FILE = "normalized_chunks.jsonl"
+
+
+def normalize_query(query: str) -> str:
+    """Normalisoi kysely avainta varten (NFC, pienet kirjaimet, välilyönnit, pykälät)."""
+    query = unicodedata.normalize("NFC", query).casefold()
+    query = _PYKALA_PATTERN.sub(r"§ \1", query)
+    return _WHITESPACE_PATTERN.sub(" ", query).strip()
+
+
+def cache_key(
+    query: str,
+    filters: dict[str, Any] | None = None,
+    k: int = 10,
+    fusion: str = "rrf",
+    expand: bool = False,
+) -> tuple:
+    """
+    Muodosta välimuistin avain kyselystä ja hakuparametreista.
+
+    Suodattimien arvot verrataan merkkijonoina (year=2025 ja year="2025" ovat
+    sama avain), ja tyhjät suodattimet ohitetaan.
+
+    Args:
+        query: Hakulause
+        filters: MetadataIndex.query()-suodattimet
+        k: Tulosten määrä
+        fusion: Fuusiomenetelmä
+        expand: Laajennetaanko osumat koko pykälään
+
+    Returns:
+        Hashattava avain
+    """
+    normalized_filters = tuple(sorted(
+        (name, str(value)) for name, value in (filters or {}).items() if value not in (None, "")
+    ))
+    return normalize_query(query), normalized_filters, k, fusion, expand
+
+
+def _file_digest(path: Path) -> str | None:
+    """Pienen tiedoston SHA256, None jos tiedostoa ei ole."""
+    try:
+        return hashlib.sha256(path.read_bytes()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def _file_fingerprint(path: Path) -> str | None:
+    """Tiedoston koko ja mtime_ns, None jos tiedostoa ei ole."""
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def dataset_version(base_dir: str | Path) -> str:
+    """
+    Laske output-hakemiston datasetin versio.
+
+    Versio on hash ingest-manifestin sisällöstä, indeksien käytössä olevista
+    versioista (CURRENT) ja niiden manifesteista sekä normalized_chunks.jsonl:n
+    koosta ja mtimesta. Kaikki luettavat tiedostot
+    ovat pieniä, joten tarkistus vie millisekunteja datasetin koosta riippumatta.
+
+    Args:
+        base_dir: Output-hakemisto
+
+    Returns:
+        16 merkin hex-tunniste
+    """
+    base_dir = Path(base_dir)
+    digest = hashlib.sha256()
+    digest.update(f"{SOURCE_FILE}={_file_fingerprint(base_dir / SOURCE_FILE)}\n".encode("utf-8"))
+    for name in VERSION_FILES:
+        digest.update(f"{name}={_file_digest(base_dir / name)}\n".encode("utf-8"))
+    for name in VERSION_INDEX_DIRS:
+        index_dir = resolve_directory(base_dir / name)
+        manifest = _file_digest(index_dir / "manifest.json")
+        digest.update(f"{name}={index_dir.name}:{manifest}\n".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def _estimate_bytes(value: Any) -> int:
+    """Arvioi arvon muistinkäyttö (sisäkkäiset dictit, listat ja skalaarit)."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        return size + sum(_estimate_bytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return size + sum(_estimate_bytes(item) for item in value)
+    return size
+
+
+class QueryCache:
+    """
+    Muistirajattu LRU-välimuisti hakutuloksille.
+
+    Säieturvallinen (yksi lukko). Välimuisti ei itse lue levyä: omistaja
+    tarkistaa datasetin version (dataset_version) ja kertoo muutoksesta
+    set_version():lla.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        ttl: float | None = None,
+        version: str | None = None,
+    ) -> None:
+        """
+        Args:
+            max_bytes: Arvioidun muistinkäytön yläraja
+            ttl: Tuloksen elinaika sekunteina (None = ei vanhene)
+            version: Datasetin versio (esim. dataset_version())
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: OrderedDict[tuple, tuple[Any, int, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.version = version
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def set_version(self, version: str) -> bool:
+        """
+        Päivitä datasetin versio ja tyhjennä välimuisti, jos se on vaihtunut.
+
+        Args:
+            version: Uusi datasetin versio
+
+        Returns:
+            True, jos versio vaihtui
+        """
+        with self._lock:
+            if version == self.version:
+                return False
+            self.version = version
+            self._entries.clear()
+            self.bytes = 0
+            self.invalidations += 1
+            return True
+
+    def get(self, key: tuple) -> Any | None:
+        """Palauta tallennettu tulos (None = ei välimuistissa tai vanhentunut)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires = entry
+            if expires and now >= expires:
+                del self._entries[key]
+                self.bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: tuple, value: Any, version: str | None = None) -> None:
+        """
+        Tallenna tulos.
+
+        Args:
+            key: cache_key():n avain
+            value: Tallennettava tulos (ei saa muuttaa tallennuksen jälkeen)
+            version: Datasetin versio haun alussa (cache.version); jos versio
+                     on vaihtunut haun aikana, tulosta ei tallenneta
+        """
+        size = _estimate_bytes(value) + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl else 0.0
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self._entries[key] = (value, size, expires)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Tyhjennä välimuisti."""
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict[str, Any]:
+        """Palauta osumat, ohitukset, poistot ja muistinkäyttö."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "version": self.version,
+        }
@@ -0,0 +1,648 @@
+"""
+Paikallinen HTTP-hakupalvelu (asyncio, ei ulkoisia riippuvuuksia).
+
+Tämä palvelu:
+- Avaa hakemiston indeksit kerran käynnistyksessä (HybridSearcher, mmap),
+  joten pyynnöt eivät lue normalized_chunks.jsonl:ää
+- Käsittelee samanaikaiset yhteydet asyncio-palvelimella (HTTP/1.1 keep-alive:
+  sama yhteys palvelee useita pyyntöjä)
+- Kerää käynnissä olevien pyyntöjen kyselyt mikroeriksi ja enkoodaa ne yhdellä
+  encoder-kutsulla (max MAX_BATCH kyselyä tai MAX_WAIT_MS odotus)
+- Ajaa haut säiepoolissa, jotta tapahtumasilmukka ei pysähdy
+- Palauttaa toistuvat kyselyt välimuistista (query_cache.QueryCache: LRU,
+  valinnainen TTL) ennen enkoodausta
+- Tarkistaa datasetin version taustatehtävänä (VERSION_CHECK_INTERVAL) säikeessä;
+  kun indeksit on rakennettu uudelleen, avaa uuden HybridSearcherin, vaihtaa
+  sen käyttöön, tyhjentää välimuistin ja sulkee vanhan, kun sen haut ovat valmiit
+- Voi käynnistää useita työprosesseja samaan porttiin (SO_REUSEPORT);
+  mmap-indeksit jaetaan prosessien kesken käyttöjärjestelmän sivuvälimuistissa
+
+Endpointit:
+    POST /search    {"query": "...", "filters": {"year": 2025}, "k": 10, "fusion": "rrf",
+                     "expand": false}
+    GET  /search?q=...&k=10&organisaatio=...&year=2025&expand=1
+                    (expand: osumat laajennetaan koko pykälään, ks. hybrid_search)
+    GET  /health    tila ja indeksien tiedot
+    GET  /metrics   Prometheus-tekstimuoto (pyynnöt, vaiheiden latenssit, eräkoot,
+                    välimuistin osumasuhde ja muistinkäyttö)
+
+Käyttö:
+    python search_service.py [output_dir]
+    LAPUA_RAG_SERVICE_PORT=8080 LAPUA_RAG_SERVICE_WORKERS=4 python search_service.py 106PDF_output
+    LAPUA_RAG_CACHE_MB=128 LAPUA_RAG_CACHE_TTL=600 python search_service.py   # 0 MB = ei välimuistia
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import time
+from collections import deque
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from embed_chunks import Encoder, build_encoder
+from hybrid_search import FUSION_METHODS, HybridSearcher
+from query_cache import QueryCache, cache_key, dataset_version
+
+# Konfiguroi logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+_log = logging.getLogger(__name__)
+
+# Konfiguraatiovakiot
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+MAX_BATCH = 32  # Kyselyjä per encoder-kutsu
+MAX_WAIT_MS = 2.0  # Kuinka kauan erää kerätään ensimmäisen kyselyn jälkeen
+SEARCH_THREADS = 4
+MAX_IN_FLIGHT = 256  # Tätä useampi samanaikainen haku -> 503
+MAX_K = 100
+MAX_BODY_BYTES = 64 * 1024
+KEEPALIVE_TIMEOUT = 30.0  # Joutilaan yhteyden sulkemisaika (s)
+LATENCY_WINDOW = 2048  # Metriikoiden persentiilit viimeisistä N pyynnöstä
+DEFAULT_CACHE_MB = 64  # Tulosvälimuistin koko per työprosessi
+VERSION_CHECK_INTERVAL = 1.0  # Datasetin version tarkistusväli (s)
+
+# GET /search -parametrit, jotka ovat metatietosuodattimia
+FILTER_PARAMS = ("organisaatio", "pykala", "section_type", "year", "month", "date_from", "date_to")
+
+_DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+_MONTH_PATTERN = re.compile(r"\d{4}-(0[1-9]|1[0-2])")
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class HTTPError(Exception):
+    """Pyyntövirhe, joka palautetaan asiakkaalle annetulla statuksella."""
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class ServiceMetrics:
+    """Prosessikohtaiset laskurit ja liukuvan ikkunan latenssit."""
+
+    def __init__(self, window: int = LATENCY_WINDOW) -> None:
+        self.started = time.time()
+        self.requests: dict[tuple[str, int], int] = {}
+        self.latencies: dict[str, deque[float]] = {}
+        self.window = window
+        self.batches = 0
+        self.batched_queries = 0
+        self.in_flight = 0
+
+    def record_request(self, path: str, status: int) -> None:
+        key = (path, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+
+    def record_latency(self, stage: str, ms: float) -> None:
+        self.latencies.setdefault(stage, deque(maxlen=self.window)).append(ms)
+
+    def record_batch(self, size: int) -> None:
+        self.batches += 1
+        self.batched_queries += size
+
+    def render(self, cache_stats: dict[str, Any] | None = None) -> str:
+        """Palauta metriikat Prometheus-tekstimuodossa (valinnaisesti välimuistin tilastot)."""
+        lines = [
+            "# TYPE lapua_rag_requests_total counter",
+            *(
+                f'lapua_rag_requests_total{{path="{path}",status="{status}"}} {count}'
+                for (path, status), count in sorted(self.requests.items())
+            ),
+            "# TYPE lapua_rag_latency_ms summary",
+        ]
+        for stage, values in sorted(self.latencies.items()):
+            ordered = sorted(values)
+            for quantile in (0.5, 0.95, 0.99):
+                value = ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+                lines.append(f'lapua_rag_latency_ms{{stage="{stage}",quantile="{quantile}"}} {value:.3f}')
+            lines.append(f'lapua_rag_latency_ms_count{{stage="{stage}"}} {len(ordered)}')
+        lines += [
+            "# TYPE lapua_rag_embed_batches_total counter",
+            f"lapua_rag_embed_batches_total {self.batches}",
+            "# TYPE lapua_rag_embed_batched_queries_total counter",
+            f"lapua_rag_embed_batched_queries_total {self.batched_queries}",
+            "# TYPE lapua_rag_in_flight gauge",
+            f"lapua_rag_in_flight {self.in_flight}",
+            "# TYPE lapua_rag_uptime_seconds gauge",
+            f"lapua_rag_uptime_seconds {time.time() - self.started:.0f}",
+        ]
+        if cache_stats is not None:
+            for name in ("hits", "misses", "evictions", "expirations", "invalidations"):
+                lines += [
+                    f"# TYPE lapua_rag_cache_{name}_total counter",
+                    f"lapua_rag_cache_{name}_total {cache_stats[name]}",
+                ]
+            lines += [
+                "# TYPE lapua_rag_cache_hit_ratio gauge",
+                f"lapua_rag_cache_hit_ratio {cache_stats['hit_ratio']:.4f}",
+                "# TYPE lapua_rag_cache_entries gauge",
+                f"lapua_rag_cache_entries {cache_stats['entries']}",
+                "# TYPE lapua_rag_cache_bytes gauge",
+                f"lapua_rag_cache_bytes {cache_stats['bytes']}",
+                "# TYPE lapua_rag_cache_max_bytes gauge",
+                f"lapua_rag_cache_max_bytes {cache_stats['max_bytes']}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+class EmbeddingBatcher:
+    """
+    Kerää samanaikaisten pyyntöjen kyselyt eriksi ja enkoodaa ne kerralla.
+
+    Erä lähtee, kun MAX_BATCH kyselyä on koossa tai ensimmäisestä kyselystä on
+    kulunut MAX_WAIT_MS. Samat kyselytekstit enkoodataan erässä vain kerran.
+    """
+
+    def __init__(
+        self,
+        encoder: Encoder,
+        metrics: ServiceMetrics,
+        max_batch: int = MAX_BATCH,
+        max_wait_ms: float = MAX_WAIT_MS,
+    ) -> None:
+        self.encoder = encoder
+        self.metrics = metrics
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        # Yksi enkooderisäie: erät suoritetaan järjestyksessä
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed-batch")
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+
+    async def encode(self, query: str) -> np.ndarray:
+        """Palauta kyselyn vektori (odottaa erän valmistumista)."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((query, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        """Lähetä kerätty erä enkooderisäikeeseen."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._run(batch))
+
+    async def _run(self, batch: list[tuple[str, asyncio.Future]]) -> None:
+        texts = list(dict.fromkeys(query for query, _ in batch))
+        start = time.perf_counter()
+        try:
+            vectors = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self.encoder.encode, texts
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.metrics.record_latency("embed_batch", (time.perf_counter() - start) * 1000)
+        self.metrics.record_batch(len(batch))
+        by_text = {text: np.asarray(vector, dtype=np.float32) for text, vector in zip(texts, vectors)}
+        for query, future in batch:
+            if not future.done():
+                future.set_result(by_text[query])
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+def _validate_filters(filters: dict[str, Any]) -> dict[str, Any]:
+    """
+    Tarkista suodattimien arvot ennen hakua (MetadataIndex.query()-muoto).
+
+    Tyhjät arvot ohitetaan ja vuosi normalisoidaan kokonaisluvuksi.
+
+    Raises:
+        HTTPError: Virheellinen arvo (esim. päivämäärä muussa kuin YYYY-MM-DD-muodossa)
+    """
+    validated: dict[str, Any] = {}
+    for name, value in filters.items():
+        if value is None or value == "":
+            continue
+        if name == "year":
+            if isinstance(value, bool) or not re.fullmatch(r"\d{4}", str(value).strip()):
+                raise HTTPError(400, f"Suodattimen 'year' pitää olla vuosi (YYYY): {value!r}")
+            validated[name] = int(value)
+            continue
+        if not isinstance(value, str):
+            raise HTTPError(400, f"Suodattimen '{name}' pitää olla merkkijono")
+        if name == "month" and not _MONTH_PATTERN.fullmatch(value):
+            raise HTTPError(400, f"Suodattimen 'month' pitää olla muotoa YYYY-MM: {value!r}")
+        if name in ("date_from", "date_to"):
+            try:
+                if not _DATE_PATTERN.fullmatch(value):
+                    raise ValueError(value)
+                date.fromisoformat(value)
+            except ValueError as e:
+                raise HTTPError(400, f"Suodattimen '{name}' pitää olla päivämäärä YYYY-MM-DD: {value!r}") from e
+        validated[name] = value
+    return validated
+
+
+class SearchService:
+    """HTTP-reititys ja haun suoritus; omistaa HybridSearcherin ja vaihtaa sen datasetin muuttuessa."""
+
+    def __init__(
+        self,
+        searcher: HybridSearcher,
+        search_threads: int = SEARCH_THREADS,
+        cache: QueryCache | None = None,
+        version: str | None = None,
+    ) -> None:
+        self.searcher = searcher
+        self.cache = cache
+        self.version = version
+        self.metrics = ServiceMetrics()
+        self.batcher: EmbeddingBatcher | None = None
+        self._update_batcher()
+        self._executor = ThreadPoolExecutor(max_workers=search_threads, thread_name_prefix="search")
+        # Versiotarkistus ja indeksien avaus/sulkeminen omassa säikeessään
+        self._reload_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reload")
+        # Käynnissä olevat haut per searcher; vaihdettu searcher suljetaan, kun luku on 0
+        self._active: dict[HybridSearcher, int] = {}
+        self._retired: set[HybridSearcher] = set()
+
+    def _update_batcher(self) -> None:
+        """Luo kyselyjen eräenkooderi, kun searcherilla on ensimmäistä kertaa vektorihaku."""
+        searcher = self.searcher
+        if self.batcher is None and searcher.encoder is not None and searcher.vectors is not None:
+            self.batcher = EmbeddingBatcher(searcher.encoder, self.metrics)
+
+    def health(self) -> dict[str, Any]:
+        """Palvelun tila ja ladatut indeksit."""
+        searcher = self.searcher
+        return {
+            "status": "ok",
+            "base_dir": str(searcher.base_dir),
+            "rows": searcher.metadata_index.rows,
+            "vector_search": searcher.vectors is not None,
+            "ann_index": searcher.ann is not None,
+            "section_index": searcher.sections is not None,
+            "encoder": searcher.encoder.name if searcher.encoder is not None else None,
+            "dataset_version": self.version,
+            "pid": os.getpid(),
+            "uptime_s": round(time.time() - self.metrics.started, 1),
+        }
+
+    @staticmethod
+    def parse_search_request(method: str, query_string: str, body: bytes) -> dict[str, Any]:
+        """
+        Poimi hakuparametrit POST-rungosta tai GET-kyselymerkkijonosta.
+
+        Returns:
+            {"query", "filters", "k", "fusion", "expand"}
+
+        Raises:
+            HTTPError: Puuttuva tai virheellinen parametri
+        """
+        if method == "POST":
+            try:
+                request = json.loads(body or b"{}")
+            except (UnicodeDecodeError, json.JSONDecodeError) as e:
+                raise HTTPError(400, f"Virheellinen JSON: {e}") from e
+            if not isinstance(request, dict):
+                raise HTTPError(400, "Pyynnön rungon pitää olla JSON-objekti")
+        else:
+            params = {key: values[-1] for key, values in parse_qs(query_string).items()}
+            request = {
+                "query": params.get("q", params.get("query")),
+                "filters": {name: params[name] for name in FILTER_PARAMS if name in params},
+                "k": params.get("k", 10),
+                "fusion": params.get("fusion", "rrf"),
+                "expand": params.get("expand", "0") not in ("", "0", "false"),
+            }
+
+        query = request.get("query")
+        if not isinstance(query, str) or not query.strip():
+            raise HTTPError(400, "Parametri 'query' puuttuu")
+        filters = request.get("filters") or {}
+        if not isinstance(filters, dict) or set(filters) - set(FILTER_PARAMS):
+            raise HTTPError(400, f"Tuetut suodattimet: {', '.join(FILTER_PARAMS)}")
+        filters = _validate_filters(filters)
+        try:
+            k = int(request.get("k", 10))
+        except (TypeError, ValueError) as e:
+            raise HTTPError(400, "Parametrin 'k' pitää olla kokonaisluku") from e
+        if not 1 <= k <= MAX_K:
+            raise HTTPError(400, f"k:n pitää olla välillä 1-{MAX_K}")
+        fusion = request.get("fusion", "rrf")
+        if fusion not in FUSION_METHODS:
+            raise HTTPError(400, f"Tuetut fuusiot: {', '.join(FUSION_METHODS)}")
+        expand = request.get("expand", False)
+        if not isinstance(expand, bool):
+            raise HTTPError(400, "Parametrin 'expand' pitää olla true tai false")
+        return {"query": query, "filters": filters, "k": k, "fusion": fusion, "expand": expand}
+
+    async def search(self, request: dict[str, Any]) -> dict[str, Any]:
+        """Suorita haku: välimuisti, kyselyn eräenkoodaus ja haku säiepoolissa."""
+        start = time.perf_counter()
+        key = None
+        # Versio luetaan ennen searcheria: jos indeksit vaihtuvat välissä, put() hylkää tuloksen
+        version = self.version
+        if self.cache is not None:
+            key = cache_key(request["query"], request["filters"], request["k"], request["fusion"], request["expand"])
+            results = self.cache.get(key)
+            if results is not None:
+                elapsed = (time.perf_counter() - start) * 1000
+                self.metrics.record_latency("cache_hit", elapsed)
+                return {"results": results, "timings_ms": {"cache": elapsed, "total": elapsed}, "cached": True}
+
+        if self.metrics.in_flight >= MAX_IN_FLIGHT:
+            raise HTTPError(503, "Liikaa samanaikaisia hakuja")
+        self.metrics.in_flight += 1
+        searcher = self.searcher
+        self._active[searcher] = self._active.get(searcher, 0) + 1
+        try:
+            loop = asyncio.get_running_loop()
+            # Suodatin ensin: jos rivejä ei ole, kyselyä ei enkoodata turhaan
+            rows = None
+            if request["filters"]:
+                rows = await loop.run_in_executor(
+                    self._executor, lambda: searcher.metadata_index.query(**request["filters"])
+                )
+            query_vector = None
+            if self.batcher is not None and searcher.vectors is not None and (rows is None or len(rows)):
+                query_vector = await self.batcher.encode(request["query"])
+            embedded = time.perf_counter()
+            response = await loop.run_in_executor(
+                self._executor,
+                lambda: searcher.search(
+                    request["query"],
+                    k=request["k"],
+                    fusion=request["fusion"],
+                    query_vector=query_vector,
+                    expand_sections=request["expand"],
+                    rows=rows,
+                ),
+            )
+        finally:
+            self.metrics.in_flight -= 1
+            self._release(searcher)
+
+        timings = response["timings_ms"]
+        timings["encode"] = (embedded - start) * 1000  # Sisältää suodatuksen ja erän odotuksen
+        timings["request"] = (time.perf_counter() - start) * 1000
+        for stage, ms in timings.items():
+            self.metrics.record_latency(stage, ms)
+        if self.cache is not None:
+            self.cache.put(key, response["results"], version)
+        response["cached"] = False
+        return response
+
+    def _release(self, searcher: HybridSearcher) -> None:
+        """Vähennä searcherin hakulaskuria ja sulje se, jos se on vaihdettu ja vapaa."""
+        self._active[searcher] -= 1
+        if self._active[searcher] == 0:
+            del self._active[searcher]
+            if searcher in self._retired:
+                self._retired.discard(searcher)
+                self._reload_executor.submit(searcher.close)
+
+    async def reload_if_changed(self) -> bool:
+        """
+        Avaa indeksit uudelleen, jos datasetin versio on vaihtunut.
+
+        Version laskenta ja indeksien avaus ajetaan säikeessä. Uusi searcher
+        otetaan käyttöön ennen välimuistin tyhjennystä, joten uuteen versioon ei
+        tallenneta vanhan searcherin tuloksia. Vanha searcher suljetaan, kun sen
+        käynnissä olevat haut ovat valmiit.
+
+        Returns:
+            True, jos searcher vaihdettiin
+        """
+        loop = asyncio.get_running_loop()
+        base_dir = self.searcher.base_dir
+        version = await loop.run_in_executor(self._reload_executor, dataset_version, base_dir)
+        if version == self.version:
+            return False
+        try:
+            searcher = await loop.run_in_executor(
+                self._reload_executor, HybridSearcher, base_dir, self.searcher.encoder
+            )
+        except Exception as e:
+            # Esim. uudelleenrakennus kesken tai encoder vaihtunut: yritetään seuraavalla kierroksella
+            _log.warning(f"Indeksien uudelleenavaus epäonnistui (versio {version}): {e}")
+            return False
+
+        previous = self.searcher
+        self.searcher = searcher
+        self._update_batcher()
+        self.version = version
+        if self.cache is not None:
+            self.cache.set_version(version)
+        if previous in self._active:
+            self._retired.add(previous)
+        else:
+            self._reload_executor.submit(previous.close)
+        _log.info(f"Indeksit avattu uudelleen (datasetin versio {version})")
+        return True
+
+    async def watch_dataset(self, interval: float = VERSION_CHECK_INTERVAL) -> None:
+        """Tarkista datasetin versio interval-välein, kunnes tehtävä perutaan."""
+        while True:
+            await asyncio.sleep(interval)
+            await self.reload_if_changed()
+
+    async def dispatch(self, method: str, target: str, body: bytes) -> tuple[int, str, bytes]:
+        """Reititä pyyntö. Palauttaa (status, content-type, runko)."""
+        url = urlsplit(target)
+        if url.path == "/health":
+            return 200, "application/json", _json_bytes(self.health())
+        if url.path == "/metrics":
+            cache_stats = self.cache.stats() if self.cache is not None else None
+            return 200, "text/plain; version=0.0.4", self.metrics.render(cache_stats).encode("utf-8")
+        if url.path == "/search":
+            if method not in ("GET", "POST"):
+                raise HTTPError(405, "Sallitut metodit: GET, POST")
+            request = self.parse_search_request(method, url.query, body)
+            try:
+                response = await self.search(request)
+            except (TypeError, ValueError) as e:
+                raise HTTPError(400, str(e)) from e
+            return 200, "application/json", _json_bytes(response)
+        raise HTTPError(404, f"Tuntematon polku: {url.path}")
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Palvele yhteyden pyynnöt (keep-alive) kunnes asiakas sulkee sen."""
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, asyncio.LimitOverrunError):
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    return
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+                keep_alive = (
+                    headers.get("connection", "").lower() != "close"
+                    if version == "HTTP/1.1"
+                    else headers.get("connection", "").lower() == "keep-alive"
+                )
+
+                path = urlsplit(target).path
+                try:
+                    length = int(headers.get("content-length", "0"))
+                    if length > MAX_BODY_BYTES:
+                        keep_alive = False
+                        raise HTTPError(413, "Liian suuri pyyntö")
+                    body = await reader.readexactly(length) if length else b""
+                    status, content_type, payload = await self.dispatch(method, target, body)
+                except HTTPError as e:
+                    status, content_type, payload = e.status, "application/json", _json_bytes({"error": str(e)})
+                except ValueError:
+                    status, content_type, payload = 400, "application/json", _json_bytes({"error": "Virheellinen pyyntö"})
+                except Exception as e:
+                    _log.error(f"Virhe pyynnössä {method} {target}: {e}", exc_info=True)
+                    status, content_type, payload = 500, "application/json", _json_bytes({"error": "Sisäinen virhe"})
+                self.metrics.record_request(path if path in ("/search", "/health", "/metrics") else "other", status)
+
+                writer.write(
+                    f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+                    + payload
+                )
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except ConnectionError:
+            return
+        finally:
+            writer.close()
+
+    def close(self) -> None:
+        """Pysäytä säiepoolit ja sulje kaikki searcherit (myös käytössä oleva)."""
+        if self.batcher is not None:
+            self.batcher.close()
+        self._executor.shutdown(wait=True)
+        self._reload_executor.shutdown(wait=True)
+        for searcher in (*self._retired, self.searcher):
+            searcher.close()
+        self._retired.clear()
+
+
+def _json_bytes(data: Any) -> bytes:
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+async def serve(
+    base_dir: str | Path,
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    encoder: Encoder | None = None,
+    reuse_port: bool = False,
+    cache_bytes: int = DEFAULT_CACHE_MB * 1024 * 1024,
+    cache_ttl: float | None = None,
+) -> None:
+    """
+    Avaa indeksit ja palvele kunnes prosessi pysäytetään.
+
+    Args:
+        base_dir: Output-hakemisto (indeksit, ks. hybrid_search.py)
+        host: Kuunneltava osoite
+        port: Kuunneltava portti
+        encoder: Kyselyjen encoder (oletus: embedding-matriisin encoder)
+        reuse_port: SO_REUSEPORT (useampi työprosessi samassa portissa)
+        cache_bytes: Tulosvälimuistin koko tavuina (0 = ei välimuistia)
+        cache_ttl: Välimuistin tuloksen elinaika sekunteina (None = ei vanhene)
+    """
+    version = dataset_version(base_dir)  # Ennen avausta: muutos avauksen aikana huomataan
+    cache = QueryCache(cache_bytes, cache_ttl, version) if cache_bytes > 0 else None
+    service = SearchService(HybridSearcher(base_dir, encoder), cache=cache, version=version)
+    watcher = asyncio.create_task(service.watch_dataset())
+    try:
+        server = await asyncio.start_server(
+            service.handle_connection, host, port, reuse_port=reuse_port or None
+        )
+        _log.info(f"Hakupalvelu kuuntelee: http://{host}:{port} (pid {os.getpid()})")
+        async with server:
+            await server.serve_forever()
+    finally:
+        watcher.cancel()
+        service.close()
+
+
+def _run_worker(base_dir: Path, host: str, port: int, encoder_id: str | None, reuse_port: bool) -> None:
+    encoder = build_encoder(encoder_id) if encoder_id else None
+    cache_mb = float(os.getenv("LAPUA_RAG_CACHE_MB", str(DEFAULT_CACHE_MB)))
+    cache_ttl = os.getenv("LAPUA_RAG_CACHE_TTL")
+    try:
+        asyncio.run(serve(
+            base_dir, host, port, encoder, reuse_port,
+            cache_bytes=int(cache_mb * 1024 * 1024),
+            cache_ttl=float(cache_ttl) if cache_ttl else None,
+        ))
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    """Pääfunktio."""
+    if len(sys.argv) > 1:
+        base_dir = Path(sys.argv[1])
+    else:
+        default_dir = Path("106PDF_output")
+        base_dir = default_dir if default_dir.exists() else Path(os.getenv("LAPUA_RAG_OUTPUT_DIR", "."))
+
+    host = os.getenv("LAPUA_RAG_SERVICE_HOST", DEFAULT_HOST)
+    port = int(os.getenv("LAPUA_RAG_SERVICE_PORT", str(DEFAULT_PORT)))
+    workers = int(os.getenv("LAPUA_RAG_SERVICE_WORKERS", "1"))
+    encoder_id = os.getenv("LAPUA_RAG_EMBED_MODEL")
+
+    if workers <= 1:
+        _run_worker(base_dir, host, port, encoder_id, reuse_port=False)
+        return
+
+    # Työprosessit jakavat portin (Linux: ydin tasaa yhteydet SO_REUSEPORT:lla)
+    processes = [
+        multiprocessing.Process(target=_run_worker, args=(base_dir, host, port, encoder_id, True))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()
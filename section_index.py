@@ -0,0 +1,245 @@
+"""
+Pykälätason yläindeksi normalisoiduille chunkeille (kaksitasoinen haku).
+
+Chunkit on rajattu ~512 tokeniin, joten yksi §-päätös jakautuu usein
+useaan chunkkiin. Tämä moduuli:
+- Ryhmittelee chunkit pykäliksi avaimella (source_file, pykala)
+- Tallentaa rivikohtaisen pykälänumeron (int32, -1 = ei pykälää) ja pykälien
+  rivit offset-taulukon kanssa, joten haun osuma laajennetaan koko pykälään
+  yhdellä taulukkohaulla ja viipaleella
+- Kirjoittaa indeksin hakemistoon ja lukee sen mmap:llä
+
+Rivinumero on chunkin järjestysnumero normalized_chunks.jsonl:ssä (sama kuin
+chunk_store.ColumnarChunkStore:n ja metadata_index.MetadataIndex:n rivi).
+
+Hakemiston rakenne:
+    manifest.json       - pykälien avaimet (source_file, pykala) id-järjestyksessä
+    row_section.bin     - rivi -> pykälän id (int32, -1 = ei pykälää)
+    section_offsets.bin - pykälän rivien alku section_rows.bin:ssä (uint32, pykäliä + 1)
+    section_rows.bin    - pykälien rivit järjestettyinä peräkkäin (uint32)
+
+Käyttö:
+    index = SectionIndex.load("106PDF_output/normalized_chunks.sections")
+    rows = index.section_rows(row)   # kaikki osuman pykälän chunkit
+"""
+
+import json
+import mmap
+import sys
+from array import array
+from collections.abc import Iterable, Sequence
+from pathlib import Path
+from typing import Any
+
+from atomic_dir import atomic_directory, resolve_directory
+from chunk_store import SourceFingerprint
+
+INDEX_VERSION = 1
+
+
+class SectionIndex:
+    """
+    Rivi -> pykälä -> pykälän rivit.
+
+    Taulukot ovat array- tai mmap-näkymiä, joten laajennus on kaksi
+    indeksointia ja viipale riippumatta datasetin koosta.
+    """
+
+    def __init__(
+        self,
+        rows: int,
+        keys: list[tuple[str, str]],
+        row_section: Sequence[int],
+        section_offsets: Sequence[int],
+        section_rows: Sequence[int],
+    ) -> None:
+        self.rows = rows
+        self.keys = keys  # Pykälän id -> (source_file, pykala)
+        self.row_section = row_section
+        self.section_offsets = section_offsets
+        self.section_rows_flat = section_rows
+        self.source_fingerprint: str | None = None  # Ks. chunk_store.SourceFingerprint
+        self._mmaps: list[mmap.mmap] = []
+        self._views: list[memoryview] = []
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[dict[str, Any]]) -> "SectionIndex":
+        """Rakenna indeksi muistiin chunkeista (rivinumero = järjestys)."""
+        builder = SectionIndexBuilder()
+        for chunk in chunks:
+            builder.add(chunk)
+        return builder.build()
+
+    @classmethod
+    def load(cls, path: str | Path) -> "SectionIndex":
+        """
+        Lataa indeksi hakemistosta (taulukot mapataan muistiin).
+
+        Args:
+            path: SectionIndexBuilder.write():n kirjoittama hakemisto
+
+        Returns:
+            SectionIndex
+        """
+        path = resolve_directory(path)
+        with (path / "manifest.json").open("r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != INDEX_VERSION:
+            raise ValueError(f"Tuntematon indeksin versio: {manifest.get('version')}")
+        if manifest["byteorder"] != sys.byteorder:
+            raise ValueError(f"Indeksi on kirjoitettu {manifest['byteorder']}-endian-koneella")
+
+        mmaps: list[mmap.mmap] = []
+        views: list[memoryview] = []
+
+        def map_file(filename: str, typecode: str) -> memoryview:
+            with (path / filename).open("rb") as f:
+                if f.seek(0, 2) == 0:
+                    view = memoryview(array(typecode))
+                else:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    mmaps.append(mapped)
+                    view = memoryview(mapped).cast(typecode)
+            views.append(view)
+            return view
+
+        index = cls(
+            manifest["rows"],
+            [tuple(key) for key in manifest["sections"]],
+            map_file("row_section.bin", "i"),
+            map_file("section_offsets.bin", "I"),
+            map_file("section_rows.bin", "I"),
+        )
+        index.source_fingerprint = manifest.get("source_fingerprint")
+        index._mmaps = mmaps
+        index._views = views
+        return index
+
+    def __len__(self) -> int:
+        """Pykälien määrä."""
+        return len(self.keys)
+
+    def section_of(self, row: int) -> int | None:
+        """Palauta rivin pykälän id (None, jos chunkilla ei ole pykälää)."""
+        section = self.row_section[row]
+        return section if section >= 0 else None
+
+    def rows_of(self, section: int) -> list[int]:
+        """Palauta pykälän rivit järjestettyinä (kopio, ei pidä mmapia auki)."""
+        return list(self.section_rows_flat[self.section_offsets[section]:self.section_offsets[section + 1]])
+
+    def section_rows(self, row: int) -> list[int]:
+        """
+        Laajenna rivi koko pykälään.
+
+        Args:
+            row: Haun osuman rivinumero
+
+        Returns:
+            Pykälän kaikki rivit järjestettyinä (pelkkä rivi, jos pykälää ei ole)
+        """
+        section = self.row_section[row]
+        if section < 0:
+            return [row]
+        return self.rows_of(section)
+
+    def close(self) -> None:
+        """Vapauta mmapit (vain load():lla avatulle indeksille)."""
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        for mapped in self._mmaps:
+            mapped.close()
+        self._mmaps = []
+
+    def __enter__(self) -> "SectionIndex":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+class SectionIndexBuilder:
+    """
+    Rakentaa pykäläindeksin chunk kerrallaan.
+
+    Muistissa pidetään pykälien avaimet ja rivinumerot (4 tavua per rivi).
+
+    Käyttö:
+        builder = SectionIndexBuilder()
+        for chunk in chunks:
+            builder.add(chunk)
+        builder.write("106PDF_output/normalized_chunks.sections")
+    """
+
+    def __init__(self) -> None:
+        self.rows = 0
+        self._ids: dict[tuple[str, str], int] = {}
+        self._row_section = array("i")
+        self._section_rows: list[array] = []
+        self._fingerprint = SourceFingerprint()
+
+    @property
+    def sections(self) -> int:
+        """Pykälien määrä."""
+        return len(self._ids)
+
+    def add(self, chunk: dict[str, Any]) -> None:
+        """Lisää seuraava chunk (rivinumero = lisäysjärjestys)."""
+        pykala = chunk.get("pykala")
+        if pykala is None:
+            self._row_section.append(-1)
+        else:
+            key = (chunk.get("source_file") or "", pykala)
+            section = self._ids.get(key)
+            if section is None:
+                section = self._ids[key] = len(self._section_rows)
+                self._section_rows.append(array("I"))
+            self._section_rows[section].append(self.rows)
+            self._row_section.append(section)
+        self._fingerprint.update(chunk.get("text", ""))
+        self.rows += 1
+
+    def _flatten(self) -> tuple[array, array]:
+        """Pykälien rivit yhdeksi taulukoksi ja alkuoffsetit."""
+        offsets = array("I", [0])
+        flat = array("I")
+        for rows in self._section_rows:
+            flat.extend(rows)
+            offsets.append(len(flat))
+        return offsets, flat
+
+    def build(self) -> SectionIndex:
+        """Palauta muistissa oleva indeksi."""
+        offsets, flat = self._flatten()
+        index = SectionIndex(self.rows, list(self._ids), self._row_section, offsets, flat)
+        index.source_fingerprint = self._fingerprint.hexdigest()
+        return index
+
+    def write(self, path: str | Path) -> None:
+        """
+        Kirjoita indeksi hakemistoon atomisesti (ks. atomic_dir).
+
+        Args:
+            path: Output-hakemisto
+        """
+        with atomic_directory(path) as staging:
+            offsets, flat = self._flatten()
+            for filename, values in (
+                ("row_section.bin", self._row_section),
+                ("section_offsets.bin", offsets),
+                ("section_rows.bin", flat),
+            ):
+                with (staging / filename).open("wb") as f:
+                    values.tofile(f)
+
+            manifest = {
+                "version": INDEX_VERSION,
+                "rows": self.rows,
+                "source_fingerprint": self._fingerprint.hexdigest(),
+                "byteorder": sys.byteorder,
+                # Pykälän id = listan indeksi
+                "sections": [list(key) for key in self._ids],
+            }
+            with (staging / "manifest.json").open("w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,287 @@
+"""
+Doclingin taulukkorakenne dokumenttikohtaisena binäärisivutiedostona.
+
+Tämä moduuli:
+- Poimii DoclingDocumentin taulukoista solut: teksti, rivi- ja sarakeväli
+  (row/col span), otsikkoliput (sarake-, rivi- ja osio-otsikko) ja bbox
+  (muunnettuna vasemman yläkulman origoon, kun sivun korkeus tunnetaan;
+  taulukon origo on otsakkeessa, "coord_origin")
+- Kirjoittaa solut sarakkeittain yhteen tiedostoon (<stem>_tables.bin
+  _rag.json:n vieressä); taulukkokohtaiset tiedot (ref, sivu, koko, otsikko)
+  ovat tiedoston JSON-otsakkeessa
+- Lukee sivutiedoston takaisin taulukoiksi, joten postiprosessoinnin ei
+  tarvitse päätellä rakennetta linearisoidusta tekstistä
+- Johtaa soluista rivin ja sarakkeen otsikot (taulukkoindeksiä varten)
+
+Taulukot yhdistetään chunkkeihin doc_items-metadatan "ref"-kentällä
+(esim. "#/tables/3").
+
+Tiedoston rakenne:
+    MAGIC (4 tavua) + otsakkeen pituus (uint32) + JSON-otsake
+    + sarakkeet peräkkäin (sijainnit otsakkeessa, natiivi tavujärjestys)
+
+Käyttö:
+    tables = extract_table_cells(doc)
+    write_table_cells(table_cells_path(doc_json_path), tables)
+    for table in read_table_cells(path):
+        for cell in table["cells"]:
+            ...
+"""
+
+import json
+import sys
+from array import array
+from pathlib import Path
+from typing import Any
+
+# Konfiguraatiovakiot
+TABLE_CELLS_VERSION = 2  # 2: bboxit TOPLEFT-origossa ja taulukon coord_origin otsakkeessa
+LEGACY_VERSIONS = (1,)  # Luetaan edelleen (coord_origin = None, origo tuntematon)
+MAGIC = b"LRTC"
+
+# Kiinteän leveyden solusarakkeet: sarake -> array-typecode
+CELL_COLUMNS = {
+    "row_start": "H",
+    "row_end": "H",  # Yksi yli viimeisen rivin (Doclingin end_row_offset_idx)
+    "col_start": "H",
+    "col_end": "H",
+    "flags": "B",  # FLAG_*-bitit
+    "bbox": "f",  # l, t, r, b per solu (0, 0, 0, 0 = ei bboxia), origo taulukon coord_origin
+}
+
+FLAG_COLUMN_HEADER = 1
+FLAG_ROW_HEADER = 2
+FLAG_ROW_SECTION = 4
+
+
+def table_cells_path(doc_json_path: Path) -> Path:
+    """Sivutiedoston polku dokumentin _rag.json-tiedoston vieressä."""
+    return doc_json_path.with_name(doc_json_path.name.replace("_rag.json", "_tables.bin"))
+
+
+def extract_table_cells(doc: Any) -> list[dict[str, Any]]:
+    """
+    Poimi DoclingDocumentin taulukot ja solut.
+
+    Args:
+        doc: DoclingDocument
+
+    Solujen bboxit muunnetaan vasemman yläkulman origoon (TOPLEFT), kun
+    taulukon sivun korkeus on tiedossa; muuten ne säilyvät Doclingin
+    origossa. Taulukon coord_origin kertoo solujen origon (None = ei bboxeja).
+
+    Returns:
+        Lista taulukoita: ref, page, num_rows, num_cols, caption,
+        coord_origin, cells (solut: text, row_start, row_end, col_start,
+        col_end, column_header, row_header, row_section, bbox)
+    """
+    pages = getattr(doc, "pages", None) or {}
+    tables = []
+    for table in getattr(doc, "tables", None) or []:
+        data = table.data
+        page = table.prov[0].page_no if table.prov else None
+        page_item = pages.get(page)
+        page_height = page_item.size.height if page_item is not None and page_item.size else None
+        coord_origin = None
+        cells = []
+        for cell in data.table_cells:
+            bbox = cell.bbox
+            if bbox is not None:
+                if page_height is not None:
+                    bbox = bbox.to_top_left_origin(page_height)
+                if coord_origin is None:
+                    coord_origin = bbox.coord_origin.value
+                elif bbox.coord_origin.value != coord_origin:
+                    bbox = None  # Sekalaiset origot ilman sivun korkeutta: ei vertailukelpoinen
+            cells.append({
+                "text": cell.text,
+                "row_start": cell.start_row_offset_idx,
+                "row_end": cell.end_row_offset_idx,
+                "col_start": cell.start_col_offset_idx,
+                "col_end": cell.end_col_offset_idx,
+                "column_header": bool(cell.column_header),
+                "row_header": bool(cell.row_header),
+                "row_section": bool(cell.row_section),
+                "bbox": (bbox.l, bbox.t, bbox.r, bbox.b) if bbox is not None else None,
+            })
+        tables.append({
+            "ref": table.self_ref,
+            "page": page,
+            "num_rows": data.num_rows,
+            "num_cols": data.num_cols,
+            "caption": table.caption_text(doc) or None,
+            "coord_origin": coord_origin,
+            "cells": cells,
+        })
+    return tables
+
+
+def write_table_cells(path: str | Path, tables: list[dict[str, Any]]) -> None:
+    """
+    Kirjoita taulukot sivutiedostoon.
+
+    Args:
+        path: Output-tiedosto (<stem>_tables.bin)
+        tables: extract_table_cells()-tulos
+    """
+    columns = {name: array(typecode) for name, typecode in CELL_COLUMNS.items()}
+    text_data = bytearray()
+    text_offsets = array("I", [0])
+    table_entries = []
+
+    for table in tables:
+        table_entries.append({
+            "ref": table["ref"],
+            "page": table["page"],
+            "num_rows": table["num_rows"],
+            "num_cols": table["num_cols"],
+            "caption": table["caption"],
+            "coord_origin": table.get("coord_origin"),
+            "first_cell": len(text_offsets) - 1,
+            "cells": len(table["cells"]),
+        })
+        for cell in table["cells"]:
+            for name in ("row_start", "row_end", "col_start", "col_end"):
+                columns[name].append(cell[name])
+            columns["flags"].append(
+                (FLAG_COLUMN_HEADER if cell["column_header"] else 0)
+                | (FLAG_ROW_HEADER if cell["row_header"] else 0)
+                | (FLAG_ROW_SECTION if cell["row_section"] else 0)
+            )
+            columns["bbox"].extend(cell["bbox"] or (0.0, 0.0, 0.0, 0.0))
+            text_data += cell["text"].encode("utf-8")
+            text_offsets.append(len(text_data))
+
+    blobs = [(name, values.tobytes()) for name, values in columns.items()]
+    blobs += [("text.offsets", text_offsets.tobytes()), ("text.data", bytes(text_data))]
+    spans = {}
+    offset = 0
+    for name, blob in blobs:
+        spans[name] = [offset, len(blob)]
+        offset += len(blob)
+
+    header = json.dumps({
+        "version": TABLE_CELLS_VERSION,
+        "byteorder": sys.byteorder,
+        "tables": table_entries,
+        "columns": spans,
+    }, ensure_ascii=False).encode("utf-8")
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("wb") as f:
+        f.write(MAGIC)
+        f.write(array("I", [len(header)]).tobytes())
+        f.write(header)
+        for _, blob in blobs:
+            f.write(blob)
+
+
+def read_table_cells(path: str | Path) -> list[dict[str, Any]]:
+    """
+    Lue sivutiedoston taulukot.
+
+    Args:
+        path: write_table_cells():n kirjoittama tiedosto
+
+    Returns:
+        Taulukot samassa muodossa kuin extract_table_cells()
+    """
+    data = Path(path).read_bytes()
+    if data[:4] != MAGIC:
+        raise ValueError(f"Ei taulukkosivutiedosto: {path}")
+    header_length = array("I", data[4:8])[0]
+    header = json.loads(data[8:8 + header_length])
+    if header.get("version") != TABLE_CELLS_VERSION and header.get("version") not in LEGACY_VERSIONS:
+        raise ValueError(f"Tuntematon sivutiedoston versio: {header.get('version')}")
+    if header["byteorder"] != sys.byteorder:
+        raise ValueError(f"Sivutiedosto on kirjoitettu {header['byteorder']}-endian-koneella")
+
+    body = 8 + header_length
+
+    def column(name: str, typecode: str) -> array:
+        offset, length = header["columns"][name]
+        values = array(typecode)
+        values.frombytes(data[body + offset:body + offset + length])
+        return values
+
+    columns = {name: column(name, typecode) for name, typecode in CELL_COLUMNS.items()}
+    text_offsets = column("text.offsets", "I")
+    text_offset, _ = header["columns"]["text.data"]
+    text_base = body + text_offset
+
+    tables = []
+    for entry in header["tables"]:
+        cells = []
+        for i in range(entry["first_cell"], entry["first_cell"] + entry["cells"]):
+            flags = columns["flags"][i]
+            bbox = tuple(columns["bbox"][4 * i:4 * i + 4])
+            cells.append({
+                "text": data[text_base + text_offsets[i]:text_base + text_offsets[i + 1]].decode("utf-8"),
+                "row_start": columns["row_start"][i],
+                "row_end": columns["row_end"][i],
+                "col_start": columns["col_start"][i],
+                "col_end": columns["col_end"][i],
+                "column_header": bool(flags & FLAG_COLUMN_HEADER),
+                "row_header": bool(flags & FLAG_ROW_HEADER),
+                "row_section": bool(flags & FLAG_ROW_SECTION),
+                "bbox": bbox if any(bbox) else None,
+            })
+        table = {key: entry[key] for key in ("ref", "page", "num_rows", "num_cols", "caption")}
+        table["coord_origin"] = entry.get("coord_origin")  # Puuttuu vanhoista tiedostoista
+        table["cells"] = cells
+        tables.append(table)
+    return tables
+
+
+def labeled_cells(table: dict[str, Any]) -> list[dict[str, Any]]:
+    """
+    Liitä taulukon datasoluihin rivin ja sarakkeen otsikot.
+
+    Sarakkeen otsikko kootaan sarakkeen kattavista sarakeotsikkosoluista
+    (ylhäältä alas, pisteellä yhdistettynä kuten Doclingin linearisoinnissa).
+    Rivin otsikko on rivin riviotsikkosolu; jos taulukossa ei ole
+    riviotsikoita, ensimmäisen sarakkeen solu.
+
+    Args:
+        table: read_table_cells()/extract_table_cells()-taulukko
+
+    Returns:
+        Datasolut: row_label, column_label, text, row, col, page
+    """
+    cells = table["cells"]
+    has_row_headers = any(cell["row_header"] for cell in cells)
+    column_labels: dict[int, list[str]] = {}
+    row_labels: dict[int, list[str]] = {}
+
+    for cell in cells:
+        text = cell["text"].strip()
+        if not text:
+            continue
+        if cell["column_header"]:
+            for col in range(cell["col_start"], cell["col_end"]):
+                labels = column_labels.setdefault(col, [])
+                if text not in labels:
+                    labels.append(text)
+        elif cell["row_header"] or (not has_row_headers and cell["col_start"] == 0):
+            for row in range(cell["row_start"], cell["row_end"]):
+                labels = row_labels.setdefault(row, [])
+                if text not in labels:
+                    labels.append(text)
+
+    labeled = []
+    for cell in cells:
+        text = cell["text"].strip()
+        if not text or cell["column_header"] or cell["row_header"] or cell["row_section"]:
+            continue
+        if not has_row_headers and cell["col_start"] == 0:
+            continue
+        labeled.append({
+            "row_label": ".".join(row_labels.get(cell["row_start"], [])),
+            "column_label": ".".join(column_labels.get(cell["col_start"], [])),
+            "text": text,
+            "row": cell["row_start"],
+            "col": cell["col_start"],
+            "page": table["page"],
+        })
+    return labeled
@@ -0,0 +1,676 @@
+"""
+Rakenteinen indeksi taulukoille (tables_normalized.jsonl).
+
+Postiprosessointi tallentaa taulukot Doclingin linearisoimana tekstinä
+("Toimintatuotot, TA 2024 = 131.070. Toimintatuotot, Tot-% = 35,7").
+Tämä moduuli:
+- Lukee solut suoraan ingestin taulukkosivutiedostosta (table_cells.py), jos
+  taulukkorivillä on viittaus siihen; muuten jäsentää linearisoidun tekstin
+  rivit soluiksi (rivin otsikko, sarakkeen otsikko, arvo). Taulukkoa edeltävä
+  otsikkorivi (esim. "musiikkiopisto:") tallennetaan solun kontekstiksi
+- Muuntaa suomalaiset luvut (desimaalipilkku, tuhaterottimena piste tai
+  välilyönti, yksiköt % ja €) float-arvoiksi
+- Tallentaa solut sarakkeittain (sanakirjakoodatut merkkijonot, YYYYMMDD-päivämäärät,
+  float64-arvot) ja rakentaa posting-listat organisaatiolle, vuodelle, rivin
+  otsikolle sekä otsikoiden ja kontekstin sanoille
+- Vastaa budjettikysymyksiin ("toimintatuotot 2024 musiikkiopisto") suoralla
+  haulla posting-listoista ilman semanttista hakua
+
+Rivinumero on solun järjestysnumero; table_id on taulukon rivi
+tables_normalized.jsonl:ssä.
+
+Hakemiston rakenne:
+    manifest.json       - solujen määrä, sanakirjat ja posting-listojen sijainnit
+    <sarake>.bin        - kiinteän leveyden sarakkeet (typecode manifestissa)
+    value_text.data     - solujen alkuperäiset arvot UTF-8-tavuina peräkkäin
+    value_text.offsets  - int64-offsetit (solut + 1 kpl)
+    postings.bin        - posting-listat uint32-taulukkoina peräkkäin
+
+Käyttö:
+    python table_index.py [output_dir]                                  # rakenna indeksi
+    python table_index.py [output_dir] "toimintatuotot 2024 musiikkiopisto"  # hae
+"""
+
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import sys
+from array import array
+from collections import Counter
+from collections.abc import Iterable, Sequence
+from pathlib import Path
+from typing import Any
+
+from atomic_dir import atomic_directory, resolve_directory
+from bm25_index import tokenize
+from chunk_store import decode_date, encode_date
+from jsonl_io import iter_jsonl
+from metadata_index import intersect_postings
+from table_cells import labeled_cells, read_table_cells
+
+# Konfiguroi logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+_log = logging.getLogger(__name__)
+
+# Konfiguraatiovakiot
+INDEX_VERSION = 2
+MAX_CONTEXT_CHARS = 120  # Kontekstiotsikon enimmäispituus
+
+# Sanakirjakoodatut sarakkeet: int32-koodi per solu, -1 = None
+DICTIONARY_COLUMNS = ("source_file", "organisaatio", "context", "row_label", "column_label", "unit")
+
+# Kiinteän leveyden sarakkeet: sarake -> array-typecode
+NUMERIC_COLUMNS = {
+    "table_id": "I",
+    "kokous_pvm": "i",  # YYYYMMDD, 0 = None
+    "value": "d",  # NaN = ei numeerinen
+    "page": "H",  # Sivunumero sivutiedostosta, 0 = tuntematon
+}
+
+# Posting-listojen kentät ("term" = otsikoiden ja kontekstin sanat, katkaistuina;
+# "organisaatio_term" = organisaation nimen sanat vapaatekstihakua varten)
+INDEXED_FIELDS = ("organisaatio", "year", "row_label", "term", "organisaatio_term")
+
+# Luku: etumerkki, kokonaisosa (tuhaterotin välilyönti tai piste), desimaalit, yksikkö
+_NUMBER_PATTERN = re.compile(
+    r"(?P<sign>[-−–+]\s?)?"
+    r"(?P<integer>\d{1,3}(?:[ \u00a0\u202f]\d{3})+|\d{1,3}(?:\.\d{3})+|\d+)"
+    r"(?:[,.](?P<fraction>\d+))?"
+    r"\s?(?P<unit>%|€|t€|M€|euroa|kpl|hlö|h)?"
+)
+_THOUSANDS_SEPARATORS = str.maketrans("", "", " .\u00a0\u202f")
+_CELL_SEPARATOR = " = "
+_KEY_SEPARATOR = ", "
+
+
+def parse_number(text: str) -> tuple[float | None, str | None]:
+    """
+    Jäsennä suomalaisittain kirjoitettu luku.
+
+    Pilkku on desimaalierotin. Piste on tuhaterotin, jos sen jälkeen tulee
+    tasan kolmen numeron ryhmiä ("131.070" -> 131070), muuten desimaalierotin
+    ("35.7" -> 35.7).
+
+    Args:
+        text: Solun arvo (esim. "-1.124.270", "6 072,00 €", "35,7")
+
+    Returns:
+        (arvo, yksikkö); (None, None) jos teksti ei ole luku
+    """
+    match = _NUMBER_PATTERN.fullmatch(text.strip())
+    if match is None:
+        return None, None
+    value = float(f"{match.group('integer').translate(_THOUSANDS_SEPARATORS)}.{match.group('fraction') or 0}")
+    if match.group("sign") and match.group("sign")[0] != "+":
+        value = -value
+    return value, match.group("unit")
+
+
+def _split_key(key: str) -> tuple[str, str]:
+    """Jaa solun avain "rivin otsikko, sarakkeen otsikko" kahtia."""
+    row_label, separator, column_label = key.strip().partition(_KEY_SEPARATOR)
+    if not separator:
+        return row_label.rstrip(","), ""
+    return row_label.strip(), column_label.strip()
+
+
+def _split_value_and_key(part: str, previous_row: str) -> tuple[str, str | None]:
+    """
+    Erota solun arvo ja seuraavan solun avain ("131.070. Toimintatuotot, Tot-%").
+
+    Arvoissa ja otsikoissa voi olla pisteitä ("Tot. 09/2024"), joten
+    jakokohdaksi valitaan ". ", jonka jälkeinen osa on avain ("rivi, sarake").
+    Jos vaihtoehtoja on useita, suositaan edellisen solun rivin jatkoa, sitten
+    lukuarvoa ja lopuksi viimeistä jakokohtaa.
+
+    Returns:
+        (arvo, seuraava avain tai None jos osa on rivin viimeinen arvo)
+    """
+    candidates = [
+        match.start() for match in re.finditer(r"\. ", part)
+        if _KEY_SEPARATOR in part[match.end():] or part[match.end():].startswith(",")
+    ]
+    if not candidates:
+        return part.rstrip(". "), None
+    if previous_row:
+        for start in candidates:
+            if part[start + 2:].startswith(previous_row + _KEY_SEPARATOR):
+                return part[:start], part[start + 2:]
+    for start in candidates:
+        value = part[:start]
+        if not value.strip() or value.strip() == "-" or parse_number(value)[0] is not None:
+            return value, part[start + 2:]
+    start = candidates[-1]
+    return part[:start], part[start + 2:]
+
+
+def parse_table_cells(text: str) -> list[dict[str, Any]]:
+    """
+    Jäsennä linearisoidun taulukon solut.
+
+    Solurivit ovat muotoa "rivi, sarake = arvo. rivi, sarake = arvo"; muut
+    rivit ovat otsikoita, joista lähin edeltävä tallennetaan kontekstiksi.
+
+    Args:
+        text: Taulukon teksti (tables_normalized.jsonl:n "text")
+
+    Returns:
+        Lista soluja: context, row_label, column_label, value_text, value, unit
+    """
+    cells: list[dict[str, Any]] = []
+    context = None
+    for line in text.splitlines():
+        line = line.strip()
+        if _CELL_SEPARATOR not in line:
+            if line:
+                context = line.rstrip(":").strip()[:MAX_CONTEXT_CHARS] or context
+            continue
+
+        parts = line.split(_CELL_SEPARATOR)
+        key: str | None = parts[0]
+        row_label = ""
+        for index, part in enumerate(parts[1:], 1):
+            if key is None:
+                break
+            row_label, column_label = _split_key(key)
+            if index == len(parts) - 1:
+                value_text, key = part.rstrip(". "), None
+            else:
+                value_text, key = _split_value_and_key(part, row_label)
+            value_text = value_text.strip()
+            if not value_text:
+                continue  # Katkennut chunk ("4 =")
+            value, unit = parse_number(value_text)
+            cells.append({
+                "context": context,
+                "row_label": row_label,
+                "column_label": column_label,
+                "value_text": value_text,
+                "value": value,
+                "unit": unit,
+            })
+    return cells
+
+
+def table_context(text: str) -> str | None:
+    """Taulukkoa edeltävä otsikkorivi (viimeinen rivi ennen ensimmäistä solua)."""
+    context = None
+    for line in text.splitlines():
+        line = line.strip()
+        if _CELL_SEPARATOR in line:
+            break
+        if line:
+            context = line.rstrip(":").strip()[:MAX_CONTEXT_CHARS] or context
+    return context
+
+
+def _year(date_value: int) -> str | None:
+    return str(date_value // 10000) if date_value else None
+
+
+class TableIndex:
+    """
+    Taulukkosolujen sarakkeet ja posting-listat.
+
+    Sarakkeet ja posting-listat ovat array- tai mmap-näkymiä, joten haku on
+    sanakirjahakuja ja järjestettyjen listojen leikkauksia.
+
+    Käyttö:
+        with TableIndex.load("106PDF_output/tables_normalized.tableindex") as index:
+            for cell in index.lookup("toimintatuotot 2024 musiikkiopisto"):
+                print(cell["row_label"], cell["column_label"], cell["value"])
+    """
+
+    def __init__(
+        self,
+        rows: int,
+        tables: int,
+        dictionaries: dict[str, list[str]],
+        columns: dict[str, Sequence[Any]],
+        value_data: bytes | memoryview,
+        value_offsets: Sequence[int],
+        postings: dict[str, dict[str, Sequence[int]]],
+    ) -> None:
+        self.rows = rows
+        self.tables = tables
+        self.dictionaries = dictionaries
+        self.columns = columns
+        self._value_data = value_data
+        self._value_offsets = value_offsets
+        self.postings = postings
+        self._mmaps: list[mmap.mmap] = []
+        self._views: list[memoryview] = []
+
+    @classmethod
+    def from_tables(cls, tables: Iterable[dict[str, Any]], cells_dir: str | Path | None = None) -> "TableIndex":
+        """Rakenna indeksi muistiin taulukoista (table_id = järjestys, ks. TableIndexBuilder)."""
+        builder = TableIndexBuilder(cells_dir)
+        for table in tables:
+            builder.add_table(table)
+        return builder.build()
+
+    @classmethod
+    def load(cls, path: str | Path) -> "TableIndex":
+        """
+        Lataa indeksi hakemistosta (sarakkeet ja posting-listat mapataan muistiin).
+
+        Args:
+            path: TableIndexBuilder.write():n kirjoittama hakemisto
+
+        Returns:
+            TableIndex
+        """
+        path = resolve_directory(path)
+        with (path / "manifest.json").open("r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != INDEX_VERSION:
+            raise ValueError(f"Tuntematon indeksin versio: {manifest.get('version')}")
+        if manifest["byteorder"] != sys.byteorder:
+            raise ValueError(f"Indeksi on kirjoitettu {manifest['byteorder']}-endian-koneella")
+
+        mmaps: list[mmap.mmap] = []
+        views: list[memoryview] = []
+
+        def map_file(filename: str, typecode: str) -> memoryview:
+            with (path / filename).open("rb") as f:
+                if f.seek(0, 2) == 0:
+                    view = memoryview(array(typecode))
+                else:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    mmaps.append(mapped)
+                    view = memoryview(mapped).cast(typecode)
+            views.append(view)
+            return view
+
+        columns = {name: map_file(f"{name}.bin", "i") for name in DICTIONARY_COLUMNS}
+        columns.update({name: map_file(f"{name}.bin", typecode) for name, typecode in NUMERIC_COLUMNS.items()})
+        base = map_file("postings.bin", "I")
+
+        def view(span: list[int]) -> memoryview:
+            offset, length = span
+            sliced = base[offset:offset + length]
+            views.append(sliced)
+            return sliced
+
+        postings = {
+            field: {value: view(span) for value, span in values.items()}
+            for field, values in manifest["fields"].items()
+        }
+        index = cls(
+            manifest["rows"],
+            manifest["tables"],
+            manifest["dictionaries"],
+            columns,
+            map_file("value_text.data", "B"),
+            map_file("value_text.offsets", "q"),
+            postings,
+        )
+        index._mmaps = mmaps
+        index._views = views
+        return index
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def posting(self, field: str, value: Any) -> Sequence[int]:
+        """Palauta kentän arvon posting-lista (tyhjä jos arvoa ei ole)."""
+        return self.postings.get(field, {}).get(str(value), ())
+
+    def get(self, row: int) -> dict[str, Any]:
+        """Palauta solu dictinä."""
+        if not 0 <= row < self.rows:
+            raise IndexError(row)
+        cell: dict[str, Any] = {"row": row, "table_id": self.columns["table_id"][row]}
+        for name in DICTIONARY_COLUMNS:
+            code = self.columns[name][row]
+            cell[name] = self.dictionaries[name][code] if code >= 0 else None
+        cell["kokous_pvm"] = decode_date(self.columns["kokous_pvm"][row])
+        cell["page"] = self.columns["page"][row] or None
+        value = self.columns["value"][row]
+        cell["value"] = None if math.isnan(value) else value
+        start, end = self._value_offsets[row], self._value_offsets[row + 1]
+        cell["value_text"] = str(self._value_data[start:end], "utf-8")
+        return cell
+
+    def query(
+        self,
+        organisaatio: str | None = None,
+        year: int | str | None = None,
+        row_label: str | None = None,
+    ) -> array:
+        """
+        Hae solut tarkoilla suodattimilla.
+
+        Args:
+            organisaatio: Esim. "Hyvinvointilautakunta"
+            year: Kokousvuosi (esim. 2024)
+            row_label: Rivin otsikko (kirjainkoolla ei väliä, esim. "Toimintatuotot")
+
+        Returns:
+            Järjestetyt solujen rivinumerot (ilman suodattimia kaikki)
+        """
+        filters = {
+            "organisaatio": organisaatio,
+            "year": year,
+            "row_label": row_label.strip().lower() if row_label else None,
+        }
+        postings = [self.posting(field, value) for field, value in filters.items() if value is not None]
+        if not postings:
+            return array("I", range(self.rows))
+        return intersect_postings(postings)
+
+    def lookup(
+        self,
+        text: str,
+        limit: int | None = 50,
+        numeric_only: bool = True,
+        **filters: Any,
+    ) -> list[dict[str, Any]]:
+        """
+        Hae solut, jotka vastaavat kyselyn sanoja.
+
+        Jokainen sana voi osua rivin tai sarakkeen otsikkoon, kontekstiin,
+        organisaation nimeen tai kokousvuoteen. Palautetaan solut, jotka
+        vastaavat useinta sanaa (kaikkia, jos sellaisia on).
+
+        Args:
+            text: Kysely (esim. "toimintatuotot 2024 musiikkiopisto")
+            limit: Palautettavien solujen enimmäismäärä (None = kaikki)
+            numeric_only: Vain solut, joiden arvo on luku
+            **filters: query()-suodattimet (organisaatio, year, row_label)
+
+        Returns:
+            Solut (ks. get()) taulukon ja solun järjestyksessä
+        """
+        allowed = set(self.query(**filters)) if filters else None
+        terms = list(dict.fromkeys(tokenize(text)))
+        hits: Counter[int] = Counter()
+        for term in terms:
+            matched = set(self.posting("term", term))
+            matched.update(self.posting("organisaatio_term", term))
+            matched.update(self.posting("year", term))
+            for row in matched:
+                if allowed is None or row in allowed:
+                    hits[row] += 1
+
+        values = self.columns["value"]
+        if numeric_only:
+            hits = Counter({row: count for row, count in hits.items() if not math.isnan(values[row])})
+        if not hits:
+            return []
+        best = max(hits.values())
+        rows = sorted(row for row, count in hits.items() if count == best)
+        if limit is not None:
+            rows = rows[:limit]
+        return [self.get(row) for row in rows]
+
+    def close(self) -> None:
+        """Vapauta mmapit (vain load():lla avatulle indeksille)."""
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self.columns = {}
+        for mapped in self._mmaps:
+            mapped.close()
+        self._mmaps = []
+
+    def __enter__(self) -> "TableIndex":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+class TableIndexBuilder:
+    """
+    Rakentaa taulukkoindeksin taulukko kerrallaan.
+
+    Käyttö:
+        builder = TableIndexBuilder()
+        for table in iter_jsonl("tables_normalized.jsonl"):
+            builder.add_table(table)
+        builder.write("tables_normalized.tableindex")
+    """
+
+    def __init__(self, cells_dir: str | Path | None = None) -> None:
+        """
+        Args:
+            cells_dir: Hakemisto, johon taulukkorivien table_cells-polut ovat
+                       suhteellisia (ingestin output-kansio); None = solut
+                       jäsennetään aina tekstistä
+        """
+        self.cells_dir = Path(cells_dir) if cells_dir is not None else None
+        self.rows = 0
+        self.tables = 0
+        self.structured_tables = 0
+        self._sidecar: tuple[str, dict[str, dict[str, Any]]] | None = None
+        self._indexed_refs: set[tuple[str, str]] = set()
+        self._dictionaries: dict[str, dict[str, int]] = {name: {} for name in DICTIONARY_COLUMNS}
+        self._columns: dict[str, array] = {name: array("i") for name in DICTIONARY_COLUMNS}
+        self._columns.update({name: array(typecode) for name, typecode in NUMERIC_COLUMNS.items()})
+        self._value_data = bytearray()
+        self._value_offsets = array("q", [0])
+        self._postings: dict[str, dict[str, array]] = {
+            field: {} for field in INDEXED_FIELDS
+        }
+        self._term_cache: dict[str, list[str]] = {}
+
+    def _encode(self, name: str, value: str | None) -> int:
+        if value is None:
+            return -1
+        dictionary = self._dictionaries[name]
+        return dictionary.setdefault(value, len(dictionary))
+
+    def _terms(self, text: str | None) -> list[str]:
+        """Otsikon sanat (välimuistissa: samat otsikot toistuvat joka rivillä)."""
+        if not text:
+            return []
+        terms = self._term_cache.get(text)
+        if terms is None:
+            terms = self._term_cache[text] = tokenize(text)
+        return terms
+
+    def _post(self, field: str, value: str | None, row: int) -> None:
+        if value is None:
+            return
+        rows = self._postings[field].setdefault(value, array("I"))
+        if not rows or rows[-1] != row:
+            rows.append(row)
+
+    def _structured_cells(self, table: dict[str, Any]) -> list[dict[str, Any]] | None:
+        """
+        Taulukkorivin solut ingestin sivutiedostosta.
+
+        Sama Docling-taulukko voi jakautua useaan chunkkiin; se indeksoidaan
+        vain kerran (ensimmäisen chunkin kohdalla).
+
+        Returns:
+            Solut tai None, jos sivutiedostoa ei ole (jäsennetään tekstistä)
+        """
+        relative = table["table_cells"]
+        if self._sidecar is None or self._sidecar[0] != relative:
+            path = self.cells_dir / relative
+            if not path.exists():
+                _log.warning(f"Taulukkosivutiedostoa ei löydy, jäsennetään tekstistä: {path}")
+                return None
+            self._sidecar = (relative, {entry["ref"]: entry for entry in read_table_cells(path)})
+        tables_by_ref = self._sidecar[1]
+
+        context = table_context(table.get("text", ""))
+        cells = []
+        for ref in table["table_refs"]:
+            if ref not in tables_by_ref or (relative, ref) in self._indexed_refs:
+                continue
+            self._indexed_refs.add((relative, ref))
+            entry = tables_by_ref[ref]
+            for cell in labeled_cells(entry):
+                value, unit = parse_number(cell["text"])
+                cells.append({
+                    "context": entry["caption"] or context,
+                    "row_label": cell["row_label"],
+                    "column_label": cell["column_label"],
+                    "value_text": cell["text"],
+                    "value": value,
+                    "unit": unit,
+                    "page": cell["page"],
+                })
+        return cells
+
+    def add_table(self, table: dict[str, Any]) -> int:
+        """
+        Lisää seuraava taulukko (table_id = lisäysjärjestys).
+
+        Args:
+            table: tables_normalized.jsonl:n rivi
+
+        Returns:
+            Lisättyjen solujen määrä
+        """
+        table_id = self.tables
+        self.tables += 1
+        organisation = table.get("organisaatio")
+        date_value = encode_date(table.get("kokous_pvm"))
+        cells = None
+        if self.cells_dir is not None and table.get("table_cells") and table.get("table_refs"):
+            cells = self._structured_cells(table)
+        if cells is None:
+            cells = parse_table_cells(table.get("text", ""))
+        else:
+            self.structured_tables += 1
+        for cell in cells:
+            row = self.rows
+            self.rows += 1
+            self._columns["table_id"].append(table_id)
+            self._columns["kokous_pvm"].append(date_value)
+            self._columns["value"].append(math.nan if cell["value"] is None else cell["value"])
+            self._columns["page"].append(cell.get("page") or 0)
+            self._columns["source_file"].append(self._encode("source_file", table.get("source_file")))
+            self._columns["organisaatio"].append(self._encode("organisaatio", organisation))
+            for name in ("context", "row_label", "column_label", "unit"):
+                self._columns[name].append(self._encode(name, cell[name] or None))
+            self._value_data += cell["value_text"].encode("utf-8")
+            self._value_offsets.append(len(self._value_data))
+
+            self._post("organisaatio", organisation, row)
+            self._post("year", _year(date_value), row)
+            self._post("row_label", cell["row_label"].lower() or None, row)
+            for term in self._terms(organisation):
+                self._post("organisaatio_term", term, row)
+            for text in (cell["row_label"], cell["column_label"], cell["context"]):
+                for term in self._terms(text):
+                    self._post("term", term, row)
+        return len(cells)
+
+    def build(self) -> TableIndex:
+        """Palauta muistissa oleva indeksi."""
+        return TableIndex(
+            self.rows,
+            self.tables,
+            {name: list(dictionary) for name, dictionary in self._dictionaries.items()},
+            self._columns,
+            bytes(self._value_data),
+            self._value_offsets,
+            self._postings,
+        )
+
+    def write(self, path: str | Path) -> None:
+        """
+        Kirjoita indeksi hakemistoon atomisesti (ks. atomic_dir).
+
+        Args:
+            path: Output-hakemisto
+        """
+        with atomic_directory(path) as staging:
+            for name, values in self._columns.items():
+                with (staging / f"{name}.bin").open("wb") as f:
+                    values.tofile(f)
+            with (staging / "value_text.data").open("wb") as f:
+                f.write(self._value_data)
+            with (staging / "value_text.offsets").open("wb") as f:
+                self._value_offsets.tofile(f)
+
+            offset = 0
+            fields: dict[str, dict[str, list[int]]] = {}
+            with (staging / "postings.bin").open("wb") as f:
+                for field, values in self._postings.items():
+                    fields[field] = {}
+                    for value, rows in values.items():
+                        rows.tofile(f)
+                        fields[field][value] = [offset, len(rows)]
+                        offset += len(rows)
+
+            manifest = {
+                "version": INDEX_VERSION,
+                "rows": self.rows,
+                "tables": self.tables,
+                "byteorder": sys.byteorder,
+                # Sanakirjat koodijärjestyksessä (koodi = listan indeksi)
+                "dictionaries": {name: list(dictionary) for name, dictionary in self._dictionaries.items()},
+                "fields": fields,
+            }
+            with (staging / "manifest.json").open("w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def build_table_index(
+    tables_jsonl: str | Path,
+    output_dir: str | Path,
+    cells_dir: str | Path | None = None,
+) -> TableIndexBuilder:
+    """
+    Rakenna taulukkoindeksi tables_normalized.jsonl:stä.
+
+    Args:
+        tables_jsonl: Polku tables_normalized.jsonl-tiedostoon
+        output_dir: Indeksin hakemisto
+        cells_dir: Taulukkosivutiedostojen juurihakemisto
+                   (oletus: tables_jsonl:n hakemisto)
+
+    Returns:
+        Builder (taulukoiden ja solujen määrät: tables, rows)
+    """
+    builder = TableIndexBuilder(cells_dir if cells_dir is not None else Path(tables_jsonl).parent)
+    for table in iter_jsonl(tables_jsonl):
+        builder.add_table(table)
+    builder.write(output_dir)
+    return builder
+
+
+def main():
+    """Pääfunktio."""
+    if len(sys.argv) > 1:
+        base_dir = Path(sys.argv[1])
+    else:
+        default_dir = Path("106PDF_output")
+        base_dir = default_dir if default_dir.exists() else Path(os.getenv("LAPUA_RAG_OUTPUT_DIR", "."))
+
+    tables_jsonl = base_dir / "tables_normalized.jsonl"
+    index_dir = base_dir / "tables_normalized.tableindex"
+
+    if len(sys.argv) <= 2:
+        _log.info(f"Rakennetaan taulukkoindeksi: {tables_jsonl}")
+        builder = build_table_index(tables_jsonl, index_dir)
+        numeric = sum(1 for value in builder._columns["value"] if not math.isnan(value))
+        _log.info(
+            f"✅ Taulukkoindeksi tallennettu: {index_dir} "
+            f"({builder.tables} taulukkoa, {builder.rows} solua, {numeric} numeerista)"
+        )
+        return
+
+    with TableIndex.load(index_dir) as index:
+        for cell in index.lookup(sys.argv[2], limit=20):
+            print(
+                f"{cell['organisaatio']} {cell['kokous_pvm']} [{cell['context'] or '-'}] "
+                f"{cell['row_label']} | {cell['column_label']} = {cell['value_text']} "
+                f"({cell['value']})"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,9 @@ import sys
 from pathlib import Path
 from typing import Any
 
+from chunk_store import ColumnarChunkStore
+from metadata_index import MetadataIndex
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(levelname)s - %(message)s",
@@ -23,9 +26,14 @@ _log = logging.getLogger(__name__)
 
 
 def load_normalized_chunks(json_path: str | Path) -> list[dict[str, Any]]:
-    """Lataa normalisoidut chunkit."""
+    """Lataa normalisoidut chunkit (normalized_chunks.json, .jsonl tai .colstore)."""
     path = Path(json_path)
+    if path.is_dir():
+        with ColumnarChunkStore(path) as store:
+            return list(store)
     with path.open("r", encoding="utf-8") as f:
+        if path.suffix == ".jsonl":
+            return [json.loads(line) for line in f if line.strip()]
         data = json.load(f)
     return data.get("chunks", [])
 
@@ -119,8 +127,16 @@ def test_metadata_coverage(chunks: list[dict[str, Any]]) -> None:
         _log.info(f"  {st}: {count} ({count/total*100:.1f}%)")
 
 
-def test_sample_queries(chunks: list[dict[str, Any]]) -> None:
-    """Testaa esimerkkihaut oikeilla kysymyksillä."""
+def test_sample_queries(chunks: list[dict[str, Any]], index: MetadataIndex | None = None) -> None:
+    """
+    Testaa esimerkkihaut oikeilla kysymyksillä.
+
+    Suodatinhaut tehdään metatietoindeksillä (rakennetaan chunkeista, jos
+    valmista indeksiä ei anneta).
+    """
+    if index is None:
+        index = MetadataIndex.from_chunks(chunks)
+
     _log.info("\n" + "="*60)
     _log.info("Testataan esimerkkihaut oikeilla kysymyksillä...")
     _log.info("="*60 + "\n")
@@ -129,12 +145,7 @@ def test_sample_queries(chunks: list[dict[str, Any]]) -> None:
     # HUOM: Löysennetty logiikka - pykälä ja päätös voivat olla eri chunkeissa
     _log.info("Testi 1: 'Etsi kaikki § 81 päätökset 2025'")
     _log.info("  (Löysennetty: § 81 + vuosi 2025, section_type ei pakollinen)")
-    query1_chunks = [
-        c
-        for c in chunks
-        if c.get("pykala") == "§ 81"
-        and c.get("kokous_pvm", "").startswith("2025")
-    ]
+    query1_chunks = [chunks[row] for row in index.query(pykala="§ 81", year=2025)]
     _log.info(f"  Löytyi {len(query1_chunks)} chunkkia")
     
     # Tarkista että jokaisen löytyneen chunkin pykala on § 81 ja vuosi 2025
@@ -155,11 +166,8 @@ def test_sample_queries(chunks: list[dict[str, Any]]) -> None:
     _log.info("\nTesti 2: 'Kaupunginhallitus 2025 + päätös'")
     org = "Kaupunginhallitus"
     query2_chunks = [
-        c
-        for c in chunks
-        if c.get("organisaatio") == org
-        and c.get("kokous_pvm", "").startswith("2025")
-        and c.get("section_type") == "paatos"
+        chunks[row]
+        for row in index.query(organisaatio=org, year=2025, section_type="paatos")
     ]
     _log.info(f"  Löytyi {len(query2_chunks)} chunkkia")
     
@@ -177,7 +185,7 @@ def test_sample_queries(chunks: list[dict[str, Any]]) -> None:
 
     # Testi 3: Etsi tietty organisaatio (yleinen)
     _log.info("\nTesti 3: Etsi kaikki Kaupunginhallituksen chunkit")
-    org_chunks = [c for c in chunks if c.get("organisaatio") == org]
+    org_chunks = [chunks[row] for row in index.query(organisaatio=org)]
     _log.info(f"  Löytyi {len(org_chunks)} chunkkia")
     if org_chunks:
         sample = random.choice(org_chunks)
@@ -186,7 +194,7 @@ def test_sample_queries(chunks: list[dict[str, Any]]) -> None:
     # Testi 4: Etsi tietty pykälä (yleinen)
     _log.info("\nTesti 4: Etsi kaikki § 81 chunkit (riippumatta vuodesta)")
     section = "§ 81"
-    section_chunks = [c for c in chunks if c.get("pykala") == section]
+    section_chunks = [chunks[row] for row in index.query(pykala=section)]
     _log.info(f"  Löytyi {len(section_chunks)} chunkkia")
     if section_chunks:
         sample = random.choice(section_chunks)
@@ -248,7 +256,13 @@ def main():
 
     test_sample_chunks(chunks, count=5)
     test_metadata_coverage(chunks)
-    test_sample_queries(chunks)
+    # Käytä postiprosessoinnin kirjoittamaa indeksiä, jos se on olemassa
+    index_path = Path(json_path).parent / "normalized_chunks.metaindex"
+    if index_path.exists():
+        with MetadataIndex.load(index_path) as index:
+            test_sample_queries(chunks, index)
+    else:
+        test_sample_queries(chunks)
 
     _log.info("\n✅ Kaikki testit suoritettu!")
 
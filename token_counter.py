@@ -0,0 +1,165 @@
+"""
+Tokenizer-pohjainen token-laskenta chunkkien koon määritykseen.
+
+Tämä moduuli:
+- Laskee tokenit samalla HuggingFace-tokenizerilla kuin ingest-vaiheen
+  HybridChunker ja embedding-malli (ilman erikoistokeneita, kuten Doclingin
+  HuggingFaceTokenizer.count_tokens)
+- Laskee erät yhdellä encode_batch-kutsulla (Rust-toteutus, rinnakkainen)
+- Välimuistittaa määrät tekstin tarkan SHA1:n mukaan (ei normalisoitua
+  chunk-hashia: kirjainkoko ja välilyönnit vaikuttavat tokeneihin), joten
+  sama teksti tokenisoidaan vain kerran; välimuistin voi tallentaa levylle,
+  jolloin uusintaajot eivät tokenisoi muuttumattomia chunkkeja uudelleen
+
+Käyttö:
+    counter = TokenCounter.from_pretrained(
+        "sentence-transformers/all-MiniLM-L6-v2",
+        cache_dir="106PDF_output/token_cache",
+    )
+    counter.count_batch(texts)   # esilaskenta erissä
+    tokens = counter.count(text)
+    counter.save()
+"""
+
+import hashlib
+import json
+import logging
+import re
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Any
+
+_log = logging.getLogger(__name__)
+
+# Konfiguraatiovakiot
+TOKEN_CACHE_VERSION = 2  # 2: avain on tekstin tarkka SHA1 (1: normalisoitu hash)
+
+_UNSAFE_NAME_PATTERN = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+def text_key(text: str) -> str:
+    """Välimuistin avain: tekstin tarkka SHA1 (ei normalisointia)."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class TokenCounter:
+    """
+    Token-määrät HuggingFace-tokenizerilla, välimuistitettuna tekstin hashin mukaan.
+
+    Voidaan välittää työprosesseihin (pickle): tokenizer ja välimuisti
+    kopioidaan kerran per prosessi.
+    """
+
+    def __init__(self, tokenizer: Any, name: str, cache_path: str | Path | None = None) -> None:
+        """
+        Args:
+            tokenizer: transformers-tokenizer (PreTrainedTokenizer tai -Fast)
+            name: Tokenizerin tunniste (välimuistin avain, esim. mallin ID)
+            cache_path: Levyvälimuistin JSON-tiedosto (None = vain muistissa)
+        """
+        self.tokenizer = tokenizer
+        self.name = name
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.counts: dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        if self.cache_path is not None and self.cache_path.exists():
+            self._load()
+
+    @classmethod
+    def from_pretrained(cls, model_id: str, cache_dir: str | Path | None = None) -> "TokenCounter":
+        """
+        Lataa tokenizer mallin ID:llä tai paikallisesta hakemistosta.
+
+        Args:
+            model_id: HuggingFace-mallin ID (sama kuin embedding-mallilla)
+            cache_dir: Hakemisto levyvälimuistille (tiedosto <model_id>.json)
+
+        Returns:
+            TokenCounter-instanssi
+        """
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(model_id)
+        cache_path = None
+        if cache_dir is not None:
+            cache_path = Path(cache_dir) / f"{_UNSAFE_NAME_PATTERN.sub('_', model_id).strip('_')}.json"
+        _log.info(f"Token-laskenta tokenizerilla: {model_id}")
+        return cls(tokenizer, model_id, cache_path)
+
+    def _load(self) -> None:
+        """Lue levyvälimuisti (ohitetaan, jos tokenizer tai versio on eri)."""
+        with self.cache_path.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != TOKEN_CACHE_VERSION or data.get("tokenizer") != self.name:
+            _log.warning(f"Token-välimuisti on eri tokenizerille tai versiolle, ohitetaan: {self.cache_path}")
+            return
+        self.counts = data["counts"]
+        _log.info(f"Token-välimuisti ladattu: {len(self.counts)} chunkkia ({self.cache_path})")
+
+    def save(self) -> None:
+        """Tallenna välimuisti levylle (jos cache_path on annettu)."""
+        if self.cache_path is None:
+            return
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.cache_path.with_suffix(".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump({"version": TOKEN_CACHE_VERSION, "tokenizer": self.name, "counts": self.counts}, f)
+        tmp_path.replace(self.cache_path)
+
+    def _encode_lengths(self, texts: list[str]) -> list[int]:
+        """Tokenisoi erä ja palauta pituudet (ilman erikoistokeneita)."""
+        backend = getattr(self.tokenizer, "backend_tokenizer", None)
+        if backend is not None:
+            # Fast-tokenizer: suoraan Rust-toteutukselle, ei pituusvaroituksia
+            return [len(encoding.ids) for encoding in backend.encode_batch(texts, add_special_tokens=False)]
+        return [len(self.tokenizer.tokenize(text)) for text in texts]
+
+    def remember(self, text: str, tokens: int) -> None:
+        """
+        Tallenna muualla (esim. työprosessissa) samalla tokenizerilla laskettu määrä.
+
+        Args:
+            text: Täsmälleen tokenisoitu teksti
+            tokens: Sen token-määrä (ei arvio)
+        """
+        self.counts[text_key(text)] = tokens
+
+    def count(self, text: str) -> int:
+        """
+        Tekstin token-määrä (välimuistista, jos sama teksti on jo laskettu).
+
+        Args:
+            text: Teksti
+
+        Returns:
+            Tokenien määrä
+        """
+        key = text_key(text)
+        tokens = self.counts.get(key)
+        if tokens is not None:
+            self.hits += 1
+            return tokens
+        self.misses += 1
+        tokens = self.counts[key] = self._encode_lengths([text])[0]
+        return tokens
+
+    def count_batch(self, texts: Sequence[str]) -> list[int]:
+        """
+        Token-määrät erälle; vain välimuistista puuttuvat tokenisoidaan (yhdellä kutsulla).
+
+        Args:
+            texts: Tekstit
+
+        Returns:
+            Tokenien määrät tekstien järjestyksessä
+        """
+        keys = [text_key(text) for text in texts]
+        missing = [i for i, key in enumerate(keys) if key not in self.counts]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            lengths = self._encode_lengths([texts[i] for i in missing])
+            for i, tokens in zip(missing, lengths):
+                self.counts[keys[i]] = tokens
+        return [self.counts[key] for key in keys]